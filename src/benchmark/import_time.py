@@ -0,0 +1,96 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# 計測対象のモジュール（前処理・特徴量作成だけを行う段階ではSeleniumを読み込まない）
+PREPROCESSING_MODULES = (
+    "src.config",
+    "src.preprocessing.modules.preprocessing_proc",
+    "src.preprocessing.modules.create_race_info",
+    "src.preprocessing.modules.feature_setting",
+    "src.preprocessing.main2",
+)
+SCRAPING_MODULES = ("src.preprocessing.modules.get_raw_data",)
+# 読み込まれたかどうかを確認する重いライブラリ
+HEAVY_MODULES = ("selenium", "webdriver_manager", "bs4", "pyarrow")
+# 前処理の段階で読み込まれてはいけないライブラリ
+FORBIDDEN_MODULES = ("selenium", "webdriver_manager")
+
+_MEASURE_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure_import(module: str, repeat: int = 3) -> dict:
+    """
+    新しいPythonプロセスでモジュールをimportし、所要時間と読み込まれた重いライブラリを計測する。
+
+    Args:
+        module (str): 計測するモジュール名。
+        repeat (int, optional): 計測回数。所要時間は最小値を採用する。
+
+    Returns:
+        dict: `module`、`seconds`、`loaded`（読み込まれた`HEAVY_MODULES`）を持つ辞書。
+    """
+    code = _MEASURE_CODE.format(module=module, heavy=HEAVY_MODULES)
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "module": module,
+        "seconds": min(result["seconds"] for result in results),
+        "loaded": results[0]["loaded"],
+    }
+
+
+def run(modules=None, repeat: int = 3) -> list:
+    """
+    モジュール毎のimport時間を計測し、表形式で出力する。
+
+    前処理のモジュールが`FORBIDDEN_MODULES`を読み込んでいた場合はその旨を出力する。
+
+    Returns:
+        list: `measure_import`の結果のリスト。
+    """
+    if modules is None:
+        modules = PREPROCESSING_MODULES + SCRAPING_MODULES
+    results = [measure_import(module, repeat) for module in modules]
+    for result in results:
+        violations = (
+            [name for name in result["loaded"] if name in FORBIDDEN_MODULES]
+            if result["module"] in PREPROCESSING_MODULES
+            else []
+        )
+        result["violations"] = violations
+        print(
+            f"{result['module']:<50} {result['seconds']:7.3f}s  "
+            f"loaded={','.join(result['loaded']) or '-'}"
+            + (f"  NG: {','.join(violations)}" if violations else "")
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="import時間の計測")
+    parser.add_argument(
+        "modules", nargs="*", help="計測するモジュール（省略時は既定の一覧）"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数")
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+    results = run(args.modules or None, args.repeat)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if any(result["violations"] for result in results) else 0)
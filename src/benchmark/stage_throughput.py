@@ -0,0 +1,319 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from src.metrics import peak_rss_bytes
+
+# 生成するデータの規模（開催日数。1日あたり2場×12レース）
+SCALES = {
+    "small": {"n_days": 4},
+    "medium": {"n_days": 24},
+    "large": {"n_days": 104},
+}
+# 計測する段階（この順に実行する）
+STAGES = (
+    "parse_race_id_list",
+    "create_race_result",
+    "create_horse_result",
+    "create_race_info_transformed",
+    "create_race_info_preprocessing",
+    "process_race_results",
+    "process_horse_results",
+    "create_features",
+)
+# 計測値の比較に使う指標（大きいほど悪い）
+COMPARED_METRICS = ("seconds", "peak_rss_bytes")
+# 計測のばらつきとみなす差（これ以下の悪化は割合に関わらず無視する）
+NOISE_FLOOR = {"seconds": 0.1, "peak_rss_bytes": 16 * 1024**2}
+DEFAULT_THRESHOLD = 0.2
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+
+def _generate(workdir: str, scale: dict, seed: int) -> dict:
+    os.chdir(workdir)
+    from src.benchmark.synthetic_pages import generate_races, write_archives
+
+    races = generate_races(seed=seed, **scale)
+    return write_archives(races, seed)
+
+
+def _prepare_stage(name: str):
+    """
+    段階の処理と、処理したページ数・出力テーブル名を返す（計測前の準備はここで行う）。
+
+    Returns:
+        tuple: `(処理, ページ数, 出力テーブル名)`。処理は行数を返すか、出力テーブルに保存する。
+    """
+    from src.config import (
+        HTML_HORSE_PACK,
+        HTML_RACE_PACK,
+        FEATURES_TABLE,
+        HORSE_RESULTS_TABLE,
+        PREPROCESSED_HORSE_RESULTS_TABLE,
+        PREPROCESSED_RACE_RESULTS_TABLE,
+        RACE_INFO_PREPROCESSING_TABLE,
+        RACE_INFO_TRANSFORMED_TABLE,
+        RACE_RESULTS_TABLE,
+        HtmlArchive,
+    )
+
+    if name == "parse_race_id_list":
+        from src.benchmark.synthetic_pages import race_list_page
+        from src.preprocessing.modules.scrape_race_id_list import parse_race_id_list
+
+        # 開催日・競馬場毎のレース一覧
+        groups = {}
+        for race_id in HtmlArchive(HTML_RACE_PACK).ids():
+            groups.setdefault(race_id[:10], []).append(race_id)
+        pages = [race_list_page(race_id_list) for race_id_list in groups.values()]
+        return (
+            lambda: sum(len(parse_race_id_list(page)) for page in pages),
+            len(pages),
+            None,
+        )
+    if name == "create_race_result":
+        from src.preprocessing.modules.create_race_result import create_race_result
+
+        return (
+            lambda: create_race_result(incremental=False),
+            len(HtmlArchive(HTML_RACE_PACK)),
+            RACE_RESULTS_TABLE,
+        )
+    if name == "create_horse_result":
+        from src.preprocessing.modules.create_horse_result import create_horse_result
+
+        return (
+            lambda: create_horse_result(incremental=False),
+            len(HtmlArchive(HTML_HORSE_PACK)),
+            HORSE_RESULTS_TABLE,
+        )
+    if name == "create_race_info_transformed":
+        from src.preprocessing.modules.create_race_info import (
+            create_race_info_transformed,
+        )
+
+        return create_race_info_transformed, None, RACE_INFO_TRANSFORMED_TABLE
+    if name == "create_race_info_preprocessing":
+        from src.preprocessing.modules.create_race_info import (
+            create_race_info_preprocessing,
+        )
+
+        return create_race_info_preprocessing, None, RACE_INFO_PREPROCESSING_TABLE
+    if name == "process_race_results":
+        from src.preprocessing.modules.process_race_results import process_race_results
+
+        return process_race_results, None, PREPROCESSED_RACE_RESULTS_TABLE
+    if name == "process_horse_results":
+        from src.preprocessing.modules.process_horse_results import (
+            process_horse_results,
+        )
+
+        return process_horse_results, None, PREPROCESSED_HORSE_RESULTS_TABLE
+    if name == "create_features":
+        from src.preprocessing.modules.feature_setting import FeatureCreator
+
+        return (lambda: FeatureCreator().create_features()), None, FEATURES_TABLE
+    raise ValueError(f"unknown stage: {name}")
+
+
+def _measure_stage(workdir: str, name: str) -> dict:
+    """
+    作業ディレクトリで段階を1つ実行し、経過時間・CPU時間・最大常駐メモリ・処理量を計測する。
+    """
+    os.chdir(workdir)
+    func, pages, table = _prepare_stage(name)
+    start_rss = peak_rss_bytes()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    rows = func()
+    seconds = time.perf_counter() - start_wall
+    cpu_seconds = time.process_time() - start_cpu
+    peak_rss = peak_rss_bytes()
+    from src.config import metrics, table_store
+
+    # 段階内で記録された件数・バイト数・処理時間のヒストグラム
+    stage_metrics = metrics.snapshot()
+    if table is not None:
+        rows = len(table_store.read(table))
+    result = {
+        "stage": name,
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "start_rss_bytes": start_rss,
+        "peak_rss_bytes": peak_rss,
+        "rows": rows,
+        "rows_per_sec": rows / seconds if seconds > 0 else None,
+    }
+    if pages is not None:
+        result["pages"] = pages
+        result["pages_per_sec"] = pages / seconds if seconds > 0 else None
+    result["counters"] = stage_metrics["counters"]
+    result["histograms"] = stage_metrics["histograms"]
+    return result
+
+
+def _child_main(queue, target, args):
+    try:
+        queue.put(("ok", target(*args)))
+    except BaseException as e:
+        queue.put(("error", repr(e)))
+
+
+def _run_in_child(target, *args):
+    """
+    新しいPythonプロセスで関数を実行して結果を返す。段階毎に最大常駐メモリを分けて計測するために使う。
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child_main, args=(queue, target, args))
+    process.start()
+    status, value = queue.get()
+    process.join()
+    if status != "ok":
+        raise RuntimeError(f"{getattr(target, '__name__', target)}: {value}")
+    return value
+
+
+def run(scale: str = "small", stages=None, workdir: str = None, seed: int = 0) -> dict:
+    """
+    合成したページからアーカイブを作り、各段階のスループットを計測する。
+
+    データは`workdir`（省略時は一時ディレクトリ）の`data/`以下に作成するため、
+    実際のデータやnetkeibaには触れない。段階は`STAGES`の順に、それぞれ新しいプロセスで実行する。
+
+    Args:
+        scale (str, optional): `SCALES`のキー。
+        stages (list, optional): 計測する段階。省略時は`STAGES`のすべて。
+            指定した段階の入力は、それより前の段階を計測せずに実行して用意する。
+        workdir (str, optional): 作業ディレクトリ。
+        seed (int, optional): データ生成の乱数のシード。
+
+    Returns:
+        dict: `scale`、`environment`、`generated`、`stages`（段階毎の計測結果のリスト）を持つ辞書。
+    """
+    selected = list(STAGES) if not stages else list(stages)
+    for name in selected:
+        if name not in STAGES:
+            raise ValueError(f"unknown stage: {name}")
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="horse_racing_bench_")
+    workdir = str(Path(workdir).resolve())
+    Path(workdir).mkdir(parents=True, exist_ok=True)
+
+    generated = _run_in_child(_generate, workdir, SCALES[scale], seed)
+    print(
+        f"generated: {generated['races']} races, {generated['horses']} horses "
+        f"({generated['bytes'] / 1024**2:.1f} MiB) in {workdir}"
+    )
+    results = []
+    last = max(STAGES.index(name) for name in selected)
+    for name in STAGES[: last + 1]:
+        result = _run_in_child(_measure_stage, workdir, name)
+        if name not in selected:
+            continue
+        results.append(result)
+        throughput = (
+            f"{result['pages_per_sec']:9.1f} pages/s"
+            if "pages_per_sec" in result
+            else " " * 16
+        )
+        print(
+            f"{name:<32} {result['seconds']:8.2f}s {result['rows_per_sec'] or 0:11.0f} rows/s "
+            f"{throughput} peak {result['peak_rss_bytes'] / 1024**2:8.1f} MiB"
+        )
+    return {
+        "scale": scale,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "generated": generated,
+        "stages": results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD):
+    """
+    計測結果を基準値と比べ、`threshold`の割合を超えて悪化した指標を返す。
+    差が`NOISE_FLOOR`以下のものは計測のばらつきとみなして除く。
+
+    Returns:
+        list: `(段階名, 指標, 基準値, 計測値)`のリスト。
+    """
+    baseline_stages = {result["stage"]: result for result in baseline["stages"]}
+    regressions = []
+    for result in results["stages"]:
+        base = baseline_stages.get(result["stage"])
+        if base is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if not base.get(metric):
+                continue
+            increase = result[metric] - base[metric]
+            if increase > base[metric] * threshold and increase > NOISE_FLOOR[metric]:
+                regressions.append(
+                    (result["stage"], metric, base[metric], result[metric])
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    """
+    例:
+        python -m src.benchmark.stage_throughput --scale medium --json result.json
+        python -m src.benchmark.stage_throughput --scale medium --save-baseline
+        python -m src.benchmark.stage_throughput --scale medium --threshold 0.3
+    """
+    parser = argparse.ArgumentParser(description="前処理の各段階のスループットの計測")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="データの規模")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, help="計測する段階")
+    parser.add_argument(
+        "--workdir", help="作業ディレクトリ（省略時は一時ディレクトリ）"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="データ生成の乱数のシード")
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    parser.add_argument(
+        "--baseline",
+        help="比較する基準値のJSONファイル（省略時は`baselines/[規模].json`があれば使う）",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="結果を基準値として保存する"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="悪化とみなす割合（0.2で20%%）",
+    )
+    args = parser.parse_args()
+
+    results = run(args.scale, args.stages, args.workdir, args.seed)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    baseline_path = (
+        Path(args.baseline) if args.baseline else BASELINE_DIR / f"{args.scale}.json"
+    )
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"baseline saved: {baseline_path}")
+        sys.exit(0)
+    if not baseline_path.is_file():
+        sys.exit(0)
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    for stage, metric, base, value in regressions:
+        print(
+            f"NG: {stage} {metric} {base:.3g} -> {value:.3g} (+{value / base - 1:.0%})"
+        )
+    sys.exit(1 if regressions else 0)
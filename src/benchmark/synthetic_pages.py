@@ -0,0 +1,305 @@
+import random
+from datetime import date, timedelta
+
+from src.config import *
+
+# ページの文字コード（netkeibaのデータベースのページと同じ）
+PAGE_ENCODING = "EUC-JP"
+
+PLACES = [
+    "札幌",
+    "函館",
+    "福島",
+    "新潟",
+    "東京",
+    "中山",
+    "中京",
+    "京都",
+    "阪神",
+    "小倉",
+]
+WEATHERS = ["晴", "晴", "晴", "曇", "曇", "雨", "小雨", "雪"]
+GROUND_STATES = ["良", "良", "良", "稍重", "重", "不良"]
+COURSE_LENS = {
+    "芝": [1200, 1400, 1600, 1800, 2000, 2400],
+    "ダ": [1000, 1200, 1400, 1800],
+}
+RACE_CLASSES = [
+    "3歳未勝利",
+    "2歳新馬",
+    "3歳以上1勝クラス",
+    "3歳以上2勝クラス",
+    "3歳以上オープン",
+]
+RACE_NAME_CLASSES = [
+    "未勝利",
+    "新馬",
+    "1勝クラス",
+    "2勝クラス",
+    "3勝クラス",
+    "オープン",
+    "(G3)",
+    "(G2)",
+    "(G1)",
+    "特別",
+]
+SEXES = ["牡", "牝", "セ"]
+HORSE_RESULTS_HEADER = [
+    "日付", "開催", "天気", "R", "レース名", "映像", "頭数", "枠番", "馬番", "オッズ", "人気",
+    "着順", "騎手", "斤量", "距離", "馬場", "馬場指数", "タイム", "着差", "ﾀｲﾑ指数", "通過",
+    "ペース", "上り", "馬体重", "厩舎ｺﾒﾝﾄ", "備考", "勝ち馬(2着馬)", "賞金",
+]  # fmt: skip
+
+
+def _page(body: str) -> bytes:
+    return (
+        f'<html><head><meta http-equiv="Content-Type" content="text/html; charset={PAGE_ENCODING}">'
+        f"</head><body>{body}</body></html>"
+    ).encode(PAGE_ENCODING)
+
+
+def _race_time(rng: random.Random, course_len: int) -> str:
+    seconds = course_len / 16.5 + rng.uniform(-1.5, 3.0)
+    return f"{int(seconds // 60)}:{seconds % 60:04.1f}"
+
+
+def race_page(race: dict, rng: random.Random) -> bytes:
+    """
+    レース結果のページ（db.netkeiba.comの`/race/[レースID]`）を模したHTMLを返す。
+
+    Args:
+        race (dict): `generate_races`が返すレースの情報。
+        rng (random.Random): 乱数生成器。
+    """
+    rows = []
+    n_horses = len(race["entries"])
+    for rank, entry in enumerate(race["entries"], start=1):
+        umaban = entry["umaban"]
+        wakuban = min(8, (umaban - 1) * 8 // n_horses + 1)
+        rank_text = rank if rng.random() > 0.01 else rng.choice(["中", "除", "取"])
+        weight = rng.randint(400, 540)
+        rows.append(
+            "<tr>"
+            f"<td>{rank_text}</td><td>{wakuban}</td><td>{umaban}</td>"
+            f'<td><a href="/horse/{entry["horse_id"]}/" title="">ウマ{entry["horse_id"][-5:]}</a></td>'
+            f"<td>{rng.choice(SEXES)}{rng.randint(2, 8)}</td><td>{rng.choice([54, 55, 56, 57, 58])}</td>"
+            f'<td><a href="/jockey/result/recent/{entry["jockey_id"]}/">騎手</a></td>'
+            f"<td>{_race_time(rng, race['course_len'])}</td>"
+            f"<td>{'' if rank == 1 else rng.choice(['ハナ', 'アタマ', 'クビ', '1/2', '1', '2', '大'])}</td>"
+            f"<td>{rng.uniform(1.1, 300.0):.1f}</td><td>{entry['popularity']}</td>"
+            f"<td>{weight}({rng.randint(-12, 12):+d})</td>"
+            f'<td>[{rng.choice(["東", "西"])}] <a href="/trainer/result/recent/{entry["trainer_id"]}/">調教師</a></td>'
+            f'<td><a href="/owner/result/recent/{entry["owner_id"]}/">馬主</a></td>'
+            "</tr>"
+        )
+    ground_label = "芝" if race["race_type"] == "芝" else "ダート"
+    day = race["date"]
+    body = (
+        '<div class="data_intro"><dl class="racedata fc"><dd>'
+        f"<h1>{race['title']}</h1>"
+        f"<p><diary_snap><span>{race['race_type']}{race['around']}{race['course_len']}m"
+        f" / 天候 : {race['weather']} / {ground_label} : {race['ground_state']}"
+        f" / 発走 : {rng.randint(10, 16)}:{rng.choice(['05', '25', '45'])}</span></diary_snap></p>"
+        "</dd></dl>"
+        f'<p class="smalltxt">{day.year}年{day.month}月{day.day}日 '
+        f"{race['kai']}回{race['place']}{race['nichi']}日目 {race['race_class']}  (混)[指](馬齢)</p></div>"
+        '<table class="race_table_01 nk_tb_common" summary="レース結果">'
+        "<tr><th>着 順</th><th>枠 番</th><th>馬 番</th><th>馬名</th><th>性齢</th><th>斤量</th>"
+        "<th>騎手</th><th>タイム</th><th>着差</th><th>単勝</th><th>人 気</th><th>馬体重</th>"
+        "<th>調教師</th><th>馬主</th></tr>" + "".join(rows) + "</table>"
+        '<table class="pay_table_01"><tr><th>単勝</th><td>1</td><td>100</td></tr></table>'
+    )
+    return _page(body)
+
+
+def horse_page(horse_id: str, history: list, rng: random.Random) -> bytes:
+    """
+    馬のページ（db.netkeiba.comの`/horse/[馬ID]`）を模したHTMLを返す。
+    競走成績は3番目の<table>に、日付の新しい順に並べる。
+
+    Args:
+        horse_id (str): 馬ID。
+        history (list): 出走したレースの情報のリスト。
+        rng (random.Random): 乱数生成器。
+    """
+    rows = []
+    for race in sorted(history, key=lambda race: race["date"], reverse=True):
+        day = race["date"]
+        n_horses = rng.randint(8, 18)
+        rank = rng.randint(1, n_horses)
+        prize = f"{rng.uniform(100, 5000):.1f}" if rank <= 5 else ""
+        values = [
+            day.strftime("%Y/%m/%d"),
+            f"{race['kai']}{race['place']}{race['nichi']}",
+            race["weather"],
+            race["race_number"],
+            f"テスト{rng.choice(RACE_NAME_CLASSES)}",
+            "",
+            n_horses,
+            rng.randint(1, 8),
+            rng.randint(1, n_horses),
+            f"{rng.uniform(1.1, 300.0):.1f}",
+            rng.randint(1, n_horses),
+            rank if rng.random() > 0.02 else rng.choice(["中", "除", "取"]),
+            "騎手",
+            rng.choice([54, 55, 56, 57, 58]),
+            f"{race['race_type']}{race['course_len']}",
+            race["ground_state"][0],
+            "**",
+            _race_time(rng, race["course_len"]),
+            f"{rng.uniform(-1.0, 3.0):.1f}",
+            "**",
+            "1-1",
+            "35.0-36.0",
+            f"{rng.uniform(33.0, 40.0):.1f}",
+            f"{rng.randint(400, 540)}({rng.randint(-12, 12):+d})",
+            "",
+            "",
+            "ウマ",
+            prize,
+        ]
+        rows.append("<tr>" + "".join(f"<td>{value}</td>" for value in values) + "</tr>")
+    header = "<tr>" + "".join(f"<th>{c}</th>" for c in HORSE_RESULTS_HEADER) + "</tr>"
+    body = (
+        f'<div class="horse_title"><h1>ウマ{horse_id[-5:]}</h1></div>'
+        '<table class="db_prof_table"><tr><th>生年月日</th><td>-</td></tr></table>'
+        '<table class="blood_table"><tr><td>父</td></tr></table>'
+        f'<table class="db_h_race_results nk_tb_common">{header}{"".join(rows)}</table>'
+    )
+    return _page(body)
+
+
+def calendar_page(kaisai_date_list: list) -> bytes:
+    """
+    開催日カレンダー（race.netkeiba.comの`/top/calendar.html`）を模したHTMLを返す。
+    """
+    links = "".join(
+        f'<td class="RaceCellBox"><a href="../top/race_list.html?kaisai_date={kaisai_date}">'
+        f"{int(kaisai_date[-2:])}</a></td>"
+        for kaisai_date in kaisai_date_list
+    )
+    return _page(f'<table class="Calendar_Table"><tr>{links}</tr></table>')
+
+
+def race_list_page(race_id_list: list) -> bytes:
+    """
+    開催日毎のレース一覧（race.netkeiba.comの`/top/race_list_sub.html`）を模したHTMLを返す。
+    """
+    items = "".join(
+        '<li class="RaceList_DataItem">'
+        f'<a href="../race/result.html?race_id={race_id}&rf=race_list">'
+        f'<div class="Race_Num">{int(race_id[-2:])}R</div></a></li>'
+        for race_id in race_id_list
+    )
+    return _page(f'<dl class="RaceList_DataList"><dd><ul>{items}</ul></dd></dl>')
+
+
+def generate_races(
+    n_days: int,
+    places_per_day: int = 2,
+    races_per_place: int = 12,
+    horses_per_race: int = 14,
+    n_horses: int = None,
+    start: date = date(2020, 1, 4),
+    seed: int = 0,
+) -> list:
+    """
+    開催日・競馬場・レース番号毎のレースと、その出走馬を生成する。
+
+    馬・騎手・調教師・馬主は一定数の集合から選ぶため、同じ馬が複数のレースに出走する。
+
+    Args:
+        n_days (int): 開催日数（土日を1日ずつ数える）。
+        places_per_day (int, optional): 1日あたりの開催場数。
+        races_per_place (int, optional): 1開催場あたりのレース数。
+        horses_per_race (int, optional): 1レースあたりの最大出走頭数。
+        n_horses (int, optional): 馬の数。省略時は1頭あたり平均5走となる数。
+        start (date, optional): 最初の開催日。
+        seed (int, optional): 乱数のシード。
+
+    Returns:
+        list: レースの情報（辞書）のリスト。
+    """
+    rng = random.Random(seed)
+    n_races = n_days * places_per_day * races_per_place
+    if n_horses is None:
+        n_horses = max(horses_per_race, n_races * horses_per_race // 5)
+    horse_ids = [f"{2015 + i % 8}{i:06d}" for i in range(n_horses)]
+    jockey_ids = [f"{i:05d}" for i in range(max(20, n_horses // 60))]
+    trainer_ids = [f"{i:05d}" for i in range(max(20, n_horses // 40))]
+    owner_ids = [f"{i:06d}" for i in range(max(50, n_horses // 10))]
+
+    races = []
+    day = start
+    for day_number in range(n_days):
+        for place_number, place in enumerate(
+            rng.sample(PLACES, min(places_per_day, len(PLACES)))
+        ):
+            kai = day_number // 8 + 1
+            nichi = day_number % 8 + 1
+            place_code = PLACES.index(place) + 1
+            for race_number in range(1, races_per_place + 1):
+                race_type = rng.choice(["芝", "ダ"])
+                n_entries = rng.randint(min(8, horses_per_race), horses_per_race)
+                popularity = rng.sample(range(1, n_entries + 1), n_entries)
+                entries = [
+                    {
+                        "horse_id": horse_id,
+                        "jockey_id": rng.choice(jockey_ids),
+                        "trainer_id": rng.choice(trainer_ids),
+                        "owner_id": rng.choice(owner_ids),
+                        "umaban": umaban,
+                        "popularity": popularity[umaban - 1],
+                    }
+                    for umaban, horse_id in enumerate(
+                        rng.sample(horse_ids, n_entries), start=1
+                    )
+                ]
+                rng.shuffle(entries)
+                races.append(
+                    {
+                        "race_id": f"{day.year}{place_code:02d}{kai:02d}{nichi:02d}{race_number:02d}",
+                        "date": day,
+                        "place": place,
+                        "kai": kai,
+                        "nichi": nichi,
+                        "race_number": race_number,
+                        "title": f"テスト{race_number}R",
+                        "race_type": race_type,
+                        "around": rng.choice(["右", "左"]),
+                        "course_len": rng.choice(COURSE_LENS[race_type]),
+                        "weather": rng.choice(WEATHERS),
+                        "ground_state": rng.choice(GROUND_STATES),
+                        "race_class": rng.choice(RACE_CLASSES),
+                        "entries": entries,
+                    }
+                )
+        # 土曜・日曜を交互に進める
+        day += timedelta(days=1 if day.weekday() == 5 else 6)
+    return races
+
+
+def write_archives(races: list, seed: int = 0) -> dict:
+    """
+    レースと馬のページを生成し、`HTML_RACE_PACK`・`HTML_HORSE_PACK`のアーカイブに書き込む。
+    パスは設定値（カレントディレクトリからの相対パス）を使う。
+
+    Returns:
+        dict: `races`・`horses`（書き込んだページ数）と`bytes`（アーカイブの合計サイズ）を持つ辞書。
+    """
+    rng = random.Random(seed)
+    HTML_DIR.mkdir(parents=True, exist_ok=True)
+    race_archive = HtmlArchive(HTML_RACE_PACK)
+    history = {}
+    for race in races:
+        race_archive.put(race["race_id"], race_page(race, rng))
+        for entry in race["entries"]:
+            history.setdefault(entry["horse_id"], []).append(race)
+    horse_archive = HtmlArchive(HTML_HORSE_PACK)
+    for horse_id, horse_races in history.items():
+        horse_archive.put(horse_id, horse_page(horse_id, horse_races, rng))
+    return {
+        "races": len(races),
+        "horses": len(history),
+        "bytes": HTML_RACE_PACK.stat().st_size + HTML_HORSE_PACK.stat().st_size,
+    }
@@ -6,25 +6,51 @@ import time
 import warnings
 from urllib.request import Request, urlopen
 import ast
+import importlib
 
 # 外部ライブラリ
-from bs4 import BeautifulSoup
 import pandas as pd
 import pickle
 from tqdm import tqdm
 from urllib.error import HTTPError
 
-# Selenium関連のライブラリ
-from selenium.webdriver.common.by import By
-
 # スクリプトの1つ上の階層をsys.pathに追加
 # sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 # sys.path.append(str(Path(__file__).resolve().parent))
 
 # 自作モジュール
 from src.logger_setting import setup_logger
-from src.chrome_setting import get_chrome_driver
 from src.mapping import MappingLoader
+from src.html_archive import HtmlArchive
+from src.page_validators import PageValidators
+from src.upcoming_entries import UpcomingEntries
+from src.ingest_manifest import IngestManifest
+from src.partition_store import PartitionStore
+from src.table_store import TableStore
+from src.feature_cache import FeatureCache, code_version
+from src.id_registry import IdRegistry
+from src.metrics import Metrics, Progress
+
+# 読み込みに時間のかかるライブラリは、使用する段階で初めて読み込む
+# （`from src.config import *` では読み込まれないため、使用する側で名前を指定してimportする）
+LAZY_IMPORTS = {
+    "BeautifulSoup": ("bs4", "BeautifulSoup"),
+    "By": ("selenium.webdriver.common.by", "By"),
+    "get_chrome_driver": ("src.chrome_setting", "get_chrome_driver"),
+}
+
+
+def __getattr__(name):
+    """
+    `LAZY_IMPORTS`に登録された名前が参照されたときに、対応するモジュールを読み込んで返す。
+    """
+    if name not in LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = LAZY_IMPORTS[name]
+    value = getattr(importlib.import_module(module_name), attr)
+    globals()[name] = value
+    return value
+
 
 # pandas warning非表示設定
 warnings.simplefilter("ignore", FutureWarning)
@@ -43,6 +69,9 @@ RACE_DATE_URL_TEMPLATE = (
 RACE_ID_LIST_URL_TEMPLATE = (
     "https://race.netkeiba.com/top/race_list.html?kaisai_date={kaisai_date}"
 )
+RACE_ID_LIST_SUB_URL_TEMPLATE = (
+    "https://race.netkeiba.com/top/race_list_sub.html?kaisai_date={kaisai_date}"
+)
 RACE_URL_TEMPLATE = "https://db.netkeiba.com/race/{race_id}"
 HORSE_URL_TEMPLATE = "https://db.netkeiba.com/horse/{horse_id}"
 
@@ -50,6 +79,13 @@ HORSE_URL_TEMPLATE = "https://db.netkeiba.com/horse/{horse_id}"
 HTML_RACE_DIR = HTML_DIR / "race"
 HTML_HORSE_DIR = HTML_DIR / "horse"
 
+# HTMLアーカイブ（圧縮済みHTMLの追記型ファイル）
+HTML_RACE_PACK = HTML_DIR / "race.pack"
+HTML_HORSE_PACK = HTML_DIR / "horse.pack"
+# 取得したページの検証子（ETag・Last-Modified）と最後に確認した時刻
+HTML_RACE_VALIDATORS = HTML_DIR / "race.validators.tsv"
+HTML_HORSE_VALIDATORS = HTML_DIR / "horse.validators.tsv"
+
 
 # ファイル名
 RAWDF_RACE_FILE_NAME_CSV = "race_results.csv"
@@ -57,6 +93,7 @@ RAWDF_HORSE_FILE_NAME_CSV = "horse_results.csv"
 RAWDF_PREPROCESSED_RACE_FILE_NAME_CSV = "preprocessed_race_results.csv"
 RAWDF_PREPROCESSED_HORSE_FILE_NAME_CSV = "preprocessed_horse_results.csv"
 RACE_INFO_CSV = "race_info.csv"
+RACE_INFO_TRANSFORMED_CSV = "race_info_transformed.csv"
 RACE_INFO_PREPROCESSING_CSV = "race_info_preprocessing.csv"
 FEATURES_CSV = "features.csv"
 
@@ -64,6 +101,130 @@ FEATURES_CSV = "features.csv"
 LOOP_WAIT_SECONDS = 3  # スクレイピング間の待機時間
 FLOM_DATE = "2024-01"  # スクレイピング開始年月
 TO_DATE = "2024-12"  # スクレイピング終了年月
+HORSE_REFRESH_MAX_REQUESTS = 1000  # 1回の実行で再取得する馬ページの上限
+HORSE_REFRESH_RETRY_SECONDS = (
+    24 * 3600
+)  # 取得に失敗した馬ページを再び試すまでの間隔（失敗毎に倍）
+HORSE_REFRESH_RETRY_MAX_SECONDS = 30 * 24 * 3600  # 再び試すまでの間隔の上限
+RACE_TIMEZONE = "Asia/Tokyo"  # 開催日とページの取得時刻を比べるときのタイムゾーン
+UPCOMING_ENTRIES_FILE = (
+    SAVE_DIR / "upcoming_entries.tsv"
+)  # 予測を依頼された出走予定の馬（馬ページの再取得で最優先にする）
+
+# 取得エンジン設定
+FETCH_MAX_WORKERS = 4  # 同時接続数の上限
+FETCH_RATE_PER_SECOND = 1 / LOOP_WAIT_SECONDS  # ホスト毎の許容リクエスト数/秒
+FETCH_BURST = 1  # トークンバケットの容量
+FETCH_MAX_RETRIES = 5  # 429/5xx時の最大リトライ回数
+FETCH_BACKOFF_BASE_SECONDS = 2.0  # 指数バックオフの初期待機時間
+FETCH_BACKOFF_MAX_SECONDS = 120.0  # 指数バックオフの最大待機時間
+FETCH_TIMEOUT_SECONDS = 30  # 1リクエストのタイムアウト
+FETCH_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)  # リトライ対象のHTTPステータス
+FETCH_ACCEPT_ENCODING = "gzip, deflate"  # 圧縮して受け取る形式
+
+# レースID取得設定
+RACE_ID_LIST_MODE = "http"  # "http"（ブラウザ無し）または "selenium"
+RACE_ID_LIST_MAX_RETRIES = 3  # 開催日毎の最大リトライ回数
+RACE_ID_LIST_SELENIUM_FALLBACK = (
+    True  # HTTPで取得できなかった開催日をSeleniumで取得する
+)
+
+# HTML解析設定
+PARSE_WORKERS = 1  # 解析に使うプロセス数（1の場合は直列に処理）
+PARSE_CHUNK_SIZE = 64  # 1回にワーカーへ渡すページ数
+
+# 差分取り込み設定
+MANIFEST_DIR = SAVE_DIR / "manifest"  # 取り込み済みページの台帳
+PARTITION_DIR = SAVE_DIR / "partitions"  # 解析結果のパーティション
+RACE_MANIFEST = MANIFEST_DIR / "race.tsv"
+HORSE_MANIFEST = MANIFEST_DIR / "horse.tsv"
+PARTITION_KEY_LENGTH = 4  # IDの先頭4桁（年）でパーティションを分割
+
+# テーブル保存設定
+STORAGE_FORMAT = "parquet"  # 保存形式（parquet / feather / csv）
+STORAGE_EXPORT_CSV = True  # 保存時にタブ区切りのCSVも書き出すかどうか
+STORAGE_ROW_GROUP_SIZE = 100_000  # Parquetの1行グループあたりの行数
+
+# 特徴量キャッシュ設定
+FEATURE_CACHE_DIR = SAVE_DIR / "feature_cache"
+FEATURE_CACHE_MAX_BYTES = 2 * 1024**3  # キャッシュ全体の最大サイズ
+FEATURE_CACHE_MAX_ENTRIES = 64  # キャッシュの最大件数
+
+# 前処理設定
+PROCESS_MEMORY_LIMIT = (
+    512 * 1024**2
+)  # 馬の結果データを1チャンクずつ処理するときのメモリの上限（Noneで一括処理）
+PROCESS_MEMORY_FACTOR = (
+    4  # 処理中のメモリ使用量が、読み込んだチャンクの何倍になるかの見積もり
+)
+
+# ID台帳設定
+ID_REGISTRY_DIR = SAVE_DIR / "id_registry"  # 外部IDとint32のコードの対応表
+
+# 計測設定
+METRICS_DIR = SAVE_DIR / "metrics"  # 実行毎の計測値（JSON・Prometheusテキスト）の保存先
+PROGRESS_INTERVAL_SECONDS = 10  # 進捗をログに出力する間隔
+
+# 学習設定
+TRAINING_DATASET_DIR = SAVE_DIR / "training_dataset"  # 学習用のバイナリのデータセット
+RANK_RELEVANCE = {1: 3, 2: 2, 3: 1}  # 着順毎のランキング学習の関連度（それ以外は0）
+TRAINING_DATASET_PARAMS = {"max_bin": 255, "min_data_in_bin": 3}  # ビン分割のパラメータ
+TRAINING_PARAMS = {
+    "objective": "lambdarank",
+    "metric": "ndcg",
+    "eval_at": [1, 3],
+    "learning_rate": 0.05,
+    "num_leaves": 31,
+    "min_data_in_leaf": 50,
+    "feature_fraction": 0.8,
+}
+TRAINING_NUM_BOOST_ROUND = 1000  # ブースティングの最大回数
+TRAINING_EARLY_STOPPING_ROUNDS = 50  # 検証スコアが改善しない場合に止めるまでの回数
+TRAINING_VALID_FRACTION = 0.1  # 検証に使う末尾のレースの割合
+
+# 時系列交差検証設定
+CV_WORKERS = None  # 並列に学習するプロセス数（Noneの場合はCPU数とfold数の小さい方）
+CV_MIN_TRAIN_RACES = 1000  # 学習に使うレースがこれより少ない月は検証しない
+CV_REPORT_FILE = SAVE_DIR / "cv_report.csv"  # fold毎の評価指標
+CV_SCORES_FILE = (
+    SAVE_DIR / "cv_scores.parquet"
+)  # 検証した月の予測スコア（バックテスト用）
+
+# バックテスト設定
+BACKTEST_STAKE = 100  # 1点あたりの購入金額
+BACKTEST_WORKERS = None  # 並列に評価するプロセス数（Noneの場合はCPU数）
+BACKTEST_CHUNK_SIZE = 64  # 1回にプロセスへ渡す賭け方の数
+BACKTEST_SOFTMAX_TEMPERATURE = 1.0  # スコアから勝率を推定するときのsoftmaxの温度
+BACKTEST_GRID = {
+    "top_k": [1, 2, 3],
+    "min_prob": [0.0, 0.1, 0.2, 0.3],
+    "min_ev": [0.0, 0.8, 1.0, 1.2, 1.5, 2.0],
+    "min_odds": [1.0, 2.0, 5.0],
+    "max_odds": [10.0, 30.0, 100.0, float("inf")],
+    "max_popularity": [3, 6, 18],
+}
+
+# 予測サービス設定
+MODEL_FILE = (
+    SAVE_DIR / "model.pickle"
+)  # 学習済みモデル（{"model", "features"}のpickle）
+PREDICTION_HOST = "127.0.0.1"  # 予測サービスの待ち受けアドレス
+PREDICTION_PORT = 8765  # 予測サービスのポート
+PREDICTION_REFRESH_SECONDS = 60  # 過去成績のテーブルの更新を確認する間隔
+
+# パイプライン設定
+PIPELINE_STATE_FILE = SAVE_DIR / "pipeline_state.json"  # 完了した段階の記録
+PIPELINE_MAX_WORKERS = 2  # 同時に実行する段階の数
+
+# テーブル名
+RACE_RESULTS_TABLE = "race_results"
+RACE_INFO_TABLE = "race_info"
+HORSE_RESULTS_TABLE = "horse_results"
+PREPROCESSED_RACE_RESULTS_TABLE = "preprocessed_race_results"
+PREPROCESSED_HORSE_RESULTS_TABLE = "preprocessed_horse_results"
+RACE_INFO_TRANSFORMED_TABLE = "race_info_transformed"
+RACE_INFO_PREPROCESSING_TABLE = "race_info_preprocessing"
+FEATURES_TABLE = "features"
 
 # カラム列名
 COLUMN_RACE_ID = "race_id"
@@ -97,6 +258,110 @@ JOCKEY_ID_LENGTH = 5
 TRAINER_ID_LENGTH = 5
 OWNER_ID_LENGTH = 6
 
+# 台帳でint32のコードに変換するIDの列（元のIDの文字列は台帳に保持する）
+ENTITY_ID_COLUMNS = [
+    COLUMN_HORSE_ID,
+    COLUMN_JOCKEY_ID,
+    COLUMN_TRAINER_ID,
+    COLUMN_OWNER_ID,
+]
+
+# テーブル毎のスキーマ（レースIDは文字列、馬・騎手・調教師・馬主のIDはコードとして扱う）
+# 前処理済みのテーブルは、欠損の無い整数をint8/int16、欠損し得る整数をInt8/Int16、
+# オッズ・斤量・馬体重・賞金をfloat32、マッピング済みの値をcategoryとして保持する
+ID_DTYPES = {
+    COLUMN_RACE_ID: "string",
+    COLUMN_HORSE_ID: "int32",
+    COLUMN_JOCKEY_ID: "int32",
+    COLUMN_TRAINER_ID: "int32",
+    COLUMN_OWNER_ID: "int32",
+}
+TABLE_SCHEMAS = {
+    RACE_RESULTS_TABLE: {
+        "csv": RAWDF_RACE_FILE_NAME_CSV,
+        "dtypes": ID_DTYPES,
+    },
+    HORSE_RESULTS_TABLE: {
+        "csv": RAWDF_HORSE_FILE_NAME_CSV,
+        "dtypes": {COLUMN_HORSE_ID: "int32"},
+    },
+    RACE_INFO_TABLE: {
+        "csv": RACE_INFO_CSV,
+        "dtypes": {
+            COLUMN_RACE_ID: "string",
+            "title": "string",
+            "info1": "list",
+            "info2": "list",
+        },
+    },
+    PREPROCESSED_RACE_RESULTS_TABLE: {
+        "csv": RAWDF_PREPROCESSED_RACE_FILE_NAME_CSV,
+        "dtypes": {
+            **ID_DTYPES,
+            COLUMN_RANK: "int8",
+            COLUMN_WAKUBAN: "int8",
+            COLUMN_UMABAN: "int8",
+            COLUMN_SEX: "category",
+            COLUMN_AGE: "int8",
+            COLUMN_WEIGHT: "float32",
+            COLUMN_WEIGHT_DIFF: "float32",
+            COLUMN_TANSYO: "float32",
+            COLUMN_POPULARITY: "int8",
+            COLUMN_IMPOST: "float32",
+        },
+    },
+    PREPROCESSED_HORSE_RESULTS_TABLE: {
+        "csv": RAWDF_PREPROCESSED_HORSE_FILE_NAME_CSV,
+        "dtypes": {
+            COLUMN_HORSE_ID: "int32",
+            COLUMN_DATE: "datetime64[ns]",
+            COLUMN_RANK: "int8",
+            COLUMN_PRIZE: "float32",
+            COLUMN_RANK_DIFF: "float32",
+            COLUMN_WEATHER: "category",
+            COLUMN_RACE_TYPE: "category",
+            COLUMN_COURSE_LEN: "int16",
+            COLUMN_GROUND_STATE: "category",
+            COLUMN_RACE_CLASS: "category",
+            "n_horses": "Int8",
+        },
+        "sort_by": [COLUMN_DATE],
+    },
+    RACE_INFO_TRANSFORMED_TABLE: {
+        "csv": RACE_INFO_TRANSFORMED_CSV,
+        "dtypes": {
+            COLUMN_RACE_ID: "string",
+            COLUMN_DATE: "string",
+            COLUMN_RACE_TYPE: "string",
+            COLUMN_AROUND: "string",
+            COLUMN_COURSE_LEN: "Int16",
+            COLUMN_WEATHER: "string",
+            COLUMN_GROUND_STATE: "string",
+            COLUMN_RACE_CLASS: "string",
+            COLUMN_PLACE: "string",
+        },
+    },
+    RACE_INFO_PREPROCESSING_TABLE: {
+        "csv": RACE_INFO_PREPROCESSING_CSV,
+        "dtypes": {
+            COLUMN_RACE_ID: "string",
+            COLUMN_DATE: "datetime64[ns]",
+            COLUMN_RACE_TYPE: "category",
+            COLUMN_AROUND: "category",
+            COLUMN_COURSE_LEN: "Int16",
+            COLUMN_WEATHER: "category",
+            COLUMN_GROUND_STATE: "category",
+            COLUMN_RACE_CLASS: "category",
+            COLUMN_PLACE: "category",
+        },
+        "sort_by": [COLUMN_DATE],
+    },
+    FEATURES_TABLE: {
+        "csv": FEATURES_CSV,
+        "dtypes": {**ID_DTYPES, COLUMN_DATE: "datetime64[ns]"},
+    },
+}
+
 # User-Agent 定義
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36"
@@ -114,11 +379,19 @@ RANK_0005_RACE = 5
 RANK_0010_RACE = 10
 RANK_1000_RACE = 1000
 
+# 騎手・調教師・馬主の直近の成績（勝率・複勝率・平均着順・平均賞金）の集計
+ENTITY_FEATURE_COLUMNS = [COLUMN_JOCKEY_ID, COLUMN_TRAINER_ID, COLUMN_OWNER_ID]
+# 条件で分けて集計する列（Noneは条件で分けない集計）
+ENTITY_FEATURE_SPLITS = [None, COLUMN_RACE_TYPE, COLUMN_PLACE, COLUMN_COURSE_LEN]
+ENTITY_N_RACES = [100, 1000]  # 集計する直近の出走数
+
 # エラーメッセージ
 ERROR_NO_VALID_TABLE = "HTMLドキュメントに有効な<table>要素が見つかりませんでした。"
 ERROR_UNEXPECTED = "予期せぬエラーが発生しました。"
 ERROR_INVALID_URL = "無効なURLが指定されました。"
 ERROR_TITLE = "対象外のタイトルです。"
+ERROR_NOT_IN_ARCHIVE = "HTMLアーカイブに存在しません。"
+ERROR_NO_RACE_ID = "レースIDを取得できませんでした。"
 
 
 # 正規表現パターン
@@ -129,9 +402,32 @@ GROUND_STATE_PATTERN = r"(芝|ダート|障):(.+)"
 PLACE_D_PATTERN = r"(\d+回(\w+)\d{1,2}日目)"
 PLACE_DD_PATTERN = r"([^\d]+)(\d{1})?"
 DATE_PATTERN = r"\d{4}年\d{1,2}月\d{1,2}日"
+DATE_PARTS_PATTERN = r"(\d+)年(\d+)月(\d+)日"
+RACE_ID_PATTERN = r"race_id=(\d{12})"
+TABLE_CELL_WHITESPACE_PATTERN = r"[\r\n]+|\s{2,}"  # pd.read_htmlと同じ空白の正規化
 
-# mappingファイル読み込み
+# mappingファイル（各マッピングは初めて参照されたときに読み込む）
 mapping_loader = MappingLoader(
     mapping_dir=Path(__file__).parent / "preprocessing" / "mapping"
 )
-mapping_loader.load_all_mappings()
+
+# 実行中の計測値
+metrics = Metrics()
+
+# テーブルの保存・読み込み
+table_store = TableStore(
+    SAVE_DIR,
+    TABLE_SCHEMAS,
+    STORAGE_FORMAT,
+    STORAGE_EXPORT_CSV,
+    STORAGE_ROW_GROUP_SIZE,
+    metrics,
+)
+
+# 特徴量ブロックのキャッシュ
+feature_cache = FeatureCache(
+    FEATURE_CACHE_DIR, FEATURE_CACHE_MAX_BYTES, FEATURE_CACHE_MAX_ENTRIES
+)
+
+# 馬・騎手・調教師・馬主のIDの台帳
+id_registry = IdRegistry(ID_REGISTRY_DIR, ENTITY_ID_COLUMNS)
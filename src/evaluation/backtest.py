@@ -0,0 +1,263 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.config import *
+
+# 評価結果の列
+RESULT_COLUMNS = [
+    "n_races",
+    "n_bets",
+    "n_hits",
+    "hit_rate",
+    "stake",
+    "payout",
+    "profit",
+    "roi",
+    "max_drawdown",
+]
+
+
+class BacktestData:
+    def __init__(self, df: pd.DataFrame, temperature: float = 1.0):
+        """
+        単勝の賭け方を評価するための、レース毎に連続した配列。
+
+        行を開催日・レースID・スコアの降順に並べ、レースの先頭行の位置(`starts`)を持つ。
+        各行には次の値を前もって計算しておく。
+        - `pred_rank`: レース内のスコアの順位（1始まり）。
+        - `prob`: レース内でスコアをsoftmaxした勝率の推定値（`temperature`で温度を調整する）。
+        - `ev`: 期待値（`prob × 単勝オッズ`）。
+        レース毎の集計は`np.add.reduceat`などの区間演算で行い、レース毎のPythonのループは使わない。
+
+        Args:
+            df (pandas.DataFrame): `race_id`・`date`・`score`・`tansyo`・`popularity`・`rank`を持つ行。
+            temperature (float, optional): softmaxの温度。
+        """
+        df = df.dropna(subset=[COLUMN_TANSYO, COLUMN_RANK, "score"])
+        df = df.sort_values(
+            [COLUMN_DATE, COLUMN_RACE_ID, "score"],
+            ascending=[True, True, False],
+            kind="stable",
+        )
+        race_ids = df[COLUMN_RACE_ID].to_numpy(dtype=str)
+        n = len(df)
+        self.starts = np.flatnonzero(np.r_[n > 0, race_ids[1:] != race_ids[:-1]])
+        self.race_ids = race_ids[self.starts]
+        self.dates = df[COLUMN_DATE].to_numpy()[self.starts]
+        self.group = np.repeat(
+            np.arange(len(self.starts)), np.diff(np.r_[self.starts, n])
+        )
+        group = self.group
+        self.score = df["score"].to_numpy(dtype=np.float64)
+        self.odds = df[COLUMN_TANSYO].to_numpy(dtype=np.float64)
+        self.popularity = df[COLUMN_POPULARITY].to_numpy(
+            dtype=np.float64, na_value=np.nan
+        )
+        self.win = df[COLUMN_RANK].to_numpy(dtype=np.float64) == 1
+        self.pred_rank = np.arange(n) - self.starts[group] + 1
+        # 行はレース内でスコアの降順のため、先頭がレース内の最大値
+        weights = np.exp((self.score - self.score[self.starts][group]) / temperature)
+        totals = np.add.reduceat(weights, self.starts) if n else np.zeros(0)
+        self.prob = weights / totals[group]
+        self.ev = self.prob * self.odds
+
+    def __len__(self) -> int:
+        return len(self.score)
+
+    @property
+    def n_races(self) -> int:
+        return len(self.starts)
+
+
+def evaluate(data: BacktestData, params: dict, stake: float = BACKTEST_STAKE) -> dict:
+    """
+    1つの賭け方の成績を求める。各レースで条件を満たすすべての馬の単勝を`stake`円ずつ買う。
+
+    Args:
+        data (BacktestData): 評価に使うデータ。
+        params (dict): 賭け方のパラメータ。
+            - `top_k`: レース内のスコアの順位がこれ以下の馬だけを買う。
+            - `min_prob`: 推定勝率の下限。
+            - `min_ev`: 期待値（推定勝率 × オッズ）の下限。
+            - `min_odds` / `max_odds`: 単勝オッズの範囲。
+            - `max_popularity`: 人気の下限（これより人気の無い馬は買わない）。
+        stake (float, optional): 1点あたりの購入金額。
+
+    Returns:
+        dict: 的中率・回収率(ROI)・最大ドローダウンなど（`RESULT_COLUMNS`）。
+    """
+    bet = data.pred_rank <= params.get("top_k", 1)
+    if "min_prob" in params:
+        bet &= data.prob >= params["min_prob"]
+    if "min_ev" in params:
+        bet &= data.ev >= params["min_ev"]
+    if "min_odds" in params:
+        bet &= data.odds >= params["min_odds"]
+    if "max_odds" in params:
+        bet &= data.odds <= params["max_odds"]
+    if "max_popularity" in params:
+        bet &= data.popularity <= params["max_popularity"]
+    # 買う行だけを取り出して集計する（買う行は全体に比べて少ない）
+    rows = np.flatnonzero(bet)
+    hit = data.win[rows]
+    n_bets = len(rows)
+    n_hits = int(hit.sum())
+    payout = np.where(hit, data.odds[rows] * stake, 0.0)
+    # 開催日順のレース毎の収支と、その累積の最大値からの下落幅
+    race_profit = np.bincount(
+        data.group[rows], weights=payout - stake, minlength=data.n_races
+    )
+    cumulative = np.cumsum(race_profit)
+    peak = np.maximum.accumulate(np.maximum(cumulative, 0.0))
+    max_drawdown = float((peak - cumulative).max()) if data.n_races else 0.0
+    n_races = len(np.unique(data.group[rows]))
+    total_stake = n_bets * stake
+    total_payout = float(payout.sum())
+    return {
+        "n_races": n_races,
+        "n_bets": n_bets,
+        "n_hits": n_hits,
+        "hit_rate": n_hits / n_bets if n_bets else np.nan,
+        "stake": total_stake,
+        "payout": total_payout,
+        "profit": total_payout - total_stake,
+        "roi": total_payout / total_stake if total_stake else np.nan,
+        "max_drawdown": max_drawdown,
+    }
+
+
+def parameter_grid(grid: dict) -> list:
+    """
+    パラメータ毎の候補のリストから、すべての組み合わせの辞書のリストを作る。
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+# ワーカープロセスで使うデータ（初期化時に1度だけ受け取る）
+_worker_data = None
+
+
+def _init_worker(data: BacktestData):
+    global _worker_data
+    _worker_data = data
+
+
+def _evaluate_chunk(params_list: list, stake: float) -> list:
+    return [evaluate(_worker_data, params, stake) for params in params_list]
+
+
+def run_grid(
+    data: BacktestData,
+    grid,
+    stake: float = BACKTEST_STAKE,
+    workers: int = BACKTEST_WORKERS,
+    chunk_size: int = BACKTEST_CHUNK_SIZE,
+) -> pd.DataFrame:
+    """
+    賭け方のパラメータの組み合わせをすべて評価する。
+
+    組み合わせを`chunk_size`件ずつに分け、`workers`個のプロセスで並列に評価する。
+    データは各プロセスの初期化時に1度だけ渡す。
+
+    Args:
+        data (BacktestData): 評価に使うデータ。
+        grid (dict or list): パラメータ毎の候補のリストの辞書、またはパラメータの辞書のリスト。
+        stake (float, optional): 1点あたりの購入金額。
+        workers (int, optional): プロセス数。Noneの場合はCPU数、1の場合は並列にしない。
+        chunk_size (int, optional): 1回にプロセスへ渡す組み合わせの数。
+
+    Returns:
+        pandas.DataFrame: パラメータと成績を1行ずつ並べたデータフレーム。
+    """
+    params_list = parameter_grid(grid) if isinstance(grid, dict) else list(grid)
+    workers = workers or os.cpu_count()
+    chunks = [
+        params_list[i : i + chunk_size] for i in range(0, len(params_list), chunk_size)
+    ]
+    start = time.perf_counter()
+    if workers <= 1 or len(chunks) <= 1:
+        results = [evaluate(data, params, stake) for params in params_list]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(data,)
+        ) as executor:
+            results = [
+                result
+                for chunk_results in executor.map(
+                    _evaluate_chunk, chunks, [stake] * len(chunks)
+                )
+                for result in chunk_results
+            ]
+    logger.info(
+        f"backtest: {len(params_list)} strategies x {data.n_races} races "
+        f"({time.perf_counter() - start:.1f}s)"
+    )
+    return pd.concat(
+        [pd.DataFrame(params_list), pd.DataFrame(results, columns=RESULT_COLUMNS)],
+        axis=1,
+    )
+
+
+def load_backtest_frame(scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    モデルのスコアに、`preprocessed_race_results`の単勝オッズ・人気・着順と開催日を結合する。
+
+    Args:
+        scores (pandas.DataFrame): `race_id`・`horse_id`・`score`を持つデータフレーム。
+
+    Returns:
+        pandas.DataFrame: `BacktestData`に渡す行。
+    """
+    results = table_store.read(
+        PREPROCESSED_RACE_RESULTS_TABLE,
+        columns=[
+            COLUMN_RACE_ID,
+            COLUMN_HORSE_ID,
+            COLUMN_TANSYO,
+            COLUMN_POPULARITY,
+            COLUMN_RANK,
+        ],
+    )
+    race_info = table_store.read(
+        RACE_INFO_PREPROCESSING_TABLE, columns=[COLUMN_RACE_ID, COLUMN_DATE]
+    )
+    return (
+        scores[[COLUMN_RACE_ID, COLUMN_HORSE_ID, "score"]]
+        .merge(results, on=[COLUMN_RACE_ID, COLUMN_HORSE_ID])
+        .merge(race_info, on=COLUMN_RACE_ID)
+    )
+
+
+if __name__ == "__main__":
+    """
+    スコアのファイルに対して、`BACKTEST_GRID`のすべての賭け方を評価する。
+
+    例:
+        python -m src.evaluation.backtest --scores data/rawdf/scores.parquet --top 20
+    """
+    parser = argparse.ArgumentParser(description="単勝の賭け方のバックテスト")
+    parser.add_argument(
+        "--scores",
+        required=True,
+        help="race_id・horse_id・scoreを持つParquetまたはタブ区切りのファイル",
+    )
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--top", type=int, default=20, help="表示する件数")
+    parser.add_argument("--output", help="全件の結果を保存するCSVのパス")
+    args = parser.parse_args()
+
+    if args.scores.endswith(".parquet"):
+        scores = pd.read_parquet(args.scores)
+    else:
+        scores = pd.read_csv(args.scores, sep="\t", dtype={COLUMN_RACE_ID: str})
+    data = BacktestData(load_backtest_frame(scores), BACKTEST_SOFTMAX_TEMPERATURE)
+    result = run_grid(data, BACKTEST_GRID, workers=args.workers)
+    if args.output:
+        result.to_csv(args.output, index=False)
+    print(result.sort_values("roi", ascending=False).head(args.top).to_string())
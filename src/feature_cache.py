@@ -0,0 +1,179 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from pathlib import Path
+
+import pandas as pd
+
+from src.logger_setting import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """
+    ファイルの内容のSHA-256を返す。
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_version(*objects) -> str:
+    """
+    関数やクラスのソースコードから、コードのバージョンを表すハッシュを返す。
+    """
+    digest = hashlib.sha256()
+    for obj in objects:
+        digest.update(inspect.getsource(obj).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    SUFFIX = ".pickle"
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_entries: int):
+        """
+        特徴量ブロックをディスクにキャッシュするストア。
+
+        キーは入力テーブルの内容のハッシュ・ブロックのパラメータ・コードのバージョンから作るため、
+        いずれかが変わると別のキーとなり再計算される。エントリは最終アクセス時刻
+        （ファイルの更新時刻）の古い順に、合計サイズが`max_bytes`、件数が`max_entries`以下になるまで削除する。
+
+        Args:
+            cache_dir (Path): キャッシュを保存するディレクトリ。
+            max_bytes (int): キャッシュ全体の最大サイズ（バイト）。
+            max_entries (int): キャッシュの最大件数。
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.stats = {}
+        self._file_hashes = {}
+
+    def input_hash(self, path: Path) -> str:
+        """
+        入力ファイルの内容のハッシュを返す。同じプロセス内ではサイズと更新時刻が
+        変わらない限り計算結果を再利用する。
+        """
+        stat = Path(path).stat()
+        signature = (str(path), stat.st_size, stat.st_mtime_ns)
+        if signature not in self._file_hashes:
+            self._file_hashes[signature] = file_hash(path)
+        return self._file_hashes[signature]
+
+    @staticmethod
+    def key(block: str, inputs: dict, params: dict, version: str) -> str:
+        """
+        ブロック名・入力のハッシュ・パラメータ・コードのバージョンからキャッシュキーを作る。
+        """
+        payload = json.dumps(
+            {"block": block, "inputs": inputs, "params": params, "version": version},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, block: str, key: str) -> Path:
+        return self.cache_dir / f"{block}-{key}{self.SUFFIX}"
+
+    def _count(self, block: str, result: str):
+        self.stats.setdefault(block, {"hit": 0, "miss": 0})[result] += 1
+
+    def get(self, block: str, key: str):
+        """
+        キャッシュを読み込む。存在しない場合はNoneを返す。ヒットしたエントリは最終アクセス時刻を更新する。
+        """
+        path = self._path(block, key)
+        try:
+            with open(path, "rb") as rf:
+                df = pickle.load(rf)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self._count(block, "miss")
+            logger.info(f"feature cache miss: {block} ({key[:12]})")
+            return None
+        os.utime(path)
+        self._count(block, "hit")
+        logger.info(f"feature cache hit: {block} ({key[:12]})")
+        return df
+
+    def put(self, block: str, key: str, df: pd.DataFrame):
+        """
+        キャッシュを保存し、上限を超えた分を古い順に削除する。
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(block, key)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as wf:
+            pickle.dump(df, wf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def get_or_compute(self, block: str, key: str, compute) -> pd.DataFrame:
+        """
+        キャッシュがあれば読み込み、無ければ`compute()`の結果を保存して返す。
+        """
+        df = self.get(block, key)
+        if df is None:
+            df = compute()
+            self.put(block, key, df)
+        return df
+
+    def entries(self) -> list:
+        """
+        キャッシュのエントリを`(path, size, 最終アクセス時刻)`のリストで、古い順に返す。
+        """
+        if not self.cache_dir.is_dir():
+            return []
+        entries = []
+        for path in self.cache_dir.glob(f"*{self.SUFFIX}"):
+            stat = path.stat()
+            entries.append((path, stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep: Path = None) -> int:
+        """
+        合計サイズと件数が上限以下になるまで、最終アクセスの古いエントリから削除する。
+
+        Args:
+            keep (Path, optional): 削除しないエントリ（直前に保存したもの）。
+
+        Returns:
+            int: 削除したエントリ数。
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            count -= 1
+            evicted += 1
+        if evicted:
+            logger.info(f"feature cache evicted {evicted} entries")
+        return evicted
+
+    def clear(self):
+        """
+        すべてのエントリを削除する。
+        """
+        for path, _, _ in self.entries():
+            path.unlink(missing_ok=True)
+
+    def report(self) -> pd.DataFrame:
+        """
+        ブロック毎のヒット数・ミス数・ヒット率を返す。
+        """
+        df = pd.DataFrame.from_dict(self.stats, orient="index", columns=["hit", "miss"])
+        df.index.name = "block"
+        df["hit_rate"] = df["hit"] / (df["hit"] + df["miss"])
+        return df
@@ -0,0 +1,358 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import (
+    FETCH_ACCEPT_ENCODING,
+    FETCH_BACKOFF_BASE_SECONDS,
+    FETCH_BACKOFF_MAX_SECONDS,
+    FETCH_BURST,
+    FETCH_MAX_RETRIES,
+    FETCH_MAX_WORKERS,
+    FETCH_RATE_PER_SECOND,
+    FETCH_RETRY_STATUS_CODES,
+    FETCH_TIMEOUT_SECONDS,
+    HEADERS,
+    metrics,
+)
+from src.logger_setting import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int = 1):
+        """
+        トークンバケット方式のレートリミッタ。
+
+        Args:
+            rate (float): 1秒あたりに補充されるトークン数（許容リクエスト数/秒）。
+            capacity (int): バケットの容量。連続して即時に払い出せる最大数。
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        トークンを1つ取得する。不足している場合は補充されるまで待機する。
+
+        トークンは予約方式で払い出すため、複数スレッドから同時に呼ばれても
+        待機時間が重複せず、全体として`rate`を超えない間隔でリクエストが行われる。
+
+        Returns:
+            None
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait_seconds = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+class FetchResponse:
+    def __init__(
+        self,
+        status: int,
+        body: bytes = None,
+        etag: str = None,
+        last_modified: str = None,
+    ):
+        """
+        1回の取得の結果。
+
+        Args:
+            status (int): HTTPステータス。304の場合は`body`がNoneとなる。
+            body (bytes, optional): 展開済みのレスポンスボディ。
+            etag (str, optional): レスポンスの`ETag`。
+            last_modified (str, optional): レスポンスの`Last-Modified`。
+        """
+        self.status = status
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+class FetchEngine:
+    def __init__(
+        self,
+        max_workers: int = FETCH_MAX_WORKERS,
+        rate_per_second: float = FETCH_RATE_PER_SECOND,
+        burst: int = FETCH_BURST,
+        max_retries: int = FETCH_MAX_RETRIES,
+        backoff_base: float = FETCH_BACKOFF_BASE_SECONDS,
+        backoff_max: float = FETCH_BACKOFF_MAX_SECONDS,
+        timeout: float = FETCH_TIMEOUT_SECONDS,
+        retry_status_codes: tuple = FETCH_RETRY_STATUS_CODES,
+        headers: dict = HEADERS,
+    ):
+        """
+        スレッドプールで並列にHTMLを取得する共通エンジン。
+
+        ホスト毎にトークンバケットでリクエスト間隔を制御し、`max_workers`を上限として
+        同時に通信を行う。HTTP 429/5xxや通信エラーの場合は指数バックオフでリトライする。
+        通信は`requests.Session`で行い、`max_workers`本までの接続をキープアライブで使い回す。
+        レスポンスはgzip等で圧縮して受け取り、展開した本文を返す。
+        1リクエストの所要時間は`fetch_seconds`のヒストグラムに、取得したバイト数・リトライ・
+        失敗の件数はカウンタに記録する。
+
+        Args:
+            max_workers (int): 同時に実行するリクエスト数の上限。
+            rate_per_second (float): ホスト毎の許容リクエスト数/秒。
+            burst (int): トークンバケットの容量。
+            max_retries (int): リトライの最大回数。
+            backoff_base (float): 指数バックオフの初期待機秒数。
+            backoff_max (float): 指数バックオフの最大待機秒数。
+            timeout (float): 1リクエストのタイムアウト秒数。
+            retry_status_codes (tuple): リトライ対象とするHTTPステータスコード。
+            headers (dict): リクエストに付与するヘッダ。
+        """
+        self.max_workers = max_workers
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.retry_status_codes = set(retry_status_codes)
+        self.headers = headers
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self.session = requests.Session()
+        # リトライは`fetch_response`で行うため、アダプタではリトライしない
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers, max_retries=0
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {"Accept-Encoding": FETCH_ACCEPT_ENCODING, **headers}
+        )
+
+    def close(self):
+        """
+        キープアライブ中の接続を閉じる。
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_bucket(self, url: str) -> TokenBucket:
+        """
+        URLのホストに対応するトークンバケットを返す（無ければ作成する）。
+        """
+        host = urlsplit(url).netloc
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate_per_second, self.burst)
+            return self._buckets[host]
+
+    def _backoff_seconds(self, attempt: int, error: Exception) -> float:
+        """
+        リトライまでの待機秒数を返す。429で`Retry-After`があればそれを優先する。
+        """
+        if isinstance(error, HTTPError) and error.headers is not None:
+            retry_after = error.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(self.backoff_max, float(retry_after))
+        backoff = min(self.backoff_max, self.backoff_base * (2**attempt))
+        # 複数スレッドのリトライが同時に集中しないようにジッタを加える
+        return backoff * random.uniform(0.5, 1.0)
+
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, HTTPError):
+            return error.code in self.retry_status_codes
+        return isinstance(
+            error,
+            (
+                URLError,
+                TimeoutError,
+                ConnectionError,
+                requests.ConnectionError,
+                requests.Timeout,
+            ),
+        )
+
+    def fetch_response(
+        self, url: str, etag: str = None, last_modified: str = None
+    ) -> FetchResponse:
+        """
+        レート制限とリトライを適用して1つのURLを取得する。
+
+        `etag`・`last_modified`を渡した場合は`If-None-Match`・`If-Modified-Since`を付けて
+        条件付きで取得し、ページが変わっていなければ本文の無い304の結果を返す。
+
+        Args:
+            url (str): 取得対象のURL。
+            etag (str, optional): 前回取得時の`ETag`。
+            last_modified (str, optional): 前回取得時の`Last-Modified`。
+
+        Returns:
+            FetchResponse: ステータス・本文・検証子。
+
+        Raises:
+            HTTPError: リトライ対象外のステータス、またはリトライ上限に達した場合。
+            requests.RequestException: 通信エラーがリトライ上限まで続いた場合。
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        bucket = self._get_bucket(url)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            start = time.perf_counter()
+            try:
+                with self.session.get(
+                    url, headers=headers, timeout=self.timeout, stream=True
+                ) as response:
+                    # 本文を読み切ってから閉じることで、304やエラーでも接続を使い回せる
+                    content = response.content
+                    if response.status_code >= 400:
+                        # 呼び出し側とリトライ判定はurllibと同じHTTPErrorで扱う
+                        raise HTTPError(
+                            url,
+                            response.status_code,
+                            response.reason,
+                            response.headers,
+                            None,
+                        )
+                    body = None if response.status_code == 304 else content
+                    # 圧縮されたままの受信バイト数
+                    wire_bytes = response.raw.tell()
+                metrics.observe("fetch_seconds", time.perf_counter() - start)
+                metrics.count("fetch_wire_bytes", wire_bytes)
+                if body is None:
+                    metrics.count("fetch_not_modified")
+                else:
+                    metrics.count("fetch_bytes", len(body))
+                return FetchResponse(
+                    response.status_code,
+                    body,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                )
+            except Exception as e:
+                metrics.observe("fetch_seconds", time.perf_counter() - start)
+                if not self._is_retryable(e) or attempt >= self.max_retries:
+                    metrics.count("fetch_errors")
+                    raise
+                metrics.count("fetch_retries")
+                wait_seconds = self._backoff_seconds(attempt, e)
+                logger.warning(f"retry {attempt + 1}/{self.max_retries}: {url} - {e}")
+                time.sleep(wait_seconds)
+                attempt += 1
+
+    def fetch(self, url: str) -> bytes:
+        """
+        レート制限とリトライを適用して1つのURLを取得し、レスポンスボディを返す。
+
+        Args:
+            url (str): 取得対象のURL。
+
+        Returns:
+            bytes: 展開済みのレスポンスボディ。
+
+        Raises:
+            HTTPError: リトライ対象外のステータス、またはリトライ上限に達した場合。
+            requests.RequestException: 通信エラーがリトライ上限まで続いた場合。
+        """
+        return self.fetch_response(url).body
+
+    def fetch_many_responses(self, items, validators: dict = None):
+        """
+        複数のURLを並列に取得し、完了した順に`FetchResponse`を返すジェネレータ。
+
+        実行中のリクエストは`max_workers`の2倍までに抑えるため、対象が多くても
+        未処理のFutureが溜まり続けることはない。
+
+        Args:
+            items (Iterable[tuple]): `(key, url)` のイテラブル。keyは結果の識別に用いる。
+            validators (dict, optional): keyをキー、`(etag, last_modified)`を値とする辞書。
+                含まれるkeyは条件付きで取得し、変わっていなければ304の結果となる。
+
+        Yields:
+            tuple: `(key, response, error)`。成功時は`error`がNone、失敗時は`response`がNone。
+        """
+        items = iter(items)
+        validators = validators or {}
+        max_in_flight = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = {}
+
+            def submit_next():
+                for key, url in items:
+                    etag, last_modified = validators.get(key, (None, None))
+                    future = executor.submit(
+                        self.fetch_response, url, etag, last_modified
+                    )
+                    in_flight[future] = key
+                    if len(in_flight) >= max_in_flight:
+                        return
+
+            submit_next()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = in_flight.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        yield key, future.result(), None
+                    else:
+                        yield key, None, error
+                submit_next()
+
+    def fetch_many(self, items):
+        """
+        複数のURLを並列に取得し、完了した順に結果を返すジェネレータ。
+
+        Args:
+            items (Iterable[tuple]): `(key, url)` のイテラブル。keyは結果の識別に用いる。
+
+        Yields:
+            tuple: `(key, html, error)`。成功時は`error`がNone、失敗時は`html`がNone。
+        """
+        for key, response, error in self.fetch_many_responses(items):
+            yield key, None if response is None else response.body, error
+
+    def fetch_all(self, urls: list) -> list:
+        """
+        複数のURLを並列に取得し、入力と同じ順序でレスポンスボディのリストを返す。
+
+        Args:
+            urls (list): 取得対象のURLのリスト。
+
+        Returns:
+            list: 各URLのレスポンスボディ。
+
+        Raises:
+            Exception: いずれかのURLの取得に失敗した場合、その例外をそのまま送出する。
+        """
+        results = [None] * len(urls)
+        for index, html, error in self.fetch_many(enumerate(urls)):
+            if error is not None:
+                raise error
+            results[index] = html
+        return results
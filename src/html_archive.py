@@ -0,0 +1,136 @@
+import gzip
+import time
+from pathlib import Path
+
+
+class HtmlArchive:
+    INDEX_SUFFIX = ".idx"
+
+    def __init__(self, pack_path: Path):
+        """
+        HTMLを圧縮して1ファイルに追記していくアーカイブ。
+
+        本体(`*.pack`)にはgzip圧縮したHTMLを追記し、索引(`*.pack.idx`)には
+        `id, offset, length, stored_at` をタブ区切りで1行ずつ追記する。
+        索引は初期化時に辞書として読み込むため、存在確認と読み出しはO(1)で行える。
+        同じIDが複数回書き込まれた場合は最後のものが有効となる。
+
+        Args:
+            pack_path (Path): アーカイブ本体のパス。索引は同じ場所に`.idx`を付けて作成される。
+        """
+        self.pack_path = Path(pack_path)
+        self.index_path = self.pack_path.with_name(
+            self.pack_path.name + self.INDEX_SUFFIX
+        )
+        self._index = {}
+        self._load_index()
+
+    def _load_index(self):
+        """
+        索引ファイルを読み込む。書き込み途中で中断された末尾の行は無視する。
+        """
+        if not self.index_path.is_file():
+            return
+        pack_size = self.pack_path.stat().st_size if self.pack_path.is_file() else 0
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                item_id, offset, length, stored_at = line.rstrip("\n").split("\t")
+                offset, length = int(offset), int(length)
+                if offset + length > pack_size:
+                    break
+                self._index[item_id] = (offset, length, float(stored_at))
+
+    def __contains__(self, item_id) -> bool:
+        return str(item_id) in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def ids(self) -> list:
+        """
+        格納されているIDを本体ファイル内の並び順で返す。
+
+        Returns:
+            list: IDのリスト。
+        """
+        return sorted(self._index, key=lambda item_id: self._index[item_id][0])
+
+    def locate(self, item_id) -> tuple:
+        """
+        IDに対応するデータの本体ファイル内の位置を返す。
+
+        Returns:
+            tuple: `(offset, length)`。
+        """
+        offset, length, _ = self._index[str(item_id)]
+        return offset, length
+
+    def stored_at(self, item_id) -> float:
+        """
+        IDに対応するデータが書き込まれた時刻(UNIX時間)を返す。
+        """
+        return self._index[str(item_id)][2]
+
+    def get(self, item_id) -> bytes:
+        """
+        IDに対応するHTMLを読み出す。
+
+        Args:
+            item_id (str): レースIDまたは馬ID。
+
+        Returns:
+            bytes: 展開済みのHTML。
+
+        Raises:
+            KeyError: IDが格納されていない場合。
+        """
+        offset, length = self.locate(item_id)
+        return self.read_at(self.pack_path, offset, length)
+
+    @staticmethod
+    def read_at(pack_path: Path, offset: int, length: int) -> bytes:
+        """
+        本体ファイルの指定位置からデータを読み出して展開する。
+
+        索引を持たない別プロセスからでも、`locate`で得た位置を渡せば読み出せる。
+        """
+        with open(pack_path, "rb") as f:
+            f.seek(offset)
+            return gzip.decompress(f.read(length))
+
+    def items(self):
+        """
+        格納されている`(id, html)`を本体ファイル内の並び順に返すジェネレータ。
+
+        ファイルを一度だけ開いて先頭から順に読むため、全件処理ではランダムアクセスより速い。
+        """
+        with open(self.pack_path, "rb") as f:
+            for item_id in self.ids():
+                offset, length = self.locate(item_id)
+                f.seek(offset)
+                yield item_id, gzip.decompress(f.read(length))
+
+    def put(self, item_id, html: bytes, stored_at: float = None):
+        """
+        HTMLを圧縮してアーカイブ末尾に追記する。
+
+        本体への書き込みが完了してから索引に追記するため、途中で中断されても
+        索引が壊れたデータを指すことはない。
+
+        Args:
+            item_id (str): レースIDまたは馬ID。
+            html (bytes): 保存するHTML。
+            stored_at (float, optional): 取得時刻(UNIX時間)。省略時は現在時刻。
+        """
+        item_id = str(item_id)
+        blob = gzip.compress(html)
+        stored_at = time.time() if stored_at is None else stored_at
+        self.pack_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.pack_path, "ab") as f:
+            offset = f.tell()
+            f.write(blob)
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(f"{item_id}\t{offset}\t{len(blob)}\t{stored_at}\n")
+        self._index[item_id] = (offset, len(blob), stored_at)
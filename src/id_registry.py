@@ -0,0 +1,143 @@
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class IdRegistry:
+    SUFFIX = ".tsv"
+    MISSING_CODE = -1
+
+    def __init__(self, registry_dir: Path, kinds: list):
+        """
+        馬・騎手・調教師・馬主などの外部IDを、連番のint32のコードに対応付ける台帳。
+
+        コードは種類毎に0から登録順に振り、一度振ったコードは変えない。
+        台帳は種類毎に`[種類].tsv`へ`code, id`を1行ずつ追記するため、処理が中断しても
+        それまでに振ったコードは失われない。テーブルにはコードだけを保存し、
+        表示やURLの組み立てには`decode`で元のIDの文字列に戻す。
+
+        Args:
+            registry_dir (Path): 台帳を保存するディレクトリ。
+            kinds (list): 登録するIDの種類（列名）のリスト。
+        """
+        self.registry_dir = Path(registry_dir)
+        self.kinds = list(kinds)
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def path(self, kind: str) -> Path:
+        return self.registry_dir / f"{kind}{self.SUFFIX}"
+
+    def _index(self, kind: str) -> pd.Index:
+        """
+        種類毎の台帳を読み込み、位置がコードとなる`pandas.Index`を返す。
+        書き込み途中で中断された末尾の行は無視する。
+        """
+        if kind not in self.kinds:
+            raise ValueError(f"unknown id kind: {kind}")
+        if kind not in self._ids:
+            ids = []
+            path = self.path(kind)
+            if path.is_file():
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.endswith("\n"):
+                            break
+                        code, item_id = line.rstrip("\n").split("\t")
+                        if int(code) != len(ids):
+                            raise ValueError(f"{path}: broken registry at code {code}")
+                        ids.append(item_id)
+            self._ids[kind] = pd.Index(ids, dtype=object)
+        return self._ids[kind]
+
+    def __len__(self) -> int:
+        return sum(len(self._index(kind)) for kind in self.kinds)
+
+    def size(self, kind: str) -> int:
+        return len(self._index(kind))
+
+    def encode(self, kind: str, ids) -> np.ndarray:
+        """
+        IDをコードに変換する。未登録のIDには新しいコードを振り、台帳に追記する。
+
+        Args:
+            kind (str): IDの種類（例: `horse_id`）。
+            ids (array-like): 変換するIDの列。数値で渡された場合も文字列として扱う。
+
+        Returns:
+            numpy.ndarray: int32のコードの配列。欠損値は`MISSING_CODE`となる。
+        """
+        values = pd.Series(ids, dtype="string").reset_index(drop=True)
+        missing = values.isna().to_numpy()
+        keys = values[~missing].to_numpy(dtype=object)
+        with self._lock:
+            index = self._index(kind)
+            found = index.get_indexer(keys)
+            new_ids = pd.unique(keys[found < 0])
+            if len(new_ids):
+                start = len(index)
+                self.registry_dir.mkdir(parents=True, exist_ok=True)
+                with open(self.path(kind), "a", encoding="utf-8") as f:
+                    f.writelines(
+                        f"{start + i}\t{item_id}\n" for i, item_id in enumerate(new_ids)
+                    )
+                index = index.append(pd.Index(new_ids, dtype=object))
+                self._ids[kind] = index
+                found = index.get_indexer(keys)
+        if len(index) > np.iinfo(np.int32).max:
+            raise OverflowError(f"{kind}: too many ids for int32 codes")
+        codes = np.full(len(values), self.MISSING_CODE, dtype=np.int32)
+        codes[~missing] = found
+        return codes
+
+    def lookup(self, kind: str, ids) -> np.ndarray:
+        """
+        登録済みのIDをコードに変換する。`encode`と異なり台帳には追記せず、
+        未登録のIDと欠損値は`MISSING_CODE`となる。
+        """
+        values = pd.Series(ids, dtype="string").reset_index(drop=True)
+        missing = values.isna().to_numpy()
+        codes = np.full(len(values), self.MISSING_CODE, dtype=np.int32)
+        with self._lock:
+            codes[~missing] = self._index(kind).get_indexer(
+                values[~missing].to_numpy(dtype=object)
+            )
+        return codes
+
+    def decode(self, kind: str, codes) -> np.ndarray:
+        """
+        コードを元のIDの文字列に戻す。`MISSING_CODE`はNoneとなる。
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        ids = self._index(kind).to_numpy(dtype=object)
+        result = np.full(len(codes), None, dtype=object)
+        valid = codes != self.MISSING_CODE
+        result[valid] = ids[codes[valid]]
+        return result
+
+    def encode_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        データフレームに含まれる登録対象のID列（インデックスを含む）をコードに置き換える。
+        すでに整数のコードになっている列はそのままにする。
+        """
+        df = df.copy()
+        for kind in self.kinds:
+            if kind in df.columns and not pd.api.types.is_integer_dtype(df[kind]):
+                df[kind] = self.encode(kind, df[kind])
+        if df.index.name in self.kinds and not pd.api.types.is_integer_dtype(df.index):
+            df.index = pd.Index(
+                self.encode(df.index.name, df.index), name=df.index.name
+            )
+        return df
+
+    def decode_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        データフレームに含まれるコードの列を、表示用に元のIDの文字列に戻す。
+        """
+        df = df.copy()
+        for kind in self.kinds:
+            if kind in df.columns and pd.api.types.is_integer_dtype(df[kind]):
+                df[kind] = pd.array(self.decode(kind, df[kind]), dtype="string")
+        return df
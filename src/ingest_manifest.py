@@ -0,0 +1,97 @@
+import os
+from pathlib import Path
+
+
+class IngestManifest:
+    COLUMNS = ("id", "length", "stored_at", "partition")
+
+    def __init__(self, manifest_path: Path):
+        """
+        HTMLアーカイブ内のどのページをどの出力パーティションへ取り込み済みかを記録する台帳。
+
+        各IDについて、取り込んだ時点のアーカイブ上のサイズ(`length`)と取得時刻(`stored_at`)、
+        出力先のパーティションをタブ区切りで保存する。アーカイブ側の値と比較することで、
+        新規または再取得されたページだけを判定できる。
+
+        Args:
+            manifest_path (Path): 台帳ファイルのパス。
+        """
+        self.manifest_path = Path(manifest_path)
+        self._entries = {}
+        if self.manifest_path.is_file():
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                next(f)  # ヘッダ
+                for line in f:
+                    item_id, length, stored_at, partition = line.rstrip("\n").split(
+                        "\t"
+                    )
+                    self._entries[item_id] = (int(length), float(stored_at), partition)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _signature(archive, item_id) -> tuple:
+        _, length = archive.locate(item_id)
+        return length, archive.stored_at(item_id)
+
+    def changed_ids(self, archive, id_list) -> list:
+        """
+        未取り込み、またはアーカイブ上のページが取り込み後に更新されたIDを返す。
+
+        Args:
+            archive (HtmlArchive): 取り込み元のHTMLアーカイブ。
+            id_list (list): 判定対象のIDのリスト。
+
+        Returns:
+            list: 取り込みが必要なIDのリスト（`id_list`の順序を保つ）。
+        """
+        changed = []
+        for item_id in id_list:
+            entry = self._entries.get(str(item_id))
+            if item_id not in archive:
+                changed.append(item_id)
+            elif entry is None or entry[:2] != self._signature(archive, item_id):
+                changed.append(item_id)
+        return changed
+
+    def partition_of(self, item_id):
+        """
+        取り込み済みのIDの出力パーティションを返す。未取り込みの場合はNone。
+        """
+        entry = self._entries.get(str(item_id))
+        return None if entry is None else entry[2]
+
+    def record(self, archive, id_list, partition_func):
+        """
+        IDを取り込み済みとして記録する。アーカイブに存在しないIDは無視する。
+
+        Args:
+            archive (HtmlArchive): 取り込み元のHTMLアーカイブ。
+            id_list (list): 取り込んだIDのリスト。
+            partition_func (callable): IDから出力パーティション名を求める関数。
+        """
+        for item_id in id_list:
+            if item_id not in archive:
+                continue
+            length, stored_at = self._signature(archive, item_id)
+            self._entries[str(item_id)] = (length, stored_at, partition_func(item_id))
+
+    def clear(self):
+        """
+        記録をすべて削除する（全件を取り込み直す場合に使用する）。
+        """
+        self._entries = {}
+
+    def save(self):
+        """
+        台帳をファイルに保存する。書き込み途中で中断しても既存の台帳が壊れないよう、
+        一時ファイルに書き出してから置き換える。
+        """
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\t".join(self.COLUMNS) + "\n")
+            for item_id, (length, stored_at, partition) in self._entries.items():
+                f.write(f"{item_id}\t{length}\t{stored_at}\t{partition}\n")
+        os.replace(tmp_path, self.manifest_path)
@@ -1,25 +1,160 @@
 import json
+from collections import deque
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
+
+class CompiledMapping:
+    def __init__(self, mapping: dict):
+        """
+        マッピングの辞書を、キーの索引と値のカテゴリ型に変換したもの。
+
+        値をカテゴリ型のカテゴリとし、キーの位置からカテゴリのコードを引く配列を持つ。
+        `map`では対象の列を一意な値に分解(`factorize`)してからキーの位置を引き、
+        コードの配列を`take`で展開するため、行毎に辞書を引く必要がない。
+
+        Args:
+            mapping (dict): キーを元の値、値を変換後の値とする辞書。
+        """
+        self.keys = pd.Index(list(mapping.keys()), dtype=object)
+        values = pd.Index(list(mapping.values()))
+        self.dtype = pd.CategoricalDtype(values.unique().sort_values())
+        # キーの位置 -> カテゴリのコード（末尾は見つからなかった場合の-1）
+        self.key_codes = np.append(
+            self.dtype.categories.get_indexer(values), -1
+        ).astype(np.int32)
+
+    def codes(self, values) -> np.ndarray:
+        """
+        値の配列をカテゴリのコードの配列に変換する。マッピングに無い値と欠損値は-1となる。
+        """
+        value_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        positions = self.keys.get_indexer(uniques)
+        unique_codes = self.key_codes[positions]
+        return np.append(unique_codes, -1).astype(np.int32).take(value_codes)
+
+    def map(self, series: pd.Series) -> pd.Series:
+        """
+        列をマッピングし、カテゴリ型の列として返す。マッピングに無い値は欠損値となる。
+        """
+        return pd.Series(
+            pd.Categorical.from_codes(self.codes(series), dtype=self.dtype),
+            index=series.index,
+            name=series.name,
+        )
+
+
+class KeywordMatcher:
+    def __init__(self, mapping: dict):
+        """
+        文字列の中からマッピングのキーを探し、対応する値に変換する複数パターンの照合器。
+
+        キーからAho-Corasick法のオートマトンを1度だけ構築し、文字列を1回走査してすべての
+        出現位置を求める。複数のキーが見つかった場合は、開始位置が最も前のものを優先し、
+        同じ位置から始まるものは長いキーを優先する（例: "G"より"G1"）。長さも同じ場合は
+        辞書の先に書かれたキーを優先する。照合は一意な文字列だけに行い、結果を`take`で展開する。
+
+        Args:
+            mapping (dict): キーを探す文字列、値を変換後の値とする辞書。
+        """
+        self.mapping = CompiledMapping(mapping)
+        self.patterns = list(mapping.keys())
+        self._max_length = max((len(pattern) for pattern in self.patterns), default=0)
+        # goto: ノード毎の遷移、output: ノードで終わるパターンの番号
+        self._goto = [{}]
+        self._output = [[]]
+        for number, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._output.append([])
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._output[node].append(number)
+        # 失敗遷移を幅優先で求め、接尾辞で終わるパターンも出力に加える
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = (
+                    self._output[child] + self._output[self._fail[child]]
+                )
+
+    def find(self, text) -> str:
+        """
+        文字列の中で優先度の最も高いキーを返す。見つからない場合はNoneを返す。
+        """
+        if not isinstance(text, str):
+            return None
+        best = None
+        node = 0
+        for end, char in enumerate(text, start=1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for number in self._output[node]:
+                length = len(self.patterns[number])
+                rank = (end - length, -length, number)
+                if best is None or rank < best:
+                    best = rank
+            # 最も前の開始位置が確定したら、それ以降は走査しない
+            if best is not None and end - best[0] >= self._max_length:
+                break
+        return None if best is None else self.patterns[best[2]]
+
+    def map(self, series: pd.Series) -> pd.Series:
+        """
+        列の各文字列からキーを探し、対応する値をカテゴリ型の列として返す。
+        キーが見つからない場合は欠損値となる。
+        """
+        value_codes, uniques = pd.factorize(series)
+        found = [self.find(text) for text in uniques]
+        unique_codes = np.append(self.mapping.codes(found), -1).astype(np.int32)
+        return pd.Series(
+            pd.Categorical.from_codes(
+                unique_codes.take(value_codes), dtype=self.mapping.dtype
+            ),
+            index=series.index,
+            name=series.name,
+        )
+
 
 class MappingLoader:
+    MAPPING_NAMES = (
+        "sex",
+        "weather",
+        "race_type",
+        "ground_state",
+        "race_class",
+        "around",
+        "race_class_info",
+        "place",
+    )
+
     def __init__(self, mapping_dir: Path):
         """
-        初期化メソッド。指定されたディレクトリからマッピングファイルをロードします。
+        初期化メソッド。マッピングファイルのディレクトリを設定する。
+
+        各マッピングは初めて参照されたときにJSONファイルから読み込み、以降は読み込み済みの辞書を返す。
 
         Args:
             mapping_dir (str): マッピングファイルが保存されているディレクトリのパス。
         """
         self.mapping_dir = Path(mapping_dir)
-        # マッピングを格納する辞書
-        self.SEX_MAPPING = {}
-        self.WEATHER_MAPPING = {}
-        self.RACE_TYPE_MAPPING = {}
-        self.GROUND_STATE_MAPPING = {}
-        self.RACE_CLASS_MAPPING = {}
-        self.AROUND_MAPPING = {}
-        self.RACE_CLASS_INFO_MAPPING = {}
-        self.PLACE_MAPPING = {}
+        # 読み込み済みのマッピングを格納する辞書
+        self._mappings = {}
+        # 変換済みのマッピング・照合器を格納する辞書
+        self._compiled = {}
+        self._matchers = {}
 
     def load_mapping(self, mapping_name: str):
         """
@@ -42,45 +177,73 @@ class MappingLoader:
             print(f"Error: {mapping_name}.json is not a valid JSON file.")
             return {}
 
+    def get_mapping(self, mapping_name: str) -> dict:
+        """
+        マッピングを返す。未読み込みの場合はJSONファイルから読み込む。
+
+        Args:
+            mapping_name (str): マッピング名（拡張子なしのファイル名）。
+
+        Returns:
+            dict: マッピングの辞書。
+        """
+        if mapping_name not in self._mappings:
+            self._mappings[mapping_name] = self.load_mapping(mapping_name)
+        return self._mappings[mapping_name]
+
+    def get_compiled(self, mapping_name: str) -> CompiledMapping:
+        """
+        マッピングを`CompiledMapping`に変換して返す。変換結果は同じインスタンス内で再利用する。
+        """
+        if mapping_name not in self._compiled:
+            self._compiled[mapping_name] = CompiledMapping(
+                self.get_mapping(mapping_name)
+            )
+        return self._compiled[mapping_name]
+
+    def get_matcher(self, mapping_name: str) -> KeywordMatcher:
+        """
+        マッピングのキーを探す`KeywordMatcher`を返す。構築結果は同じインスタンス内で再利用する。
+        """
+        if mapping_name not in self._matchers:
+            self._matchers[mapping_name] = KeywordMatcher(
+                self.get_mapping(mapping_name)
+            )
+        return self._matchers[mapping_name]
+
     def load_all_mappings(self):
         """
-        必要なすべてのマッピングファイルを読み込み、インスタンス変数にセットする関数。
+        必要なすべてのマッピングファイルをまとめて読み込む関数（事前に読み込んでおきたい場合に使用する）。
 
         Returns:
             None
         """
-        self.SEX_MAPPING = self.load_mapping("sex")
-        self.WEATHER_MAPPING = self.load_mapping("weather")
-        self.RACE_TYPE_MAPPING = self.load_mapping("race_type")
-        self.GROUND_STATE_MAPPING = self.load_mapping("ground_state")
-        self.RACE_CLASS_MAPPING = self.load_mapping("race_class")
-        self.AROUND_MAPPING = self.load_mapping("around")
-        self.RACE_CLASS_INFO_MAPPING = self.load_mapping("race_class_info")
-        self.PLACE_MAPPING = self.load_mapping("place")
+        for mapping_name in self.MAPPING_NAMES:
+            self.get_mapping(mapping_name)
 
     def get_sex_mapping(self):
-        return self.SEX_MAPPING
+        return self.get_mapping("sex")
 
     def get_weather_mapping(self):
-        return self.WEATHER_MAPPING
+        return self.get_mapping("weather")
 
     def get_race_type_mapping(self):
-        return self.RACE_TYPE_MAPPING
+        return self.get_mapping("race_type")
 
     def get_ground_state_mapping(self):
-        return self.GROUND_STATE_MAPPING
+        return self.get_mapping("ground_state")
 
     def get_race_class_mapping(self):
-        return self.RACE_CLASS_MAPPING
+        return self.get_mapping("race_class")
 
     def get_around_mapping(self):
-        return self.AROUND_MAPPING
+        return self.get_mapping("around")
 
     def get_race_class_info_mapping(self):
-        return self.RACE_CLASS_INFO_MAPPING
+        return self.get_mapping("race_class_info")
 
     def get_place_mapping(self):
-        return self.PLACE_MAPPING
+        return self.get_mapping("place")
 
 
 # # 使用
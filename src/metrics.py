@@ -0,0 +1,273 @@
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.logger_setting import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def peak_rss_bytes() -> int:
+    """
+    このプロセスの最大常駐メモリ（バイト）を返す。
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windowsではresourceが無いため、psutilのピークワーキングセットを使う
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト単位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        """
+        上限値毎の件数を数えるヒストグラム（Prometheusのhistogramと同じ累積の形で出力する）。
+
+        Args:
+            buckets (tuple): 各区間の上限値（昇順）。最後の区間の上は`+Inf`として数える。
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        区間の上限値から分位点を近似する（`+Inf`の区間に入る場合は最後の上限値を返す）。
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def to_dict(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class Metrics:
+    LATENCY_BUCKETS = (
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    )  # fmt: skip
+    PROMETHEUS_PREFIX = "horse_racing_"
+
+    def __init__(self):
+        """
+        1回の実行の計測値（段階毎の時間・メモリ、処理時間のヒストグラム、件数・バイト数のカウンタ）を集める。
+
+        - `stage(name)`: 段階の経過時間・CPU時間・終了時点の最大常駐メモリを記録する。
+          CPU時間はプロセス全体の値のため、並行に実行した段階の分も含まれる。
+        - `observe(name, seconds)` / `time(name)`: 取得・解析1件あたりの所要時間をヒストグラムに加える。
+        - `count(name, value)`: スキップ・失敗・解析したページ数や読み書きしたバイト数を加算する。
+
+        `write`でJSONとPrometheusのテキスト形式のファイルに保存し、`summary`で要約を返す。
+        複数のスレッドから同時に呼び出してよい。
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.LATENCY_BUCKETS)
+            self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def time(self, name: str):
+        """
+        ブロックの所要時間を`name`のヒストグラムに加える。
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        段階の経過時間・CPU時間・最大常駐メモリを記録する。例外で終了した場合も`failed`として記録する。
+        """
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_rss = peak_rss_bytes()
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            with self._lock:
+                self.stages[name] = {
+                    "status": status,
+                    "wall_seconds": time.perf_counter() - start_wall,
+                    "cpu_seconds": time.process_time() - start_cpu,
+                    "start_peak_rss_bytes": start_rss,
+                    "peak_rss_bytes": peak_rss_bytes(),
+                }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "finished_at": time.time(),
+                "pid": os.getpid(),
+                "peak_rss_bytes": peak_rss_bytes(),
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: histogram.to_dict()
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        計測値をPrometheusのテキスト形式（node_exporterのtextfileで読み込める形式）で返す。
+        """
+        snapshot = self.snapshot()
+        prefix = self.PROMETHEUS_PREFIX
+        lines = []
+        for field in ("wall_seconds", "cpu_seconds", "peak_rss_bytes"):
+            metric = f"{prefix}stage_{field}"
+            lines.append(f"# TYPE {metric} gauge")
+            for name, stage in snapshot["stages"].items():
+                lines.append(f'{metric}{{stage="{name}"}} {stage[field]}')
+        for name, value in snapshot["counters"].items():
+            metric = f"{prefix}{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, histogram in snapshot["histograms"].items():
+            metric = f"{prefix}{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{metric}_sum {histogram['sum']}")
+            lines.append(f"{metric}_count {histogram['count']}")
+        lines.append(f"# TYPE {prefix}peak_rss_bytes gauge")
+        lines.append(f"{prefix}peak_rss_bytes {snapshot['peak_rss_bytes']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_dir: Path, run_name: str = None) -> Path:
+        """
+        計測値を`[run_name].json`と`[run_name].prom`として保存し、JSONのパスを返す。
+
+        Args:
+            metrics_dir (Path): 保存先のディレクトリ。
+            run_name (str, optional): ファイル名。省略時は開始時刻から作る。
+        """
+        if run_name is None:
+            run_name = "run-" + time.strftime(
+                "%Y%m%d-%H%M%S", time.localtime(self.started_at)
+            )
+        metrics_dir = Path(metrics_dir)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        json_path = metrics_dir / f"{run_name}.json"
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        with open(metrics_dir / f"{run_name}.prom", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        return json_path
+
+    def summary(self) -> str:
+        """
+        段階毎の時間・メモリ、カウンタ、ヒストグラムの件数と分位点を表形式の文字列で返す。
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, stage in snapshot["stages"].items():
+            lines.append(
+                f"{name:<32} {stage['status']:<6} wall {stage['wall_seconds']:8.2f}s "
+                f"cpu {stage['cpu_seconds']:8.2f}s "
+                f"peak {stage['peak_rss_bytes'] / 1024**2:8.1f} MiB"
+            )
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name:<32} {value:>12,.0f}")
+        with self._lock:
+            histograms = dict(self.histograms)
+        for name, histogram in sorted(histograms.items()):
+            lines.append(
+                f"{name:<32} n={histogram.count:<8} "
+                f"mean {histogram.sum / max(histogram.count, 1) * 1000:8.1f} ms "
+                f"p50<={histogram.quantile(0.5) * 1000:.0f} ms "
+                f"p99<={histogram.quantile(0.99) * 1000:.0f} ms"
+            )
+        return "\n".join(lines)
+
+
+class Progress:
+    def __init__(self, label: str, total: int = None, interval: float = 10.0, log=None):
+        """
+        処理件数を一定間隔でだけログに出力する進捗表示（1件毎にログを出さないために使う）。
+
+        Args:
+            label (str): ログに付ける名前。
+            total (int, optional): 全体の件数。
+            interval (float, optional): ログを出力する最短の間隔（秒）。
+            log (logging.Logger, optional): 出力先のロガー。
+        """
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.log = log or logger
+        self.done = 0
+        self._start = time.monotonic()
+        self._last = self._start
+
+    def update(self, n: int = 1):
+        self.done += n
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._emit(now)
+
+    def close(self):
+        self._emit(time.monotonic())
+
+    def _emit(self, now: float):
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        total = f"/{self.total}" if self.total is not None else ""
+        self.log.info(
+            f"{self.label}: {self.done}{total} ({rate:.1f}/s, {elapsed:.0f}s)"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
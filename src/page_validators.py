@@ -0,0 +1,134 @@
+import threading
+import time
+from pathlib import Path
+
+
+class PageValidators:
+    def __init__(self, path: Path):
+        """
+        取得したページの検証子（`ETag`・`Last-Modified`）と最後に確認した時刻の台帳。
+
+        台帳には`id, etag, last_modified, checked_at, failures, failed_at`をタブ区切りで
+        1行ずつ追記し、同じIDが複数回書き込まれた場合は最後のものが有効となる
+        （`failures`・`failed_at`の無い4列の行は失敗無しとして読む）。
+        再取得時にこの値を`If-None-Match`・`If-Modified-Since`として送ることで、
+        変更の無いページは本文を受け取らずに304で確認できる。
+        取得に失敗した場合は`put_failure`で連続した失敗の回数と時刻を記録し、
+        取得できた時点で（`put`）回数を0に戻す。
+
+        Args:
+            path (Path): 台帳ファイルのパス。
+        """
+        self.path = Path(path)
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        """
+        台帳を読み込む。書き込み途中で中断された末尾の行は無視する。
+        """
+        if self._entries is None:
+            entries = {}
+            if self.path.is_file():
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.endswith("\n"):
+                            break
+                        fields = line.rstrip("\n").split("\t")
+                        item_id, etag, last_modified, checked_at = fields[:4]
+                        failures, failed_at = (fields[4:] + ["0", ""])[:2]
+                        entries[item_id] = (
+                            etag or None,
+                            last_modified or None,
+                            float(checked_at) if checked_at else None,
+                            int(failures),
+                            float(failed_at) if failed_at else None,
+                        )
+            self._entries = entries
+        return self._entries
+
+    def __contains__(self, item_id) -> bool:
+        return str(item_id) in self._load()
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def get(self, item_id) -> tuple:
+        """
+        IDの検証子を返す。
+
+        Returns:
+            tuple: `(etag, last_modified)`。記録が無い場合は`(None, None)`。
+        """
+        entry = self._load().get(str(item_id))
+        return (None, None) if entry is None else entry[:2]
+
+    def checked_at(self, item_id) -> float:
+        """
+        IDのページを最後に取得または確認した時刻(UNIX時間)を返す。記録が無い場合はNone。
+        """
+        entry = self._load().get(str(item_id))
+        return None if entry is None else entry[2]
+
+    def failures(self, item_id) -> tuple:
+        """
+        IDのページの連続した取得失敗を返す。
+
+        Returns:
+            tuple: `(回数, 最後に失敗した時刻(UNIX時間))`。失敗していない場合は`(0, None)`。
+        """
+        entry = self._load().get(str(item_id))
+        return (0, None) if entry is None else entry[3:]
+
+    def _append(self, item_id: str, entry: tuple):
+        etag, last_modified, checked_at, failures, failed_at = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(
+                f"{item_id}\t{etag or ''}\t{last_modified or ''}\t"
+                f"{'' if checked_at is None else checked_at}\t{failures}\t"
+                f"{'' if failed_at is None else failed_at}\n"
+            )
+        self._entries[item_id] = entry
+
+    def put(
+        self,
+        item_id,
+        etag: str = None,
+        last_modified: str = None,
+        checked_at: float = None,
+    ):
+        """
+        IDの検証子と確認した時刻を追記する。
+
+        Args:
+            item_id (str): レースIDまたは馬ID。
+            etag (str, optional): レスポンスの`ETag`。
+            last_modified (str, optional): レスポンスの`Last-Modified`。
+            checked_at (float, optional): 確認した時刻(UNIX時間)。省略時は現在時刻。
+        """
+        item_id = str(item_id)
+        checked_at = time.time() if checked_at is None else checked_at
+        with self._lock:
+            self._load()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._append(item_id, (etag, last_modified, checked_at, 0, None))
+
+    def put_failure(self, item_id, failed_at: float = None):
+        """
+        IDのページの取得に失敗したことを追記する。検証子と確認した時刻はそのまま引き継ぐ。
+
+        Args:
+            item_id (str): レースIDまたは馬ID。
+            failed_at (float, optional): 失敗した時刻(UNIX時間)。省略時は現在時刻。
+        """
+        item_id = str(item_id)
+        failed_at = time.time() if failed_at is None else failed_at
+        with self._lock:
+            entries = self._load()
+            etag, last_modified, checked_at, failures, _ = entries.get(
+                item_id, (None, None, None, 0, None)
+            )
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._append(
+                item_id, (etag, last_modified, checked_at, failures + 1, failed_at)
+            )
@@ -0,0 +1,84 @@
+import os
+import pickle
+from pathlib import Path
+
+import pandas as pd
+
+
+class PartitionStore:
+    def __init__(self, partition_dir: Path):
+        """
+        テーブルをパーティション単位でpickle保存するストア。
+
+        各パーティションはIDをインデックスとして持つDataFrameで、差分取り込み時は
+        更新のあったIDの行だけを置き換える。
+
+        Args:
+            partition_dir (Path): パーティションを保存するディレクトリ。
+        """
+        self.partition_dir = Path(partition_dir)
+
+    def _path(self, key) -> Path:
+        return self.partition_dir / f"{key}.pickle"
+
+    def keys(self) -> list:
+        """
+        保存されているパーティション名を昇順で返す。
+        """
+        if not self.partition_dir.is_dir():
+            return []
+        return sorted(path.stem for path in self.partition_dir.glob("*.pickle"))
+
+    def load(self, key):
+        """
+        パーティションを読み込む。存在しない場合はNoneを返す。
+        """
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        with open(path, "rb") as rf:
+            return pickle.load(rf)
+
+    def save(self, key, df: pd.DataFrame):
+        """
+        パーティションを保存する。一時ファイルに書き出してから置き換える。
+        """
+        self.partition_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as wf:
+            pickle.dump(df, wf)
+        os.replace(tmp_path, path)
+
+    def replace_rows(self, key, id_list, new_df_list):
+        """
+        パーティション内の指定IDの行を削除し、新しい行を末尾に追加して保存する。
+
+        Args:
+            key (str): パーティション名。
+            id_list (list): 置き換え対象のID。新しい行が無いIDは削除だけが行われる。
+            new_df_list (list): 追加するDataFrameのリスト。
+        """
+        df_list = []
+        stored_df = self.load(key)
+        if stored_df is not None:
+            df_list.append(stored_df[~stored_df.index.isin(id_list)])
+        df_list.extend(new_df_list)
+        df_list = [df for df in df_list if len(df) > 0]
+        if df_list:
+            self.save(key, pd.concat(df_list))
+        elif stored_df is not None:
+            self._path(key).unlink()
+
+    def clear(self):
+        """
+        すべてのパーティションを削除する。
+        """
+        for key in self.keys():
+            self._path(key).unlink()
+
+    def concat_all(self) -> pd.DataFrame:
+        """
+        すべてのパーティションをパーティション名の順に結合して返す。
+        """
+        return pd.concat([self.load(key) for key in self.keys()])
@@ -0,0 +1,280 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from src.logger_setting import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func,
+        inputs: list = (),
+        outputs: list = (),
+        volatile: bool = False,
+    ):
+        """
+        パイプラインの1段階。
+
+        Args:
+            name (str): 段階名。
+            func (callable): 引数無しで呼び出す処理。1回の実行で処理しきれなかった件数を
+                intで返した場合、0より大きければ次回の実行でも最新でないとみなす。
+            inputs (list): 入力ファイルのパスのリスト。
+            outputs (list): 出力ファイルのパスのリスト。
+            volatile (bool): Trueの場合は最新とみなさず、毎回実行する。
+                入力ファイルで表せない外部の状態（Webサイトなど）に依存する段階に使う。
+        """
+        self.name = name
+        self.func = func
+        self.inputs = [Path(path) for path in inputs]
+        self.outputs = [Path(path) for path in outputs]
+        self.volatile = volatile
+
+
+class Pipeline:
+    def __init__(
+        self, stages: list, state_path: Path, max_workers: int = 2, metrics=None
+    ):
+        """
+        入出力の宣言から依存関係を求め、段階を実行するパイプライン。
+
+        ある段階の入力が別の段階の出力であれば、その段階に依存するとみなす。
+        依存関係の無い段階は`max_workers`個のスレッドで並行に実行する。
+        完了した段階と、その時点の入力ファイルの更新時刻は`state_path`に記録し（チェックポイント）、
+        出力がすべて存在し、入力より新しく、記録後に入力が変わっていない段階は実行を省略する。
+        途中で失敗した場合も、再実行時は完了済みの段階を省略して失敗した段階から再開できる。
+
+        Args:
+            stages (list): `Stage`のリスト。
+            state_path (Path): チェックポイントを保存するJSONファイルのパス。
+            max_workers (int, optional): 同時に実行する段階の数。
+            metrics (Metrics, optional): 実行した段階の時間・メモリを記録する計測値。
+
+        Raises:
+            ValueError: 段階の依存関係が循環している場合。
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = Path(state_path)
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self._state_lock = threading.Lock()
+        producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                producers[output] = stage.name
+        self.dependencies = {
+            stage.name: sorted(
+                {producers[path] for path in stage.inputs if path in producers}
+                - {stage.name}
+            )
+            for stage in stages
+        }
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        """
+        依存関係が循環していないことを確かめる（循環していると実行できる段階が無くなり、
+        `run`が終わらないため）。依存の無い段階から順に取り除き、残った段階を循環とみなす。
+        """
+        remaining = {name: set(deps) for name, deps in self.dependencies.items()}
+        while True:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                break
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        # 循環の下流にあるだけの段階を除き、循環している段階だけを示す
+        while True:
+            needed = set().union(*remaining.values()) if remaining else set()
+            unneeded = [name for name in remaining if name not in needed]
+            if not unneeded:
+                break
+            for name in unneeded:
+                del remaining[name]
+        if remaining:
+            raise ValueError(
+                f"stage dependencies form a cycle: {', '.join(sorted(remaining))}"
+            )
+
+    def _load_state(self) -> dict:
+        if not self.state_path.is_file():
+            return {}
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, stage: Stage, input_mtimes: dict, pending: int = 0):
+        """
+        段階の完了を記録する。書き込み途中で中断しても既存の記録が壊れないよう置き換えで保存する。
+        """
+        with self._state_lock:
+            state = self._load_state()
+            state[stage.name] = {
+                "completed_at": time.time(),
+                "inputs": input_mtimes,
+                "pending": pending,
+            }
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_path)
+
+    @staticmethod
+    def _mtimes(paths: list) -> dict:
+        return {str(path): path.stat().st_mtime_ns for path in paths if path.exists()}
+
+    def is_up_to_date(self, name: str) -> bool:
+        """
+        段階の出力が最新かどうかを返す。
+
+        出力がすべて存在し、いずれの出力も入力より新しく、チェックポイントに完了が記録され、
+        記録時から入力ファイルの更新時刻が変わっていない場合に最新とみなす。
+        `volatile`な段階と、前回の実行で処理しきれなかった件数（`pending`）が残っている段階は
+        常に最新でないとみなす。
+        """
+        stage = self.stages[name]
+        if stage.volatile:
+            return False
+        if not all(path.exists() for path in stage.outputs):
+            return False
+        checkpoint = self._load_state().get(name)
+        if checkpoint is None or checkpoint.get("pending"):
+            return False
+        input_mtimes = self._mtimes(stage.inputs)
+        if len(input_mtimes) != len(stage.inputs):
+            return False
+        if checkpoint["inputs"] != input_mtimes:
+            return False
+        if input_mtimes and stage.outputs:
+            oldest_output = min(path.stat().st_mtime_ns for path in stage.outputs)
+            if oldest_output < max(input_mtimes.values()):
+                return False
+        return True
+
+    def upstream(self, names) -> list:
+        """
+        指定した段階と、それらが依存するすべての段階の名前を返す。
+        """
+        result = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in result:
+                result.add(name)
+                pending.extend(self.dependencies[name])
+        return [name for name in self.stages if name in result]
+
+    def downstream(self, names) -> list:
+        """
+        指定した段階と、それらに依存するすべての段階の名前を返す。
+        """
+        result = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for name, dependencies in self.dependencies.items():
+                if name not in result and result.intersection(dependencies):
+                    result.add(name)
+                    changed = True
+        return [name for name in self.stages if name in result]
+
+    def _run_stage(self, stage: Stage):
+        logger.info(f"{stage.name}: start")
+        start = time.perf_counter()
+        # 実行前の入力の状態を記録する（実行中に入力が更新された場合は次回に再実行される）
+        input_mtimes = self._mtimes(stage.inputs)
+        if self.metrics is None:
+            result = stage.func()
+        else:
+            with self.metrics.stage(stage.name):
+                result = stage.func()
+        pending = result if isinstance(result, int) and result > 0 else 0
+        self._save_checkpoint(stage, input_mtimes, pending)
+        logger.info(
+            f"{stage.name}: done ({time.perf_counter() - start:.1f}s)"
+            + (f", {pending} pending" if pending else "")
+        )
+
+    def run(
+        self,
+        only: list = None,
+        from_: list = None,
+        targets: list = None,
+        force: bool = False,
+    ) -> dict:
+        """
+        パイプラインを実行する。
+
+        Args:
+            only (list, optional): 指定した段階だけを実行する（最新かどうかに関わらず実行する）。
+            from_ (list, optional): 指定した段階とその下流の段階を、最新かどうかに関わらず実行する。
+                それより上流の段階は最新でなければ実行する。
+            targets (list, optional): 指定した段階とその上流の段階だけを対象にする。
+            force (bool, optional): Trueの場合はすべての対象段階を実行する。
+
+        Returns:
+            dict: 段階名をキー、`done`・`skipped`・`failed`・`blocked`を値とする辞書。
+
+        Raises:
+            RuntimeError: いずれかの段階が失敗した場合（失敗した段階の下流は実行しない）。
+        """
+        for name in (only or []) + (from_ or []) + (targets or []):
+            if name not in self.stages:
+                raise ValueError(f"unknown stage: {name}")
+        selected = list(self.stages) if targets is None else self.upstream(targets)
+        forced = set(selected) if force else set()
+        if only:
+            selected = [name for name in selected if name in only]
+            forced |= set(only)
+        if from_:
+            forced |= set(self.downstream(from_))
+
+        status = {}
+        remaining = list(selected)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while remaining or running:
+                for name in list(remaining):
+                    dependencies = [
+                        dep for dep in self.dependencies[name] if dep in selected
+                    ]
+                    if any(
+                        status.get(dep) in ("failed", "blocked") for dep in dependencies
+                    ):
+                        status[name] = "blocked"
+                        remaining.remove(name)
+                        logger.warning(f"{name}: blocked by failed upstream stage")
+                        continue
+                    if not all(dep in status for dep in dependencies):
+                        continue
+                    remaining.remove(name)
+                    if name not in forced and self.is_up_to_date(name):
+                        status[name] = "skipped"
+                        logger.info(f"{name}: skip (up to date)")
+                        continue
+                    running[executor.submit(self._run_stage, self.stages[name])] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        status[name] = "done"
+                    else:
+                        status[name] = "failed"
+                        logger.error(f"{name}: failed - {error!r}")
+
+        failed = [name for name, result in status.items() if result == "failed"]
+        if failed:
+            raise RuntimeError(f"failed stages: {', '.join(failed)}")
+        return status
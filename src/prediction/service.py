@@ -0,0 +1,521 @@
+import argparse
+import json
+import pickle
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from src.config import *
+from src.preprocessing.modules.asof_aggregation import AsofIndex, EntityAsofIndex
+from src.preprocessing.modules.feature_setting import (
+    ENTITY_VALUE_COLUMNS,
+    HORSE_N_RACES,
+    FeatureCreator,
+)
+
+# 直近nレースの集計に使うレース数（`FeatureCreator.agg_horse_n_races`と同じ）
+N_RACES = HORSE_N_RACES
+HISTORY_COLUMNS = [COLUMN_RANK, COLUMN_PRIZE]
+# 出走馬の列名の別名（英語の列名で送られた値を、`FEATURES_TABLE`のレース結果の列名にする）
+ENTRY_COLUMN_ALIASES = {
+    COLUMN_WAKUBAN: "枠番",
+    COLUMN_UMABAN: "馬番",
+    COLUMN_IMPOST: "斤量",
+    COLUMN_TANSYO: "単勝",
+    COLUMN_POPULARITY: "人気",
+}
+
+
+class HorseHistoryState:
+    def __init__(
+        self,
+        table: str = PREPROCESSED_HORSE_RESULTS_TABLE,
+        store: TableStore = table_store,
+        race_info_table: str = RACE_INFO_PREPROCESSING_TABLE,
+        entity_results_table: str = PREPROCESSED_RACE_RESULTS_TABLE,
+    ):
+        """
+        予測サービスがメモリ上に持つ、馬・騎手・調教師・馬主の過去成績の状態。
+
+        `PREPROCESSED_HORSE_RESULTS_TABLE`の着順・賞金を馬ID（文字列）と日付の順に並べた
+        `AsofIndex`として保持し、出走馬の直近nレースの平均を数マイクロ秒で求められるようにする。
+        騎手・調教師・馬主の成績も、`FeatureCreator.agg_entity_n_races`と同じ組み合わせ
+        （`ENTITY_FEATURE_COLUMNS`×`ENTITY_FEATURE_SPLITS`）の`EntityAsofIndex`として保持する。
+
+        - `refresh()`: テーブルが更新されていれば読み込み直して索引を作り直し、入れ替える。
+          作り直している間も、それまでの索引で問い合わせに答える。
+        - `add_results(df)`: 当日に確定した結果など、テーブルにまだ無い成績を馬の索引に追加する。
+          作り直した後も、テーブルに反映されるまでは追加した成績を引き継ぐ。
+          騎手などの成績は、テーブルが更新されて作り直すときに反映される。
+
+        Args:
+            table (str, optional): 馬の過去成績のテーブル名。
+            store (TableStore, optional): 読み込みに使うストア。
+            race_info_table (str, optional): 前処理済みレース情報のテーブル名。
+            entity_results_table (str, optional): 騎手・調教師・馬主の成績の集計に使う、
+                前処理済みのレース結果のテーブル名。
+        """
+        self.table = table
+        self.store = store
+        self.race_info_table = race_info_table
+        self.entity_results_table = entity_results_table
+        self.index = None
+        self.entity_indexes = {}
+        self.registry = None
+        self.added = None
+        self.loaded_mtime = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _tables(self) -> list:
+        return [self.table, self.race_info_table, self.entity_results_table]
+
+    def _load_index(self) -> tuple:
+        """
+        馬の索引・騎手などの索引・IDの台帳を読み込む。
+        """
+        history = self.store.read(
+            self.table, columns=[COLUMN_HORSE_ID, COLUMN_DATE, *HISTORY_COLUMNS]
+        )
+        # 起動後に追加されたコードも扱えるよう、台帳は毎回読み直す
+        registry = IdRegistry(ID_REGISTRY_DIR, ENTITY_ID_COLUMNS)
+        history[COLUMN_HORSE_ID] = registry.decode(
+            COLUMN_HORSE_ID, history[COLUMN_HORSE_ID]
+        )
+        index = AsofIndex(history, COLUMN_HORSE_ID, HISTORY_COLUMNS)
+        entity_history = FeatureCreator(
+            race_info_table=self.race_info_table,
+            horse_results_table=self.table,
+            entity_results_table=self.entity_results_table,
+            store=self.store,
+        ).entity_history
+        entity_indexes = {
+            (entity_column, split): EntityAsofIndex(
+                entity_history, entity_column, split, ENTITY_VALUE_COLUMNS
+            )
+            for split in ENTITY_FEATURE_SPLITS
+            for entity_column in ENTITY_FEATURE_COLUMNS
+        }
+        return index, entity_indexes, registry
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        いずれかのテーブルの更新時刻が読み込み時から変わっていれば索引を作り直す。
+
+        Returns:
+            bool: 作り直した場合はTrue。
+        """
+        with self._refresh_lock:
+            mtime = tuple(
+                self.store.path(table).stat().st_mtime_ns for table in self._tables()
+            )
+            if not force and mtime == self.loaded_mtime:
+                return False
+            start = time.perf_counter()
+            index, entity_indexes, registry = self._load_index()
+            with self._lock:
+                # 追加した成績のうち、まだテーブルに無いものは新しい索引にも追加する
+                if self.added is not None:
+                    self.added = self.added[
+                        ~index.contains(
+                            self.added[COLUMN_HORSE_ID], self.added[COLUMN_DATE]
+                        )
+                    ]
+                    index.append(self.added)
+                self.index = index
+                self.entity_indexes = entity_indexes
+                self.registry = registry
+                self.loaded_mtime = mtime
+                self.loaded_at = time.time()
+            logger.info(
+                f"history state: {len(index)} rows, "
+                f"{len(entity_indexes)} entity indexes "
+                f"({time.perf_counter() - start:.2f}s)"
+            )
+            return True
+
+    def add_results(self, results: pd.DataFrame) -> int:
+        """
+        成績を索引に追加する。
+
+        Args:
+            results (pandas.DataFrame): `horse_id`（文字列）・`date`・`rank`・`prize`を持つ成績。
+
+        Returns:
+            int: 追加した行数。
+        """
+        results = results.copy()
+        results[COLUMN_HORSE_ID] = results[COLUMN_HORSE_ID].astype(str)
+        results[COLUMN_DATE] = pd.to_datetime(results[COLUMN_DATE])
+        for column in HISTORY_COLUMNS:
+            results[column] = pd.to_numeric(results.get(column), errors="coerce")
+        with self._lock:
+            # 同じ成績が重ねて送られても二重に数えない
+            results = results.drop_duplicates([COLUMN_HORSE_ID, COLUMN_DATE])
+            results = results[
+                ~self.index.contains(results[COLUMN_HORSE_ID], results[COLUMN_DATE])
+            ]
+            self.index.append(results)
+            self.added = pd.concat([self.added, results], ignore_index=True)
+            return len(results)
+
+    def trailing_means(self, horse_id_list: list, date) -> dict:
+        with self._lock:
+            return self.index.trailing_means(
+                np.asarray(horse_id_list, dtype=object),
+                np.full(len(horse_id_list), pd.Timestamp(date).to_datetime64()),
+                N_RACES,
+            )
+
+    def entity_trailing_means(self, entries: pd.DataFrame, date) -> dict:
+        """
+        出走馬毎に、騎手・調教師・馬主の直近nレースの成績を集計する。
+
+        `entries`に騎手などのID（元のIDの文字列）と条件の列（`race_type`・`place`・
+        `course_len`）のある組み合わせだけを求め、列名は`FEATURES_TABLE`と同じにする。
+        台帳に無いIDや履歴に無い条件の馬はNaNとなる。
+
+        Args:
+            entries (pandas.DataFrame): 出走馬毎の行。
+            date: 開催日。この日より前の成績だけを集計に使う。
+
+        Returns:
+            dict: 列名をキー、値の配列を値とする辞書。
+        """
+        dates = np.full(len(entries), pd.Timestamp(date).to_datetime64())
+        result = {}
+        with self._lock:
+            for (entity_column, split), index in self.entity_indexes.items():
+                if entity_column not in entries or (
+                    split is not None and split not in entries
+                ):
+                    continue
+                result.update(
+                    index.trailing_means(
+                        self.registry.lookup(entity_column, entries[entity_column]),
+                        (
+                            None
+                            if split is None
+                            else entries[split].to_numpy(dtype=object)
+                        ),
+                        dates,
+                        ENTITY_N_RACES,
+                    )
+                )
+        return result
+
+
+def recent_rank_score(features: pd.DataFrame) -> np.ndarray:
+    """
+    学習済みモデルが無い場合のスコア。直近5レースの平均着順が良いほど高く、履歴の無い馬は最低とする。
+    """
+    return (
+        (-features[f"{COLUMN_RANK}_{RANK_0005_RACE}-races"]).fillna(-np.inf).to_numpy()
+    )
+
+
+class RacePredictor:
+    def __init__(
+        self,
+        state: HorseHistoryState,
+        model_path: Path = MODEL_FILE,
+        upcoming: UpcomingEntries = None,
+    ):
+        """
+        1レース分の出走馬から特徴量を組み立て、スコアを付ける。
+
+        特徴量は出走表の列・レース情報・馬毎の直近nレースの着順と賞金の平均・
+        騎手・調教師・馬主の直近nレースの成績で、列名は`FEATURES_TABLE`と同じにする。`model_path`に学習済みモデル
+        （`{"model": predictを持つモデル, "features": 列名のリスト}`のpickle）があればそれで、
+        無ければ`recent_rank_score`でスコアを付ける。
+        `upcoming`を指定した場合は、予測した出走馬を出走予定の馬として記録する
+        （馬ページの再取得で最優先にする）。
+
+        Args:
+            state (HorseHistoryState): 馬毎の過去成績の状態。
+            model_path (Path, optional): 学習済みモデルのパス。
+            upcoming (UpcomingEntries, optional): 出走予定の馬の台帳。
+        """
+        self.state = state
+        self.upcoming = upcoming
+        self.model = None
+        self.model_features = None
+        if model_path is not None and Path(model_path).is_file():
+            with open(model_path, "rb") as f:
+                bundle = pickle.load(f)
+            self.model = bundle["model"]
+            self.model_features = list(bundle["features"])
+            logger.info(f"model: {model_path} ({len(self.model_features)} features)")
+
+    def features(
+        self, race_id: str, date, entries: list, race_info: dict = None
+    ) -> pd.DataFrame:
+        """
+        出走馬毎の特徴量を組み立てる。
+
+        列名は`FEATURES_TABLE`（学習に使った列）と同じにする。
+
+        Args:
+            race_id (str): レースID。
+            date (str): 開催日。この日より前の成績だけを集計に使う。
+            entries (list): 出走馬毎の辞書のリスト。`horse_id`は必須で、その他の列は
+                そのまま特徴量に加える。学習に使う出走表の列は`枠番`・`馬番`・`斤量`・
+                `単勝`・`人気`で、`wakuban`・`umaban`・`impost`・`tansyo`・`popularity`
+                の名前で送った場合もこれらの列として扱う（`ENTRY_COLUMN_ALIASES`）。
+                騎手・調教師・馬主の成績には`jockey_id`・`trainer_id`・`owner_id`
+                （netkeibaのIDの文字列）を使う。
+            race_info (dict, optional): レース情報。全馬に同じ値を加える。`course_len`と、
+                マッピング済みのコードの`race_type`・`around`・`weather`・`ground_state`・
+                `race_class`・`place`（`race_info_preprocessing`と同じ値）。騎手などの
+                条件毎の成績には`race_type`・`place`・`course_len`を使う。
+
+        Returns:
+            pandas.DataFrame: 出走馬毎の特徴量。
+        """
+        features = pd.DataFrame(entries).rename(columns=ENTRY_COLUMN_ALIASES)
+        features[COLUMN_HORSE_ID] = features[COLUMN_HORSE_ID].astype(str)
+        features.insert(0, COLUMN_RACE_ID, race_id)
+        features[COLUMN_DATE] = pd.Timestamp(date)
+        for column, value in (race_info or {}).items():
+            features[column] = value
+        aggregates = self.state.trailing_means(features[COLUMN_HORSE_ID].tolist(), date)
+        aggregates.update(self.state.entity_trailing_means(features, date))
+        return pd.concat(
+            [
+                features.drop(columns=list(aggregates), errors="ignore"),
+                pd.DataFrame(aggregates, index=features.index),
+            ],
+            axis=1,
+        )
+
+    def missing_features(self, features: pd.DataFrame) -> list:
+        """
+        モデルの特徴量のうち、組み立てた特徴量に無い列名を返す（モデルが無い場合は空）。
+        """
+        if self.model is None:
+            return []
+        return [column for column in self.model_features if column not in features]
+
+    def score(self, features: pd.DataFrame) -> np.ndarray:
+        """
+        特徴量にスコアを付ける。モデルの特徴量に無い列は欠損値として扱い、列名をログに記録する。
+        """
+        if self.model is None:
+            return recent_rank_score(features)
+        missing = self.missing_features(features)
+        if missing:
+            metrics.count("prediction_missing_features")
+            logger.warning(
+                f"{len(missing)}/{len(self.model_features)} model features "
+                f"missing, scored as NaN: {', '.join(missing)}"
+            )
+        X = features.reindex(columns=self.model_features)
+        X = X.apply(pd.to_numeric, errors="coerce")
+        return np.asarray(self.model.predict(X), dtype=float)
+
+    def predict(
+        self, race_id: str, date, entries: list, race_info: dict = None
+    ) -> pd.DataFrame:
+        """
+        出走馬にスコアを付け、スコアの高い順に並べて返す。
+
+        Returns:
+            pandas.DataFrame: 特徴量に`score`と予想順位`predicted_rank`を加えたデータフレーム。
+        """
+        with metrics.time("predict_seconds"):
+            features = self.features(race_id, date, entries, race_info)
+            features["score"] = self.score(features)
+            features = features.sort_values("score", ascending=False, kind="stable")
+            features["predicted_rank"] = np.arange(1, len(features) + 1)
+        metrics.count("races_predicted")
+        if self.upcoming is not None:
+            self.upcoming.add(
+                features[COLUMN_HORSE_ID].tolist(),
+                pd.Timestamp(date).strftime("%Y-%m-%d"),
+            )
+        return features.reset_index(drop=True)
+
+
+def _to_json(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(pd.Timestamp(value).date())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def predict_response(predictor: RacePredictor, request: dict) -> dict:
+    """
+    予測のリクエスト（`race_id`・`date`・`entries`・`race_info`）に答える辞書を返す。
+
+    モデルの特徴量のうちリクエストから組み立てられなかった列は`missing_features`に返す。
+    """
+    start = time.perf_counter()
+    date = request.get("date") or pd.Timestamp.now(tz=RACE_TIMEZONE).date()
+    result = predictor.predict(
+        request[COLUMN_RACE_ID], date, request["entries"], request.get("race_info")
+    )
+    return {
+        COLUMN_RACE_ID: request[COLUMN_RACE_ID],
+        "predictions": [
+            {column: _to_json(value) for column, value in row.items()}
+            for row in result.to_dict("records")
+        ],
+        "missing_features": predictor.missing_features(result),
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    予測サービスのHTTPハンドラ。
+
+    - `POST /predict`: `{"race_id", "date", "entries": [{"horse_id", ...}], "race_info": {...}}`
+      （列名は`RacePredictor.features`を参照。応答の`missing_features`は欠けていた特徴量）
+    - `POST /results`: `{"results": [{"horse_id", "date", "rank", "prize"}]}` を状態に追加する。
+    - `POST /refresh`: テーブルが更新されていれば状態を作り直す。
+    - `GET /health`: 状態の行数と読み込み時刻。
+    - `GET /metrics`: Prometheusのテキスト形式の計測値。
+    """
+
+    predictor = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        if not isinstance(body, str):
+            body = json.dumps(body, ensure_ascii=False)
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        state = self.predictor.state
+        if self.path == "/health":
+            self._send(
+                200,
+                {
+                    "rows": len(state.index),
+                    "loaded_at": state.loaded_at,
+                    "model": self.predictor.model is not None,
+                },
+            )
+        elif self.path == "/metrics":
+            self._send(200, metrics.to_prometheus(), "text/plain")
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+            if self.path == "/predict":
+                self._send(200, predict_response(self.predictor, request))
+            elif self.path == "/results":
+                added = self.predictor.state.add_results(
+                    pd.DataFrame(request["results"])
+                )
+                self._send(200, {"added": added})
+            elif self.path == "/refresh":
+                self._send(200, {"refreshed": self.predictor.state.refresh()})
+            else:
+                self._send(404, {"error": "not found"})
+        except (KeyError, ValueError, TypeError) as e:
+            metrics.count("prediction_bad_requests")
+            self._send(400, {"error": repr(e)})
+
+
+def _refresh_loop(state: HorseHistoryState, interval: float, stop: threading.Event):
+    """
+    一定間隔でテーブルの更新を確認し、更新されていれば状態を作り直す。
+    """
+    while not stop.wait(interval):
+        try:
+            state.refresh()
+        except Exception as e:
+            logger.error(f"history state refresh failed - {e!r}")
+
+
+def serve(
+    host: str = PREDICTION_HOST,
+    port: int = PREDICTION_PORT,
+    refresh_interval: float = PREDICTION_REFRESH_SECONDS,
+    model_path: Path = MODEL_FILE,
+):
+    """
+    状態を読み込み、ローカルのHTTPサーバーとして予測を受け付ける（終了するまで戻らない）。
+    """
+    state = HorseHistoryState()
+    state.refresh(force=True)
+    PredictionHandler.predictor = RacePredictor(
+        state, model_path, UpcomingEntries(UPCOMING_ENTRIES_FILE)
+    )
+    stop = threading.Event()
+    threading.Thread(
+        target=_refresh_loop, args=(state, refresh_interval, stop), daemon=True
+    ).start()
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    logger.info(f"prediction service: http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    """
+    予測サービスを起動する、または1レースだけ予測する。
+
+    例:
+        python -m src.prediction.service serve --port 8765
+        python -m src.prediction.service predict --race-id 202406050811 --date 2024-12-28 \\
+            --horses 2021105898 2021101429
+        python -m src.prediction.service predict --request request.json
+    """
+    parser = argparse.ArgumentParser(description="当日の予測サービス")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="HTTPサーバーとして起動する")
+    serve_parser.add_argument("--host", default=PREDICTION_HOST)
+    serve_parser.add_argument("--port", type=int, default=PREDICTION_PORT)
+    serve_parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=PREDICTION_REFRESH_SECONDS,
+        help="テーブルの更新を確認する間隔（秒）",
+    )
+    predict_parser = subparsers.add_parser("predict", help="1レースを予測して表示する")
+    predict_parser.add_argument("--request", help="予測リクエストのJSONファイル")
+    predict_parser.add_argument("--race-id")
+    predict_parser.add_argument("--date", help="開催日（省略時は今日）")
+    predict_parser.add_argument("--horses", nargs="+", help="出走馬のIDのリスト")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.refresh_interval)
+    else:
+        if args.request:
+            with open(args.request, "r", encoding="utf-8") as f:
+                request = json.load(f)
+        else:
+            request = {
+                COLUMN_RACE_ID: args.race_id,
+                "date": args.date,
+                "entries": [{COLUMN_HORSE_ID: horse_id} for horse_id in args.horses],
+            }
+        state = HorseHistoryState()
+        state.refresh(force=True)
+        response = predict_response(RacePredictor(state), request)
+        print(json.dumps(response, ensure_ascii=False, indent=2))
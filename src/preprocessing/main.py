@@ -1,32 +1,21 @@
-from src.preprocessing.modules.get_raw_data import get_raw_data
-from src.preprocessing.modules.preprocessing_proc import preprocessing
-from src.preprocessing.modules.create_race_info import create_race_info
-from src.preprocessing.modules.create_race_info import (
-    create_race_info_transformed,
-)
-from src.preprocessing.modules.create_race_info import (
-    create_race_info_preprocessing,
-)
-from src.preprocessing.modules.feature_setting import FeatureCreator
+from src.config import METRICS_DIR, metrics, table_store
+from src.preprocessing.pipeline import build_pipeline
 
 if __name__ == "__main__":
     """
     メイン処理を実行する。
-    - 生データの取得を行い、その後前処理を実施する。
+    - 生データの取得、前処理、特徴量の作成をパイプラインとして実行する。
+    - 出力が最新の段階は省略し、途中で失敗した場合は再実行時に失敗した段階から再開する。
+    - 段階毎の時間・メモリや取得・解析の件数を`METRICS_DIR`に保存する。
 
     Returns:
         None
     """
-    # 生データ取得
-    get_raw_data()
-
-    # データ前処理
-    preprocessing()
-
-    # レース情報テーブルを生成する
-    create_race_info()
-    create_race_info_transformed()
-    create_race_info_preprocessing()
-
-    fc = FeatureCreator()
-    print(fc)
+    try:
+        status = build_pipeline().run()
+        print(status)
+        # 保存したテーブル毎のスキーマ適用前後のメモリ使用量
+        print(table_store.memory_report())
+    finally:
+        metrics.write(METRICS_DIR)
+        print(metrics.summary())
@@ -0,0 +1,15 @@
+from src.config import HTML_HORSE_DIR, HTML_HORSE_PACK, HTML_RACE_DIR, HTML_RACE_PACK
+from src.preprocessing.modules.migrate_html_bin import migrate_html_bin
+
+if __name__ == "__main__":
+    """
+    既存の `data/html/race`, `data/html/horse` 内の `.bin` ファイルをHTMLアーカイブへ移行する。
+
+    実行方法:
+        python -m src.preprocessing.migrate_html
+
+    Returns:
+        None
+    """
+    migrate_html_bin(HTML_RACE_DIR, HTML_RACE_PACK)
+    migrate_html_bin(HTML_HORSE_DIR, HTML_HORSE_PACK)
@@ -0,0 +1,291 @@
+import numpy as np
+
+from src.config import *
+
+
+class AsofIndex:
+    # (キー, 日付)を1つの整数にまとめるときの日付のずらし幅（日付はUNIX日数でint32に収まる）
+    DAY_BITS = 32
+    DAY_OFFSET = 2**31
+
+    def __init__(
+        self,
+        history_df: pd.DataFrame,
+        key_column: str,
+        value_columns: list,
+        date_column: str = COLUMN_DATE,
+    ):
+        """
+        履歴を`(key_column, date_column)`の順に並べ、値の累積和を持つ索引。
+
+        各行の日付より前の履歴だけを使った直近nレースの平均を、履歴をマージせずに
+        `searchsorted`と累積和の差で求めるために使う。索引を作るときに1度だけソートするため、
+        同じ履歴に対して何度も問い合わせる場合（予測サービスなど）は索引を使い回す。
+        `append`で履歴を追加した場合は、追加分だけを挿入して累積和を計算し直す。
+
+        Args:
+            history_df (pandas.DataFrame): 過去の履歴。`key_column`、`date_column`、`value_columns`を持つ。
+            key_column (str): 履歴を紐付けるキーの列名（例: `horse_id`）。
+            value_columns (list): 平均を求める列名のリスト。
+            date_column (str, optional): 日付の列名。デフォルトは`COLUMN_DATE`。
+        """
+        self.key_column = key_column
+        self.value_columns = list(value_columns)
+        self.date_column = date_column
+        history_df = self._valid(history_df)
+        self.key_index = pd.Index(pd.unique(history_df[key_column].to_numpy()))
+        combined = self._combined(
+            self.key_index.get_indexer(history_df[key_column].to_numpy()),
+            self._days(history_df[date_column]),
+        )
+        order = np.argsort(combined, kind="stable")
+        self.keys = combined[order]
+        self.values = {
+            column: history_df[column].to_numpy(dtype=np.float64)[order]
+            for column in self.value_columns
+        }
+        self._accumulate()
+
+    def _valid(self, history_df: pd.DataFrame) -> pd.DataFrame:
+        return history_df[
+            history_df[self.date_column].notna() & history_df[self.key_column].notna()
+        ]
+
+    @staticmethod
+    def _days(dates) -> np.ndarray:
+        return (
+            np.asarray(dates, dtype="datetime64[ns]")
+            .astype("datetime64[D]")
+            .astype(np.int64)
+        )
+
+    @classmethod
+    def _combined(cls, codes: np.ndarray, days: np.ndarray) -> np.ndarray:
+        return (np.asarray(codes, dtype=np.int64) << cls.DAY_BITS) + (
+            days + cls.DAY_OFFSET
+        )
+
+    def _accumulate(self):
+        """
+        値の列毎に、欠損値を除いた累積和と件数の累積和を求める。
+        """
+        self.cumsums = {}
+        for column, values in self.values.items():
+            valid = ~np.isnan(values)
+            self.cumsums[column] = (
+                np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0)))),
+                np.concatenate(([0], np.cumsum(valid))),
+            )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def append(self, history_df: pd.DataFrame):
+        """
+        履歴を追加する。新しいキーには続きのコードを振り、追加分だけを並び順の位置に挿入する。
+        """
+        history_df = self._valid(history_df)
+        if len(history_df) == 0:
+            return
+        keys = history_df[self.key_column].to_numpy()
+        new_keys = pd.unique(keys[self.key_index.get_indexer(keys) < 0])
+        if len(new_keys):
+            self.key_index = self.key_index.append(pd.Index(new_keys))
+        combined = self._combined(
+            self.key_index.get_indexer(keys), self._days(history_df[self.date_column])
+        )
+        order = np.argsort(combined, kind="stable")
+        # 同じ(キー, 日付)の既存の履歴より後ろに挿入する
+        positions = np.searchsorted(self.keys, combined[order], side="right")
+        self.keys = np.insert(self.keys, positions, combined[order])
+        for column in self.value_columns:
+            values = history_df[column].to_numpy(dtype=np.float64)[order]
+            self.values[column] = np.insert(self.values[column], positions, values)
+        self._accumulate()
+
+    def contains(self, keys, dates) -> np.ndarray:
+        """
+        各行の`(キー, 日付)`の履歴が索引にあるかどうかを返す。
+        """
+        codes = self.key_index.get_indexer(np.asarray(keys))
+        combined = self._combined(codes, self._days(dates))
+        position = np.searchsorted(self.keys, combined)
+        found = np.zeros(len(combined), dtype=bool)
+        in_range = position < len(self.keys)
+        found[in_range] = self.keys[position[in_range]] == combined[in_range]
+        return found & (codes >= 0)
+
+    def trailing_means(self, keys, dates, windows: list) -> dict:
+        """
+        各行の日付より前（当日を含まない）の直近nレースの平均を求める。
+
+        Args:
+            keys (array-like): 行のキー。
+            dates (array-like): 行の日付。
+            windows (list): 直近何レースを集計するかのリスト。
+
+        Returns:
+            dict: `[列名]_[n]-races`をキー、平均値（履歴が無い場合はNaN）の配列を値とする辞書。
+        """
+        codes = self.key_index.get_indexer(np.asarray(keys))
+        # 索引に無いキーは-1となり、すべての履歴より前を指すため件数が0となる
+        start = np.searchsorted(self.keys, self._combined(codes, 0) - self.DAY_OFFSET)
+        end = np.searchsorted(self.keys, self._combined(codes, self._days(dates)))
+        result = {}
+        for column in self.value_columns:
+            value_cumsum, count_cumsum = self.cumsums[column]
+            for n_race in windows:
+                lower = np.maximum(start, end - n_race)
+                total = value_cumsum[end] - value_cumsum[lower]
+                count = count_cumsum[end] - count_cumsum[lower]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result[f"{column}_{n_race}-races"] = np.where(
+                        count > 0, total / count, np.nan
+                    )
+        return result
+
+
+def entity_split_keys(entity_codes, split_codes=None) -> np.ndarray:
+    """
+    騎手などのコードと、条件（コース種別など）のコードを1つのint64のキーにまとめる。
+
+    条件毎の成績を`AsofIndex`で集計するときのキーとして使う。
+    どちらかが欠損（負のコード）の行は-1とし、履歴からは除いて問い合わせでは履歴無しとする。
+
+    Args:
+        entity_codes (array-like): 騎手・調教師・馬主などのint32のコード。
+        split_codes (array-like, optional): 条件のコード（`pandas.factorize`の結果など）。
+            省略時は条件で分けない。
+
+    Returns:
+        numpy.ndarray: int64のキーの配列。
+    """
+    entity_codes = np.asarray(entity_codes, dtype=np.int64)
+    if split_codes is None:
+        split_codes = np.zeros(len(entity_codes), dtype=np.int64)
+    split_codes = np.asarray(split_codes, dtype=np.int64)
+    keys = (entity_codes << 32) + split_codes
+    return np.where((entity_codes < 0) | (split_codes < 0), -1, keys)
+
+
+class EntityAsofIndex:
+    def __init__(
+        self,
+        history_df: pd.DataFrame,
+        entity_column: str,
+        split: str,
+        value_columns: list,
+        date_column: str = COLUMN_DATE,
+    ):
+        """
+        騎手・調教師・馬主のいずれかについて、条件（コース種別など）毎の成績を持つ`AsofIndex`。
+
+        キーは`entity_split_keys`で(騎手などのコード, 条件のコード)をまとめたもので、条件のコードは
+        履歴に現れる値の位置とする（履歴に無い条件の行は履歴無しとなる）。
+        値の列名は`[jockey|trainer|owner]_[条件の列名]_[値]`（条件で分けない場合は条件の列名を除く）とし、
+        特徴量の作成（`FeatureCreator.agg_entity_n_races`）と予測サービスで同じ列名・値になるようにする。
+
+        Args:
+            history_df (pandas.DataFrame): 過去の出走。`entity_column`、`split`、`date_column`、
+                `value_columns`を持つ。
+            entity_column (str): 騎手などのコードの列名（例: `jockey_id`）。
+            split (str): 条件の列名。Noneの場合は条件で分けない。
+            value_columns (list): 平均を求める列名のリスト。
+            date_column (str, optional): 日付の列名。デフォルトは`COLUMN_DATE`。
+        """
+        self.entity_column = entity_column
+        self.split = split
+        self.prefix = entity_column.removesuffix("_id")
+        self.split_values = None
+        split_values = None
+        if split is not None:
+            self.prefix = f"{self.prefix}_{split}"
+            split_values = history_df[split].to_numpy(dtype=object)
+            self.split_values = pd.Index(
+                pd.unique(split_values[pd.notna(split_values)])
+            )
+        keys = self.keys(
+            history_df[entity_column].to_numpy(dtype=np.int64, na_value=-1),
+            split_values,
+        )
+        entity_df = pd.DataFrame(
+            {
+                "key": keys,
+                date_column: history_df[date_column].to_numpy(),
+                **{
+                    f"{self.prefix}_{column}": history_df[column].to_numpy(
+                        dtype=np.float64, na_value=np.nan
+                    )
+                    for column in value_columns
+                },
+            }
+        )
+        self.index = AsofIndex(
+            entity_df[keys >= 0],
+            "key",
+            [f"{self.prefix}_{column}" for column in value_columns],
+            date_column,
+        )
+
+    def keys(self, entity_codes, split_values=None) -> np.ndarray:
+        """
+        騎手などのコードと条件の値から、索引のキーを求める。
+        """
+        split_codes = None
+        if self.split is not None:
+            split_codes = self.split_values.get_indexer(
+                np.asarray(split_values, dtype=object)
+            )
+        return entity_split_keys(entity_codes, split_codes)
+
+    def trailing_means(self, entity_codes, split_values, dates, windows: list) -> dict:
+        """
+        各行の日付より前（当日を含まない）の直近nレースの平均を求める。
+
+        Args:
+            entity_codes (array-like): 行の騎手などのコード（欠損は負の値）。
+            split_values (array-like): 行の条件の値（条件で分けない場合はNone）。
+            dates (array-like): 行の日付。
+            windows (list): 直近何レースを集計するかのリスト。
+
+        Returns:
+            dict: `[接頭辞]_[値]_[n]-races`をキー、平均値の配列を値とする辞書。
+        """
+        return self.index.trailing_means(
+            self.keys(entity_codes, split_values), dates, windows
+        )
+
+
+def asof_trailing_means(
+    query_df: pd.DataFrame,
+    history_df: pd.DataFrame,
+    key_column: str,
+    value_columns: list,
+    windows: list,
+    date_column: str = COLUMN_DATE,
+) -> pd.DataFrame:
+    """
+    各行の日付より前の履歴だけを使い、直近nレースの平均値を求める関数。
+
+    履歴から`AsofIndex`を作り（`(key_column, date_column)`で1度だけソートし、各列の累積和を取る）、
+    各行について同じキーの履歴のうち日付が厳密に前のものの終端位置を`searchsorted`で求め、
+    すべてのnについて累積和の差から平均を計算する。履歴と行をマージしないため、
+    メモリ使用量は入力の行数に比例する。欠損値は平均の計算から除外する。
+
+    Args:
+        query_df (pandas.DataFrame): 集計対象の行。`key_column`と`date_column`を持つ。
+        history_df (pandas.DataFrame): 過去の履歴。`key_column`、`date_column`、`value_columns`を持つ。
+        key_column (str): 履歴を紐付けるキーの列名（例: `horse_id`）。
+        value_columns (list): 平均を求める列名のリスト。
+        windows (list): 直近何レースを集計するかのリスト。
+        date_column (str, optional): 日付の列名。デフォルトは`COLUMN_DATE`。
+
+    Returns:
+        pandas.DataFrame: `query_df`と同じインデックスを持ち、
+            `[列名]_[n]-races`の列に平均値（履歴が無い場合はNaN）を格納したDataFrame。
+    """
+    index = AsofIndex(history_df, key_column, value_columns, date_column)
+    result = index.trailing_means(
+        query_df[key_column].to_numpy(), query_df[date_column].to_numpy(), windows
+    )
+    return pd.DataFrame(result, index=query_df.index)
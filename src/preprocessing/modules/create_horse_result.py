@@ -1,41 +1,72 @@
 from src.config import *
+from src.preprocessing.modules.ingest_html_archive import ingest_html_archive
 
 
-def create_horse_result(html_paths):
+def parse_horse_html(horse_id, html):
     """
-    指定されたHTMLファイルパスリストからテーブルデータを抽出し、結合して1つのDataFrameにする。
+    1頭分のHTMLから競走成績テーブルを抽出したDataFrameを返す関数。
 
-    この関数は、各HTMLファイルを読み込み、ファイル内の有効なテーブルを抽出してPandasのDataFrameに変換する。
+    Args:
+        horse_id (str): 馬ID。
+        html (bytes): 馬のページのHTML。
+
+    Returns:
+        pandas.DataFrame or None: 馬IDをインデックスとして持つDataFrame。
+            エラーが発生した場合はログに記録しNoneを返す。
+    """
+    try:
+        # 対象は2番目のtableタグ
+        df = pd.read_html(html)[2]
+        df.index = [horse_id] * len(df)
+        return df
+    except IndexError:
+        logger.error(f"{horse_id}:" + ERROR_NO_VALID_TABLE)
+        return None
+    except Exception:
+        logger.error(f"{horse_id}:" + ERROR_UNEXPECTED)
+        return None
+
+
+def create_horse_result(
+    horse_id_list=None, workers: int = PARSE_WORKERS, incremental: bool = True
+):
+    """
+    HTMLアーカイブから馬のページを読み込み、テーブルデータを抽出し、結合して1つのDataFrameにする。
+
+    この関数は、`HTML_HORSE_PACK` から各HTMLを読み込み、ページ内の有効なテーブルを抽出してPandasのDataFrameに変換する。
     有効なテーブルが複数あれば、それらを結合して1つのDataFrameにまとめる。最終的なDataFrameは、レースIDをインデックスとして持つ。
+    馬IDは`id_registry`でint32のコードに変換する。
+    `workers` に2以上を指定すると、ページをチャンクに分けてプロセスプールで並列に解析する。
+    `incremental=True` の場合は台帳(`HORSE_MANIFEST`)に記録済みで変更の無いページは解析せず、
+    新規・再取得されたページの行だけを年単位のパーティション内で置き換えてから、テーブルを書き出す。
 
     Args:
-        html_paths (list): HTMLファイルのパスのリスト。各ファイルはレースIDに対応し、テーブルデータを含む。
+        horse_id_list (list, optional): 取り込み対象とする馬IDのリスト。省略時はアーカイブ内の全馬を対象とする。
+        workers (int, optional): 解析に使うプロセス数。デフォルトは`PARSE_WORKERS`。
+        incremental (bool, optional): 差分取り込みを行うかどうか。Falseの場合は全件を解析し直す。
 
     Returns:
-        pandas.DataFrame: すべてのHTMLファイルから抽出したテーブルデータを結合したDataFrame。レースIDがインデックスとなる。
+        pandas.DataFrame: 取り込み済みの全馬のテーブルデータを結合したDataFrame。馬IDがインデックスとなる。
 
     Raises:
         Exception: HTMLのパースやテーブル抽出中にエラーが発生した場合、そのエラーメッセージをログに記録し、処理を続行する。
     """
-    html_df_dict = {}
-    for html_path in tqdm(html_paths):
-        with open(html_path, "rb") as rf:
-            try:
-                horse_id = html_path.stem  # ファイル名を抽出 ../[horse_id].html
-                html = rf.read()
-                # 対象は2番目のtableタグ
-                df = pd.read_html(html)[2]
-                df.index = [horse_id] * len(df)
-                html_df_dict[horse_id] = df
-            except IndexError:
-                logger.error(f"{horse_id}:" + ERROR_NO_VALID_TABLE)
-                continue
-            except Exception:
-                logger.error(f"{horse_id}:" + ERROR_UNEXPECTED)
-                continue
-    concat_df = pd.concat(html_df_dict.values())
+    archive = HtmlArchive(HTML_HORSE_PACK)
+    if horse_id_list is None:
+        horse_id_list = archive.ids()
+    tables = ingest_html_archive(
+        parse_horse_html,
+        archive,
+        horse_id_list,
+        HORSE_MANIFEST,
+        (HORSE_RESULTS_TABLE,),
+        workers,
+        incremental,
+    )
+    concat_df = tables[HORSE_RESULTS_TABLE]
     concat_df.index.name = COLUMN_HORSE_ID
     concat_df.columns = concat_df.columns.str.replace(" ", "")
-    SAVE_DIR.mkdir(parents=True, exist_ok=True)
-    concat_df.to_csv(SAVE_DIR / RAWDF_HORSE_FILE_NAME_CSV, sep="\t")
+    # 馬IDは台帳のコードに変換して保存する
+    concat_df = id_registry.encode_columns(concat_df)
+    table_store.write(HORSE_RESULTS_TABLE, concat_df)
     return concat_df
@@ -1,58 +1,66 @@
 from src.config import *
+from src.preprocessing.modules.extract_race_page import extract_race_page
+from src.preprocessing.modules.ingest_html_archive import ingest_html_archive
 
 
-def create_race_info():
+def save_race_info(info_df_list):
     """
-    レース情報をHTMLファイルから抽出し、CSVに保存する。
+    レース毎に抽出したレース情報を1つのDataFrameにまとめ、`RACE_INFO_TABLE`として保存する。
 
-    この関数は、`HTML_RACE_DIR`内のすべてのHTMLファイルを読み込み、指定されたレース情報を抽出して、
+    Args:
+        info_df_list (list): `extract_race_page`が返すレース情報のDataFrameのリスト。
+
+    返り値:
+        なし
+    """
+    concat_df = pd.concat(info_df_list)
+    concat_df.index.name = COLUMN_RACE_ID
+    concat_df.columns = concat_df.columns.str.replace(" ", "")
+    table_store.write(RACE_INFO_TABLE, concat_df)
+
+
+def create_race_info(
+    race_id_list=None, workers: int = PARSE_WORKERS, incremental: bool = True
+):
+    """
+    レース情報をHTMLファイルから抽出し、`RACE_INFO_TABLE`として保存する。
+
+    通常は`create_race_result`がレース結果と同じパースでレース情報も保存するため、
+    この関数はレース情報だけを作り直したい場合に使用する。取り込みは`create_race_result`と
+    同じ台帳・パーティションを共有するため、変更の無いページは解析しない。
+
+    この関数は、`HTML_RACE_PACK`内のHTMLを読み込み、指定されたレース情報を抽出して、
     DataFrameに格納する。抽出された情報は`title`、`info1`、`info2`として保存され、最終的に
-    それらを1つのDataFrameにまとめ、`SAVE_DIR / RACE_INFO_CSV`としてCSVファイルに保存する。
+    それらを1つのDataFrameにまとめ、`RACE_INFO_TABLE`として保存する。
 
     処理の流れ:
-    - HTMLファイルを読み込み、`BeautifulSoup`で解析
+    - アーカイブからHTMLを読み込み、`extract_race_page`でlxmlにより解析
     - `data_intro`クラスを持つ`div`タグ内の情報を抽出
     - レース情報として`title`、`info1`、`info2`を取得
-    - `race_id`をファイル名から取得し、DataFrameに格納
-    - 抽出した情報を全て1つのDataFrameにまとめ、CSVとして保存
+    - `race_id`をアーカイブのIDから取得し、DataFrameに格納
+    - 抽出した情報を全て1つのDataFrameにまとめ、テーブルとして保存
+
+    Args:
+        race_id_list (list, optional): 対象とするレースIDのリスト。省略時はアーカイブ内の全レースを対象とする。
+        workers (int, optional): 解析に使うプロセス数。デフォルトは`PARSE_WORKERS`。
+        incremental (bool, optional): 差分取り込みを行うかどうか。Falseの場合は全件を解析し直す。
 
     返り値:
         なし
     """
-    dfs = {}
-    for html_path in tqdm(list((HTML_RACE_DIR).glob("*bin"))):
-        with open(html_path, "rb") as f:
-            try:
-                html = f.read()
-                soup = BeautifulSoup(html, "lxml").find("div", class_="data_intro")
-                info_dict = {}
-                info_dict["title"] = soup.find("h1").text
-                p_list = soup.find_all("p")
-                # レース名取得
-                info_dict["info1"] = re.findall(
-                    r"[\w:]+", p_list[0].text.replace(" ", "")
-                )
-                # 日付を含むpタグ取得
-                for i, p_2 in enumerate(p_list):
-                    if re.search(DATE_PATTERN, p_2.text):
-                        break  # 最初に見つかったものだけ欲しいなら break
-                info_dict["info2"] = re.findall(r"[\w:]+", p_2.text)
-                df = pd.DataFrame.from_dict(info_dict, orient="index").T
-                # ファイル名からrace_idを取得
-                race_id = html_path.stem
-                df.index = [race_id] * len(df)
-                dfs[race_id] = df
-            except IndexError as e:
-                logger.error(ERROR_TITLE)
-                continue
-            except AttributeError as e:
-                logger.error(ERROR_TITLE)
-                continue
-    concat_df = pd.concat(dfs.values())
-    concat_df.index.name = COLUMN_RACE_ID
-    concat_df.columns = concat_df.columns.str.replace(" ", "")
-    SAVE_DIR.mkdir(exist_ok=True, parents=True)
-    concat_df.to_csv(SAVE_DIR / RACE_INFO_CSV, sep="\t")
+    archive = HtmlArchive(HTML_RACE_PACK)
+    if race_id_list is None:
+        race_id_list = archive.ids()
+    tables = ingest_html_archive(
+        extract_race_page,
+        archive,
+        race_id_list,
+        RACE_MANIFEST,
+        (RACE_RESULTS_TABLE, RACE_INFO_TABLE),
+        workers,
+        incremental,
+    )
+    save_race_info([tables[RACE_INFO_TABLE]])
 
 
 def get_match(pattern, string, group_num=1):
@@ -79,107 +87,84 @@ def create_race_info_transformed():
     """
     レース情報を変換して、新しいファイルに保存する。
 
-    この関数は、`SAVE_DIR / RACE_INFO_CSV`からタブ区切りのCSVファイルを読み込み、
-    各行について必要な情報を抽出し、新しい形式で変換してから
-    `SAVE_DIR / race_info_TRANSFORMED`に保存する。
+    この関数は、`RACE_INFO_TABLE`を読み込み、`info1`・`info2`のリスト列から
+    必要な情報を列単位の正規表現抽出(`Series.str.extract`)でまとめて取り出し、
+    `RACE_INFO_TRANSFORMED_TABLE`として保存する。
 
     変換の内容:
-    - `info1` と `info2` 列のデータを辞書またはリストに変換
-    - 各列の値を計算し、適切な形式で新しい行を作成
+    - `info1` からコース種別・回り・距離・天候・馬場状態を抽出
+    - `info2` から日付（`YYYY-MM-DD`形式）・クラス・開催場所を抽出
     - 最終的に必要なカラムのみを保持したデータを保存
 
     返り値:
         なし
     """
-    race_infos = pd.read_csv(SAVE_DIR / RACE_INFO_CSV, sep="\t")
-    # 必要な列名
-    columns = [
-        COLUMN_RACE_ID,
-        COLUMN_DATE,
-        COLUMN_RACE_TYPE,
-        COLUMN_AROUND,
-        COLUMN_COURSE_LEN,
-        COLUMN_WEATHER,
-        COLUMN_GROUND_STATE,
-        COLUMN_RACE_CLASS,
-        COLUMN_PLACE,
-    ]
-
-    # 空のデータフレームを作成（最終結果を格納）
-    result_df = pd.DataFrame(columns=columns)
-
-    # 各行をループ処理
-    for index, row in race_infos.iterrows():
-        # info1 と info2 を文字列から辞書またはリストに変換
-        info1 = ast.literal_eval(row["info1"])
-        info2 = ast.literal_eval(row["info2"])
-
-        # 各列の値を計算
-        race_id = row["race_id"]
-        formatted_date = re.sub(r"(\d+)年(\d+)月(\d+)日", r"\1-\2-\3", info2[0])
-        formatted_date = re.sub(r"-(\d)-", r"-0\1-", formatted_date)  # 月の0埋め
-        formatted_date = re.sub(r"-(\d)$", r"-0\1", formatted_date)  # 日の0埋め
-        race_type = get_match(RACE_TYPE_PATTERN, info1[0])
-        around = get_match(AROUND_PATTERN, info1[0])
-        course_len = get_match(CORCE_LEN_PATTERN, info1[0])
-        weather = info1[1][3:]
-        ground_state = get_match(GROUND_STATE_PATTERN, info1[2], group_num=2)
-        race_class = info2[2]
-        place = get_match(PLACE_D_PATTERN, info2[1], group_num=2)
-        # 新しい行を作成
-        new_row = {
-            COLUMN_RACE_ID: race_id,
+    race_infos = table_store.read(RACE_INFO_TABLE)
+    info1 = race_infos["info1"]
+    info2 = race_infos["info2"]
+    course = info1.str[0]
+
+    # 日付を YYYY-MM-DD 形式に変換（月・日は0埋め）
+    date_str = info2.str[0]
+    date_parts = date_str.str.extract(DATE_PARTS_PATTERN)
+    formatted_date = (
+        date_parts[0]
+        + "-"
+        + date_parts[1].str.zfill(2)
+        + "-"
+        + date_parts[2].str.zfill(2)
+    ).fillna(date_str)
+
+    result_df = pd.DataFrame(
+        {
+            COLUMN_RACE_ID: race_infos[COLUMN_RACE_ID],
             COLUMN_DATE: formatted_date,
-            COLUMN_RACE_TYPE: race_type,
-            COLUMN_AROUND: around,
-            COLUMN_COURSE_LEN: course_len,
-            COLUMN_WEATHER: weather,
-            COLUMN_GROUND_STATE: ground_state,
-            COLUMN_RACE_CLASS: race_class,
-            COLUMN_PLACE: place,
+            COLUMN_RACE_TYPE: course.str.extract(RACE_TYPE_PATTERN)[0],
+            COLUMN_AROUND: course.str.extract(AROUND_PATTERN)[0],
+            COLUMN_COURSE_LEN: course.str.extract(CORCE_LEN_PATTERN)[0],
+            COLUMN_WEATHER: info1.str[1].str[3:],
+            COLUMN_GROUND_STATE: info1.str[2].str.extract(GROUND_STATE_PATTERN)[1],
+            COLUMN_RACE_CLASS: info2.str[2],
+            COLUMN_PLACE: info2.str[1].str.extract(PLACE_D_PATTERN)[1],
         }
-
-        # 新しい行を DataFrame に追加
-        result_df = pd.concat([result_df, pd.DataFrame([new_row])], ignore_index=True)
+    )
 
     # 保存処理
-    SAVE_DIR.mkdir(parents=True, exist_ok=True)
-    result_df.to_csv(SAVE_DIR / RACE_INFO_PREPROCESSING_CSV, sep="\t", index=False)
+    table_store.write(RACE_INFO_TRANSFORMED_TABLE, result_df)
 
 
 def create_race_info_preprocessing():
     """
     レース情報を前処理して、指定のディレクトリに保存する。
 
-    この関数は、`SAVE_DIR / race_info_TRANSFORMED`からタブ区切りのCSVファイルを読み込み、
+    この関数は、`RACE_INFO_TRANSFORMED_TABLE`を読み込み、
     各カラムに対して定義されたマッピングを適用して前処理を行う。
-    処理後、必要なカラムだけを抽出し、`SAVE_DIR / RACE_INFO_PREPROCESSING_CSV`に再保存する。
+    処理後、必要なカラムだけを抽出し、`RACE_INFO_PREPROCESSING_TABLE`として保存する。
 
     前処理の内容:
     - レースの日付を日時型に変換
     - 各カラムに対してマッピングを適用
-    - 必要なカラムのみを抽出して保存
+    - 必要なカラムのみを抽出し、スキーマの型（マッピング済みの値はカテゴリ型）に縮小して保存
 
     返り値:
         なし
     """
-    df = pd.read_csv(SAVE_DIR / RACE_INFO_PREPROCESSING_CSV, sep="\t")
+    df = table_store.read(RACE_INFO_TRANSFORMED_TABLE)
     df[COLUMN_DATE] = pd.to_datetime(df[COLUMN_DATE])
-    df[COLUMN_RACE_TYPE] = df[COLUMN_RACE_TYPE].map(
-        mapping_loader.get_race_type_mapping()
+    df[COLUMN_RACE_TYPE] = mapping_loader.get_compiled("race_type").map(
+        df[COLUMN_RACE_TYPE]
     )
-    df[COLUMN_AROUND] = df[COLUMN_AROUND].map(mapping_loader.get_around_mapping())
-    df[COLUMN_WEATHER] = df[COLUMN_WEATHER].map(mapping_loader.get_weather_mapping())
-    df[COLUMN_GROUND_STATE] = df[COLUMN_GROUND_STATE].map(
-        mapping_loader.get_ground_state_mapping()
+    df[COLUMN_AROUND] = mapping_loader.get_compiled("around").map(df[COLUMN_AROUND])
+    df[COLUMN_WEATHER] = mapping_loader.get_compiled("weather").map(df[COLUMN_WEATHER])
+    df[COLUMN_GROUND_STATE] = mapping_loader.get_compiled("ground_state").map(
+        df[COLUMN_GROUND_STATE]
     )
-    df[COLUMN_RACE_CLASS] = df[COLUMN_RACE_CLASS].map(
-        mapping_loader.get_race_class_info_mapping()
+    df[COLUMN_RACE_CLASS] = mapping_loader.get_compiled("race_class_info").map(
+        df[COLUMN_RACE_CLASS]
     )
-    place_perse_list = pd.Series(
-        [get_match(PLACE_DD_PATTERN, i) for i in df[COLUMN_PLACE].values]
+    df[COLUMN_PLACE] = mapping_loader.get_compiled("place").map(
+        df[COLUMN_PLACE].str.extract(PLACE_DD_PATTERN)[0]
     )
-    df[COLUMN_PLACE] = place_perse_list.map(mapping_loader.get_place_mapping())
     # ここに使用する列名を列挙
     df = df[
         [
@@ -194,5 +179,4 @@ def create_race_info_preprocessing():
             COLUMN_PLACE,
         ]
     ]
-    SAVE_DIR.mkdir(parents=True, exist_ok=True)
-    df.to_csv(SAVE_DIR / RACE_INFO_PREPROCESSING_CSV, sep="\t", index=False)
+    table_store.write(RACE_INFO_PREPROCESSING_TABLE, df)
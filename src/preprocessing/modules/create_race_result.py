@@ -1,71 +1,54 @@
 from src.config import *
-from src.preprocessing.modules.id_names import id_names
+from src.preprocessing.modules.create_race_info import save_race_info
+from src.preprocessing.modules.extract_race_page import extract_race_page
+from src.preprocessing.modules.ingest_html_archive import ingest_html_archive
 
 
-def create_race_result(html_paths):
+def create_race_result(
+    race_id_list=None, workers: int = PARSE_WORKERS, incremental: bool = True
+):
     """
-    指定されたHTMLファイルパスリストを読み込み、HTMLからテーブルデータを抽出して結合する関数。
+    HTMLアーカイブからレースページを読み込み、HTMLからテーブルデータを抽出して結合する関数。
 
-    この関数は、HTMLファイルを1つずつ読み込み、その中の有効なテーブルデータを抽出してPandasのDataFrameに変換する。
+    この関数は、`HTML_RACE_PACK` からHTMLを読み込み、その中の有効なテーブルデータを抽出してPandasのDataFrameに変換する。
     有効なテーブルが複数見つかれば、それらを結合して最終的に1つのDataFrameとして返す。
     レースIDをインデックスとして設定し、最終的なDataFrameにまとめる。
+    馬・騎手・調教師・馬主のIDは`id_registry`でint32のコードに変換する。
+    解析は複数のプロセスで行うため、コードの割り当ては結合後に親プロセスでまとめて行う。
+    各ページは `extract_race_page` で1度だけパースし、同じパース結果から抽出したレース情報も
+    `RACE_INFO_TABLE` として保存する。
+    `workers` に2以上を指定すると、ページをチャンクに分けてプロセスプールで並列に解析する。
+    `incremental=True` の場合は台帳(`RACE_MANIFEST`)に記録済みで変更の無いページは解析せず、
+    新規・再取得されたページの行だけを年単位のパーティション内で置き換えてから、テーブルを書き出す。
 
     Args:
-        html_paths (list): HTMLファイルのパスのリスト。各ファイルはレースIDに対応し、テーブルデータを含んでいる。
+        race_id_list (list, optional): 取り込み対象とするレースIDのリスト。省略時はアーカイブ内の全レースを対象とする。
+        workers (int, optional): 解析に使うプロセス数。デフォルトは`PARSE_WORKERS`。
+        incremental (bool, optional): 差分取り込みを行うかどうか。Falseの場合は全件を解析し直す。
 
     Returns:
-        pandas.DataFrame: すべてのHTMLファイルから抽出したテーブルデータを結合したDataFrame。各行はレースIDをインデックスとして持つ。
+        pandas.DataFrame: 取り込み済みの全レースのテーブルデータを結合したDataFrame。各行はレースIDをインデックスとして持つ。
 
     Raises:
-        Exception: HTMLのパースやテーブル抽出中にエラーが発生した場合、その情報を標準出力に表示し続行する。
+        Exception: HTMLのパースやテーブル抽出中にエラーが発生した場合、その情報をログに記録し続行する。
     """
-    html_df_dict = {}
-    for html_path in tqdm(html_paths):
-        with open(html_path, "rb") as rf:
-            try:
-                race_id = html_path.stem  # ファイル名を抽出 ../[race_id].html
-                html = rf.read()
-                # BeautifulSoupでHTMLをパース
-                tmp_soup = BeautifulSoup(html, "html.parser")
-                tables = tmp_soup.find_all("table")  # 全ての<table>を取得
-
-                # thまたはtd要素を持つ有効な<table>を抽出
-                valid_tables = [
-                    table for table in tables if table.find("th") or table.find("td")
-                ]
-
-                if not valid_tables:
-                    logger.warning(f"{race_id}:" + ERROR_NO_VALID_TABLE)
-                    continue
-
-                # 有効な<table>をHTML文字列に変換して、pd.read_htmlに渡す
-                dfs = pd.read_html(str(valid_tables))
-
-                if len(dfs) == 0:
-                    logger.warning(f"{race_id}:" + ERROR_NO_VALID_TABLE)
-                    continue
-
-                # 最初のテーブルを取得
-                df = dfs[0]
-
-                # 各id取得関数
-                soup = BeautifulSoup(html, "lxml").find(
-                    "table", class_="race_table_01 nk_tb_common"
-                )
-                df = id_names(soup, df)
-
-                df.index = [race_id] * len(df)
-                html_df_dict[race_id] = df
-
-            except IndexError:
-                logger.error(f"{race_id}:" + ERROR_NO_VALID_TABLE)
-                continue
-            except Exception:
-                logger.error(f"{race_id}:" + ERROR_UNEXPECTED)
-                continue
-    concat_df = pd.concat(html_df_dict.values())
+    archive = HtmlArchive(HTML_RACE_PACK)
+    if race_id_list is None:
+        race_id_list = archive.ids()
+    tables = ingest_html_archive(
+        extract_race_page,
+        archive,
+        race_id_list,
+        RACE_MANIFEST,
+        (RACE_RESULTS_TABLE, RACE_INFO_TABLE),
+        workers,
+        incremental,
+    )
+    save_race_info([tables[RACE_INFO_TABLE]])
+    concat_df = tables[RACE_RESULTS_TABLE]
     concat_df.index.name = COLUMN_RACE_ID
     concat_df.columns = concat_df.columns.str.replace(" ", "")
-    SAVE_DIR.mkdir(parents=True, exist_ok=True)
-    concat_df.to_csv(SAVE_DIR / RAWDF_RACE_FILE_NAME_CSV, sep="\t")
+    # 馬・騎手・調教師・馬主のIDは台帳のコードに変換して保存する
+    concat_df = id_registry.encode_columns(concat_df)
+    table_store.write(RACE_RESULTS_TABLE, concat_df)
     return concat_df
@@ -1,22 +1,26 @@
 from src.config import *
 
 
-def extract_ids(soup, regex_pattern, id_length):
+def extract_ids(element, regex_pattern, id_length):
     """
     HTML内の特定のパターンに一致するIDを抽出する汎用関数。
 
     Args:
-        soup (bs4.BeautifulSoup): BeautifulSoupで解析されたHTMLデータ。
+        element (lxml.html.HtmlElement): lxmlで解析されたHTML要素。
         regex_pattern (str): href属性の正規表現パターン。
         id_length (int): 抽出するIDの長さ。
 
     Returns:
         list: 抽出されたIDのリスト。
     """
+    href_regex = re.compile(regex_pattern)
+    id_regex = re.compile(rf"\d{{{id_length}}}")
     id_list = []
-    a_tag_list = soup.find_all("a", href=re.compile(regex_pattern))
-    for a in a_tag_list:
-        id_match = re.findall(rf"\d{{{id_length}}}", a["href"])
+    for a in element.iter("a"):
+        href = a.get("href")
+        if href is None or not href_regex.search(href):
+            continue
+        id_match = id_regex.findall(href)
         if id_match:
             id_list.append(id_match[0])
     return id_list
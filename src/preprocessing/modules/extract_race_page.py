@@ -0,0 +1,128 @@
+from io import StringIO
+
+import lxml.html
+from bs4.dammit import UnicodeDammit
+from pandas.io.parsers import TextParser
+
+from src.config import *
+from src.preprocessing.modules.id_names import id_names
+
+
+def _cell_text(cell):
+    """
+    セルのテキストを取得し、`pd.read_html`と同じ規則で空白を正規化する。
+    """
+    return re.sub(TABLE_CELL_WHITESPACE_PATTERN, " ", cell.text_content().strip())
+
+
+def _table_to_df(table):
+    """
+    lxmlで解析済みの<table>要素をDataFrameに変換する。
+
+    `pd.read_html`はHTML文字列を受け取り再度パースするため、ここではセルのテキストを
+    直接取り出し、`pd.read_html`と同じ`TextParser`で型推論を行う。
+    先頭の<th>のみの行をヘッダとみなす点や<br>の扱いも`pd.read_html`に合わせている。
+    colspan/rowspanを含む表は展開規則が複雑なため`pd.read_html`に委ねる。
+    """
+    rows = table.xpath("./tr|./thead/tr|./tbody/tr")
+    # `pd.read_html`と同様に<br>を改行として扱う（正規化で空白1つになる）
+    for br in table.iter("br"):
+        br.tail = "\n" + (br.tail or "")
+    if table.xpath(".//*[@colspan>1 or @rowspan>1]"):
+        return pd.read_html(StringIO(lxml.html.tostring(table, encoding="unicode")))[0]
+
+    cells = [row.xpath("./td|./th") for row in rows]
+    head = []
+    while cells and all(cell.tag == "th" for cell in cells[0]):
+        head.append([_cell_text(cell) for cell in cells.pop(0)])
+    body = head + [[_cell_text(cell) for cell in row] for row in cells]
+
+    # 列数の少ない行は空文字で埋める
+    n_columns = max(len(row) for row in body)
+    body = [row + [""] * (n_columns - len(row)) for row in body]
+    if len(head) == 1:
+        header = 0
+    elif head:
+        header = [i for i, row in enumerate(head) if any(row)]
+    else:
+        header = None
+    with TextParser(body, header=header) as parser:
+        return parser.read()
+
+
+def _extract_race_info(doc):
+    """
+    `data_intro`クラスを持つ`div`タグからレース名・コース情報・開催情報を抽出する。
+
+    Returns:
+        dict: `title`、`info1`、`info2`をキーに持つ辞書。
+    """
+    data_intro = doc.find_class("data_intro")[0]
+    info_dict = {}
+    info_dict["title"] = data_intro.find(".//h1").text_content()
+    p_list = list(data_intro.iter("p"))
+    # レース名取得
+    info_dict["info1"] = re.findall(
+        r"[\w:]+", p_list[0].text_content().replace(" ", "")
+    )
+    # 日付を含むpタグ取得
+    for p_2 in p_list:
+        if re.search(DATE_PATTERN, p_2.text_content()):
+            break  # 最初に見つかったものだけ欲しいなら break
+    info_dict["info2"] = re.findall(r"[\w:]+", p_2.text_content())
+    return info_dict
+
+
+def extract_race_page(race_id, html):
+    """
+    1レース分のHTMLをlxmlで1度だけパースし、レース結果とレース情報を同時に抽出する関数。
+
+    レース結果は最初の有効な<table>（thまたはtdを持つもの）から取得し、
+    `race_table_01 nk_tb_common`テーブル内のリンクから馬・騎手・調教師・馬主のIDを付与する。
+    レース情報は`data_intro`から`title`、`info1`、`info2`を取得する。
+
+    Args:
+        race_id (str): レースID。
+        html (bytes): レースページのHTML。
+
+    Returns:
+        tuple: `(results_df, info_df)`。いずれもレースIDをインデックスとして持つDataFrame。
+            抽出できなかった方はエラーをログに記録しNoneとなる。
+    """
+    try:
+        # 文字コードの判定はBeautifulSoupと同じ方法で行い、パース自体はlxmlで1度だけ行う
+        doc = lxml.html.fromstring(UnicodeDammit(html, is_html=True).unicode_markup)
+    except Exception:
+        logger.error(f"{race_id}:" + ERROR_UNEXPECTED)
+        return None, None
+
+    results_df = None
+    try:
+        # thまたはtd要素を持つ有効な<table>を抽出
+        valid_tables = [
+            table for table in doc.iter("table") if table.xpath(".//th|.//td")
+        ]
+        if not valid_tables:
+            logger.warning(f"{race_id}:" + ERROR_NO_VALID_TABLE)
+        else:
+            # 最初のテーブルを取得
+            results_df = _table_to_df(valid_tables[0])
+            # 各id取得関数
+            id_table = doc.xpath('//table[@class="race_table_01 nk_tb_common"]')[0]
+            results_df = id_names(id_table, results_df)
+            results_df.index = [race_id] * len(results_df)
+    except IndexError:
+        logger.error(f"{race_id}:" + ERROR_NO_VALID_TABLE)
+        results_df = None
+    except Exception:
+        logger.error(f"{race_id}:" + ERROR_UNEXPECTED)
+        results_df = None
+
+    info_df = None
+    try:
+        info_df = pd.DataFrame.from_dict(_extract_race_info(doc), orient="index").T
+        info_df.index = [race_id] * len(info_df)
+    except (IndexError, AttributeError):
+        logger.error(f"{race_id}:" + ERROR_TITLE)
+
+    return results_df, info_df
@@ -1,69 +1,421 @@
+import json
+import os
+
+import numpy as np
+
 from src.config import *
+from src.preprocessing.modules.asof_aggregation import (
+    AsofIndex,
+    EntityAsofIndex,
+    asof_trailing_means,
+    entity_split_keys,
+)
+
+# 馬毎に集計する直近のレース数
+HORSE_N_RACES = [RANK_0003_RACE, RANK_0005_RACE, RANK_0010_RACE, RANK_1000_RACE]
+# 騎手・調教師・馬主の成績として集計する値（1着・3着以内は0/1の平均が勝率・複勝率となる）
+ENTITY_VALUE_COLUMNS = ["win", "top3", COLUMN_RANK, COLUMN_PRIZE]
 
 
 class FeatureCreator:
     def __init__(
         self,
-        results_filepath: Path = SAVE_DIR / RAWDF_RACE_FILE_NAME_CSV,
-        race_info_filepath: Path = SAVE_DIR / RACE_INFO_PREPROCESSING_CSV,
-        horse_results_filepath: Path = SAVE_DIR / RAWDF_HORSE_FILE_NAME_CSV,
-        output_dir: Path = SAVE_DIR,
+        results_table: str = RACE_RESULTS_TABLE,
+        race_info_table: str = RACE_INFO_PREPROCESSING_TABLE,
+        horse_results_table: str = PREPROCESSED_HORSE_RESULTS_TABLE,
+        entity_results_table: str = PREPROCESSED_RACE_RESULTS_TABLE,
+        date_from=None,
+        date_to=None,
+        store: TableStore = table_store,
+        cache: FeatureCache = feature_cache,
     ):
-        self.results = pd.read_csv(results_filepath, sep="\t")
-        self.race_info = pd.read_csv(race_info_filepath, sep="\t")
-        self.horse_results = pd.read_csv(horse_results_filepath, sep="\t")
-        self.output_dir = output_dir
+        """
+        特徴量作成に使うテーブルとキャッシュを設定する。
+
+        各特徴量ブロック（population、agg_horse_n_races、agg_entity_n_races、最終的な特徴量）は、入力テーブルの
+        内容のハッシュ・パラメータ・コードのバージョンをキーとして`cache`に保存される。
+        テーブルはキャッシュに無いブロックを計算するときに初めて読み込む。
+
+        `date_from`・`date_to`を指定した場合は、その期間に開催されたレースだけを読み込む。
+        レース情報は日付で、レース結果はレースIDで読み込み時に絞り込み、
+        馬の過去成績は`date_to`より前のレースの集計に使う列だけを読み込む。
+
+        Args:
+            results_table (str, optional): レース結果のテーブル名。
+            race_info_table (str, optional): 前処理済みレース情報のテーブル名。
+            horse_results_table (str, optional): 前処理済みの馬の過去成績のテーブル名。
+            entity_results_table (str, optional): 騎手・調教師・馬主の成績の集計に使う、
+                前処理済みのレース結果のテーブル名。
+            date_from (str, optional): 対象期間の開始日（この日を含む）。
+            date_to (str, optional): 対象期間の終了日（この日を含む）。
+            store (TableStore, optional): 読み込み・保存に使うストア。
+            cache (FeatureCache, optional): 特徴量ブロックのキャッシュ。
+        """
+        self.results_table = results_table
+        self.race_info_table = race_info_table
+        self.horse_results_table = horse_results_table
+        self.entity_results_table = entity_results_table
+        self.date_from = date_from
+        self.date_to = date_to
+        self.store = store
+        self.cache = cache
+        self._tables = None
+        self._population = None
+        self._entity_history = None
+
+    def _load_tables(self):
+        """
+        特徴量作成に使うテーブルを読み込む（読み込み済みの場合は何もしない）。
+        """
+        if self._tables is not None:
+            return self._tables
+        race_info_filters = []
+        if self.date_from is not None:
+            race_info_filters.append((COLUMN_DATE, ">=", pd.Timestamp(self.date_from)))
+        if self.date_to is not None:
+            race_info_filters.append((COLUMN_DATE, "<=", pd.Timestamp(self.date_to)))
+        race_info = self.store.read(self.race_info_table, filters=race_info_filters)
+        results_filters = []
+        if race_info_filters:
+            results_filters.append(
+                (COLUMN_RACE_ID, "in", race_info[COLUMN_RACE_ID].tolist())
+            )
+        results = self.store.read(self.results_table, filters=results_filters)
+        horse_results_filters = []
+        if self.date_to is not None:
+            horse_results_filters.append((COLUMN_DATE, "<", pd.Timestamp(self.date_to)))
+        horse_results = self.store.read(
+            self.horse_results_table,
+            columns=[COLUMN_HORSE_ID, COLUMN_DATE, COLUMN_RANK, COLUMN_PRIZE],
+            filters=horse_results_filters,
+        )
+        self._tables = {
+            "results": results,
+            "race_info": race_info,
+            "horse_results": horse_results,
+        }
+        return self._tables
+
+    @property
+    def results(self) -> pd.DataFrame:
+        return self._load_tables()["results"]
+
+    @property
+    def race_info(self) -> pd.DataFrame:
+        return self._load_tables()["race_info"]
+
+    @property
+    def horse_results(self) -> pd.DataFrame:
+        return self._load_tables()["horse_results"]
+
+    @property
+    def entity_history(self) -> pd.DataFrame:
+        """
+        騎手・調教師・馬主の成績の集計に使う、`date_to`より前のすべての出走。
+
+        前処理済みのレース結果に開催日・コース種別・開催場所・距離を、馬の過去成績から
+        賞金を結合する。`date_from`より前のレースも、それ以降の行の集計に使うため含める。
+        """
+        if self._entity_history is not None:
+            return self._entity_history
+        filters = []
+        if self.date_to is not None:
+            filters.append((COLUMN_DATE, "<", pd.Timestamp(self.date_to)))
+        race_info = self.store.read(
+            self.race_info_table,
+            columns=[
+                COLUMN_RACE_ID,
+                COLUMN_DATE,
+                COLUMN_RACE_TYPE,
+                COLUMN_PLACE,
+                COLUMN_COURSE_LEN,
+            ],
+            filters=filters,
+        )
+        results = self.store.read(
+            self.entity_results_table,
+            columns=[
+                COLUMN_RACE_ID,
+                COLUMN_HORSE_ID,
+                COLUMN_RANK,
+                *ENTITY_FEATURE_COLUMNS,
+            ],
+        )
+        prize = self.horse_results[
+            [COLUMN_HORSE_ID, COLUMN_DATE, COLUMN_PRIZE]
+        ].drop_duplicates([COLUMN_HORSE_ID, COLUMN_DATE], keep="last")
+        history = results.merge(race_info, on=COLUMN_RACE_ID).merge(
+            prize, on=[COLUMN_HORSE_ID, COLUMN_DATE], how="left"
+        )
+        rank = history[COLUMN_RANK].to_numpy(dtype=np.float64, na_value=np.nan)
+        history["win"] = np.where(np.isnan(rank), np.nan, rank == 1)
+        history["top3"] = np.where(np.isnan(rank), np.nan, rank <= 3)
+        self._entity_history = history
+        return history
+
+    def _block_key(self, block: str, tables: list, params: dict, code: list) -> str:
+        """
+        特徴量ブロックのキャッシュキーを求める。
+
+        Args:
+            block (str): ブロック名。
+            tables (list): ブロックの入力となるテーブル名のリスト。
+            params (dict): ブロックのパラメータ。
+            code (list): ブロックの計算に使う関数のリスト（ソースコードをキーに含める）。
+        """
+        inputs = {
+            table: self.cache.input_hash(self.store.path(table)) for table in tables
+        }
+        params = {"date_from": self.date_from, "date_to": self.date_to, **params}
+        return self.cache.key(block, inputs, params, code_version(*code))
+
+    def _population_key(self) -> str:
+        return self._block_key(
+            "population",
+            [self.results_table, self.race_info_table],
+            {},
+            [FeatureCreator._create_population],
+        )
+
+    def _agg_horse_n_races_key(self, n_races: list) -> str:
+        return self._block_key(
+            "agg_horse_n_races",
+            [self.results_table, self.race_info_table, self.horse_results_table],
+            {"n_races": list(n_races)},
+            [
+                FeatureCreator._create_population,
+                FeatureCreator._agg_horse_n_races,
+                asof_trailing_means,
+                AsofIndex,
+            ],
+        )
+
+    def _agg_entity_n_races_key(
+        self, n_races: list, entity_columns: list, splits: list
+    ) -> str:
+        return self._block_key(
+            "agg_entity_n_races",
+            [
+                self.results_table,
+                self.race_info_table,
+                self.horse_results_table,
+                self.entity_results_table,
+            ],
+            {
+                "n_races": list(n_races),
+                "entity_columns": list(entity_columns),
+                "splits": list(splits),
+            },
+            [
+                FeatureCreator._create_population,
+                FeatureCreator.entity_history.fget,
+                FeatureCreator._agg_entity_n_races,
+                EntityAsofIndex,
+                entity_split_keys,
+                AsofIndex,
+            ],
+        )
+
+    def _features_key(self) -> str:
+        """
+        最終的な特徴量のキャッシュキー。`_create_features`が使う各ブロックのキー
+        （入力・パラメータ・コードを含む）から作るため、いずれかのブロックが変われば変わる。
+        """
+        return self._block_key(
+            "features",
+            [self.results_table, self.race_info_table],
+            {
+                "blocks": {
+                    "population": self._population_key(),
+                    "agg_horse_n_races": self._agg_horse_n_races_key(HORSE_N_RACES),
+                    "agg_entity_n_races": self._agg_entity_n_races_key(
+                        ENTITY_N_RACES, ENTITY_FEATURE_COLUMNS, ENTITY_FEATURE_SPLITS
+                    ),
+                }
+            },
+            [FeatureCreator._create_features],
+        )
+
+    @property
+    def population(self) -> pd.DataFrame:
+        """
+        学習母集団（レースID・馬ID・日付）。
+        """
+        if self._population is None:
+            self._population = self.cache.get_or_compute(
+                "population", self._population_key(), self._create_population
+            )
+        return self._population
+
+    def _create_population(self) -> pd.DataFrame:
         # 学習母集団の作成
-        self.population = self.results[[COLUMN_RACE_ID, COLUMN_HORSE_ID]].merge(
+        return self.results[[COLUMN_RACE_ID, COLUMN_HORSE_ID]].merge(
             self.race_info[[COLUMN_RACE_ID, COLUMN_DATE]], on=COLUMN_RACE_ID
         )
 
+    def agg_horse_n_races(
+        self,
+        n_races: list[int] = HORSE_N_RACES,
+    ):
+        """
+        直近nレースの着順と賞金の平均を集計する。
+
+        各馬の過去成績のうちレース日より前（当日を含まない）のものだけを使い、
+        すべてのnをまとめて`asof_trailing_means`で計算する。過去成績の無い馬はNaNとなる。
+
+        Args:
+            n_races (list[int], optional): 集計する直近のレース数のリスト。
+        """
+        self.agg_horse_n_races_df = self.cache.get_or_compute(
+            "agg_horse_n_races",
+            self._agg_horse_n_races_key(n_races),
+            lambda: self._agg_horse_n_races(n_races),
+        )
+
+    def _agg_horse_n_races(self, n_races: list[int]) -> pd.DataFrame:
+        agg_df = asof_trailing_means(
+            self.population,
+            self.horse_results,
+            COLUMN_HORSE_ID,
+            [COLUMN_RANK, COLUMN_PRIZE],
+            n_races,
+        )
+        return pd.concat([self.population, agg_df], axis=1)
+
+    def agg_entity_n_races(
+        self,
+        n_races: list[int] = ENTITY_N_RACES,
+        entity_columns: list = ENTITY_FEATURE_COLUMNS,
+        splits: list = ENTITY_FEATURE_SPLITS,
+    ):
+        """
+        騎手・調教師・馬主毎に、直近nレースの勝率・複勝率・平均着順・平均賞金を集計する。
 
-def agg_horse_n_races(
-    self,
-    n_races: list[int] = [
-        RANK_0003_RACE,
-        RANK_0005_RACE,
-        RANK_0010_RACE,
-        RANK_1000_RACE,
-    ],
-):
-    # 直近nレースの着順と賞金の平均を集計する関数。
-    grouped_df = (
-        self.population.merge(
-            self.horse_results, on=[COLUMN_RACE_ID], suffixes=("", "_horse")
-        )
-        .query("date > date_horse")
-        .sort_values("date_horse", ascending=False)
-        .groupby([COLUMN_RACE_ID, COLUMN_RACE_ID])
-    )
-    merged_df = self.population.copy()
-    for n_race in n_races:
-        df = (
-            grouped_df.head(n_race)
-            .groupby([COLUMN_RACE_ID, COLUMN_RACE_ID])[[COLUMN_RANK, COLUMN_PRIZE]]
-            .mean()
-        ).add_suffix(f"_{n_race}-races")
-        merged_df = merged_df.merge(
-            df,
-            on=[COLUMN_RACE_ID, COLUMN_RACE_ID],
-        )
-    self.agg_horse_n_races_df = merged_df
-
-
-def create_features(self):
-    """
-    特徴量作成処理を実行し、populationテーブルに全ての特徴量を結合する。
-    """
-    self.agg_horse_n_races()
-    features = (
-        self.population.merge(self.results, on=[COLUMN_RACE_ID, COLUMN_RACE_ID])
-        .merge(self.race_info, on=[COLUMN_RACE_ID, COLUMN_DATE])
-        .merge(
-            self.agg_horse_n_races_df,
-            on=[COLUMN_RACE_ID, COLUMN_DATE, COLUMN_RACE_ID],
+        `splits`の条件（コース種別・開催場所・距離）が同じレースだけでの集計も求める。
+        各行のレース日より前（当日を含まない）の出走だけを使い、
+        `(騎手などのコード, 条件のコード)`をキーとした`AsofIndex`で、
+        ソートと`searchsorted`・累積和の差から計算する（O(n log n)）。
+        列名は`[jockey|trainer|owner]_[条件の列名]_[値]_[n]-races`
+        （条件で分けない集計は条件の列名を除く）となる。
+
+        Args:
+            n_races (list[int], optional): 集計する直近の出走数のリスト。
+            entity_columns (list, optional): 集計する騎手・調教師・馬主のIDの列名。
+            splits (list, optional): 条件で分けて集計する列名（Noneは条件で分けない）。
+        """
+        self.agg_entity_n_races_df = self.cache.get_or_compute(
+            "agg_entity_n_races",
+            self._agg_entity_n_races_key(n_races, entity_columns, splits),
+            lambda: self._agg_entity_n_races(n_races, entity_columns, splits),
+        )
+
+    def _agg_entity_n_races(
+        self, n_races: list[int], entity_columns: list, splits: list
+    ) -> pd.DataFrame:
+        history = self.entity_history
+        queries = self.population.merge(
+            self.results[
+                [COLUMN_RACE_ID, COLUMN_HORSE_ID, *entity_columns]
+            ].drop_duplicates([COLUMN_RACE_ID, COLUMN_HORSE_ID]),
+            on=[COLUMN_RACE_ID, COLUMN_HORSE_ID],
             how="left",
+        ).merge(
+            self.race_info[
+                [COLUMN_RACE_ID, *[split for split in splits if split is not None]]
+            ].drop_duplicates(COLUMN_RACE_ID),
+            on=COLUMN_RACE_ID,
+            how="left",
+        )
+        query_dates = queries[COLUMN_DATE].to_numpy()
+        columns = {}
+        for split in splits:
+            for entity_column in entity_columns:
+                # 索引は1つずつ作り、集計したら捨てる（同時に持つのは1つだけ）
+                index = EntityAsofIndex(
+                    history, entity_column, split, ENTITY_VALUE_COLUMNS
+                )
+                for column, values in index.trailing_means(
+                    queries[entity_column].to_numpy(dtype=np.int64, na_value=-1),
+                    None if split is None else queries[split].to_numpy(dtype=object),
+                    query_dates,
+                    n_races,
+                ).items():
+                    columns[column] = values.astype(np.float32)
+        return pd.concat(
+            [self.population, pd.DataFrame(columns, index=self.population.index)],
+            axis=1,
+        )
+
+    def create_features(self):
+        """
+        特徴量作成処理を実行し、populationテーブルに全ての特徴量を結合する。
+
+        入力・パラメータ・コードが前回から変わっていなければ、キャッシュ済みの結果を返す。
+        変わっている場合も、変更の影響を受けないブロックはキャッシュから読み込む。
+        キャッシュ済みの結果が保存済みの`FEATURES_TABLE`と同じ場合は保存し直さない。
+        """
+        key = self._features_key()
+        features = self.cache.get_or_compute("features", key, self._create_features)
+        self._write_features(features, key)
+        return features
+
+    def _write_features(self, features: pd.DataFrame, key: str):
+        """
+        特徴量を`FEATURES_TABLE`として保存する。
+
+        保存したときのキャッシュキーとファイルの更新時刻を`[テーブルのファイル名].key.json`に記録し、
+        同じキーの特徴量が保存済みでその後に書き換えられていなければ保存し直さない。
+        ただし入力テーブルより古い場合は、内容が最新であることを示すため更新時刻だけを進める
+        （パイプラインが入力より古い出力を最新でないとみなすため）。
+        """
+        path = self.store.path(FEATURES_TABLE)
+        key_path = path.with_name(path.name + ".key.json")
+        saved = None
+        if key_path.is_file() and path.is_file():
+            with open(key_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        if (
+            saved is not None
+            and saved["key"] == key
+            and saved["mtime_ns"] == path.stat().st_mtime_ns
+        ):
+            newest_input = max(
+                self.store.path(table).stat().st_mtime_ns
+                for table in [
+                    self.results_table,
+                    self.race_info_table,
+                    self.horse_results_table,
+                    self.entity_results_table,
+                ]
+            )
+            if path.stat().st_mtime_ns >= newest_input:
+                logger.info(f"features: up to date ({path})")
+                return
+            os.utime(path)
+        else:
+            self.store.write(FEATURES_TABLE, features)
+        tmp_path = key_path.with_name(key_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "mtime_ns": path.stat().st_mtime_ns}, f)
+        os.replace(tmp_path, key_path)
+
+    def _create_features(self) -> pd.DataFrame:
+        # `_features_key`のブロックと同じパラメータで作る
+        self.agg_horse_n_races(HORSE_N_RACES)
+        self.agg_entity_n_races(
+            ENTITY_N_RACES, ENTITY_FEATURE_COLUMNS, ENTITY_FEATURE_SPLITS
+        )
+        return (
+            self.population.merge(self.results, on=[COLUMN_RACE_ID, COLUMN_HORSE_ID])
+            .merge(self.race_info, on=[COLUMN_RACE_ID, COLUMN_DATE])
+            .merge(
+                self.agg_horse_n_races_df,
+                on=[COLUMN_RACE_ID, COLUMN_DATE, COLUMN_HORSE_ID],
+                how="left",
+            )
+            .merge(
+                self.agg_entity_n_races_df,
+                on=[COLUMN_RACE_ID, COLUMN_DATE, COLUMN_HORSE_ID],
+                how="left",
+            )
         )
-    )
-    features.to_csv(self.output_dir / FEATURES_CSV, sep="\t", index=None)
-    return features
@@ -4,6 +4,10 @@ from src.preprocessing.modules.scrape_race_id_list import scrape_race_id_list
 from src.preprocessing.modules.scrape_html_race import scrape_html_race
 from src.preprocessing.modules.create_race_result import create_race_result
 from src.preprocessing.modules.scrape_html_horse import scrape_html_horse
+from src.preprocessing.modules.plan_horse_refresh import (
+    plan_horse_refresh,
+    upcoming_horse_ids,
+)
 from src.preprocessing.modules.create_horse_result import create_horse_result
 
 
@@ -12,6 +16,8 @@ def get_raw_data():
     生データを取得し、レース結果データと馬の結果データをスクレイピングする関数。
     - 開催日一覧を取得し、そこからレースID一覧を生成。
     - 各レースIDに基づいてHTMLデータを取得。
+    - 馬のページは、未取得の馬と取得後に出走した馬だけを`plan_horse_refresh`で選んで取得する
+      （予測サービスに予測を依頼された出走予定の馬を最優先とする）。
     - 取得したHTMLデータを基に、レース結果と馬の結果データを生成する。
 
     Returns:
@@ -23,15 +29,11 @@ def get_raw_data():
     race_id_list = scrape_race_id_list(kaisai_date_list)
     # レースIDに基づいてHTMLデータをスクレイピング
     scrape_html_race(race_id_list)
-    # 取得したレースHTMLデータのパス一覧を作成
-    html_paths_race = list(Path(HTML_RACE_DIR).glob("*"))
-    # レース結果データを生成
-    race_results = create_race_result(html_paths_race)
-    # レース結果から馬ID一覧を抽出
-    horse_id_list = race_results[COLUMN_HORSE_ID].unique()
+    # アーカイブ内の全レースHTMLデータからレース結果データを生成
+    create_race_result()
+    # 未取得の馬と、ページの取得後に出走した馬だけを優先度の順に選ぶ
+    horse_id_list = plan_horse_refresh(upcoming_horse_ids())
     # 馬IDに基づいてHTMLデータをスクレイピング
     scrape_html_horse(horse_id_list, False)
-    # 取得した馬HTMLデータのパス一覧を作成
-    html_paths_horse = list(Path(HTML_HORSE_DIR).glob("*"))
-    # 馬結果データを生成
-    create_horse_result(html_paths_horse)
+    # アーカイブ内の全馬HTMLデータから馬結果データを生成
+    create_horse_result()
@@ -2,16 +2,17 @@ from src.config import *
 from src.preprocessing.modules.extract_ids import extract_ids
 
 
-def id_names(soup, df):
+def id_names(element, df):
     """
     HTMLから馬、騎手、調教師、馬主のIDを抽出し、指定されたDataFrameに追加する関数。
 
     Args:
-        soup (bs4.BeautifulSoup): BeautifulSoupで解析されたHTMLデータ。
+        element (lxml.html.HtmlElement): lxmlで解析されたレース結果テーブル。
         df (pandas.DataFrame): IDを追加する対象のDataFrame。
 
     Returns:
-        pandas.DataFrame: 各ID列が追加されたDataFrame。
+        pandas.DataFrame: 各ID列が追加されたDataFrame。IDは文字列のまま追加し、
+            int32のコードへの変換は`create_race_result`で結合後にまとめて行う。
     """
     id_specs = [
         (r"^/horse/", COLUMN_HORSE_ID, HORSE_ID_LENGTH),
@@ -21,6 +22,6 @@ def id_names(soup, df):
     ]
 
     for regex, column, length in id_specs:
-        df[column] = extract_ids(soup, regex, length)
+        df[column] = extract_ids(element, regex, length)
 
     return df
@@ -0,0 +1,93 @@
+from src.config import *
+from src.preprocessing.modules.parse_html_archive import parse_html_archive
+
+
+def partition_key(item_id) -> str:
+    """
+    IDから出力パーティション名を求める。レースID・馬IDとも先頭4桁は年を表すため、年単位で分割する。
+    """
+    return str(item_id)[:PARTITION_KEY_LENGTH]
+
+
+def ingest_html_archive(
+    parse_func,
+    archive: HtmlArchive,
+    id_list: list,
+    manifest_path: Path,
+    table_names: tuple,
+    workers: int = PARSE_WORKERS,
+    incremental: bool = True,
+) -> dict:
+    """
+    HTMLアーカイブのページを解析し、テーブル毎のパーティションへ差分で取り込む関数。
+
+    `incremental=True` の場合、台帳(`IngestManifest`)と比較して新規または再取得された
+    ページだけを解析し、該当IDの行だけをパーティション内で置き換える。
+    `incremental=False` の場合は台帳とパーティションを削除し、`id_list`を全件取り込み直す。
+    パーティション内の行はアーカイブ上の並び順（再取得されたページは末尾）に保たれるため、
+    差分取り込みと全件取り込みの結果は一致する。
+    解析に失敗したページは台帳に記録しないため、次回の実行で再び解析される
+    （解析処理の修正後に、ページを取得し直さずに取り込める）。
+
+    Args:
+        parse_func (callable): `(item_id, html)` を受け取り、`table_names`の順に
+            DataFrame（1つの場合はDataFrame単体）を返す関数。失敗時はNoneを返す。
+        archive (HtmlArchive): 取り込み元のHTMLアーカイブ。
+        id_list (list): 取り込み対象のIDのリスト。
+        manifest_path (Path): 台帳ファイルのパス。
+        table_names (tuple): 出力テーブル名。パーティションは`PARTITION_DIR / テーブル名`に保存される。
+        workers (int, optional): 解析に使うプロセス数。デフォルトは`PARSE_WORKERS`。
+        incremental (bool, optional): 差分取り込みを行うかどうか。デフォルトはTrue。
+
+    Returns:
+        dict: テーブル名をキー、全パーティションを結合したDataFrameを値とする辞書。
+    """
+    manifest = IngestManifest(manifest_path)
+    stores = {name: PartitionStore(PARTITION_DIR / name) for name in table_names}
+    if incremental:
+        target_list = manifest.changed_ids(archive, id_list)
+    else:
+        manifest.clear()
+        for store in stores.values():
+            store.clear()
+        target_list = list(id_list)
+    # アーカイブ上の並び順で処理する
+    target_list.sort(
+        key=lambda item_id: archive.locate(item_id)[0] if item_id in archive else -1
+    )
+    logger.info(f"{manifest_path.stem}: {len(target_list)}/{len(id_list)} to ingest")
+
+    # 解析結果をテーブル・パーティション毎に振り分ける
+    new_dfs = {name: {} for name in table_names}
+    failed_ids = []
+    for result in parse_html_archive(
+        parse_func, archive, target_list, workers, failed_ids=failed_ids
+    ):
+        if not isinstance(result, tuple):
+            result = (result,)
+        for name, df in zip(table_names, result):
+            if df is not None and len(df) > 0:
+                key = partition_key(df.index[0])
+                new_dfs[name].setdefault(key, []).append(df)
+
+    # 対象IDの行をパーティション毎に置き換える
+    target_ids = {}
+    for item_id in target_list:
+        target_ids.setdefault(partition_key(item_id), []).append(item_id)
+    for name, store in stores.items():
+        for key, ids in target_ids.items():
+            store.replace_rows(key, ids, new_dfs[name].get(key, []))
+
+    failed = set(failed_ids)
+    if failed:
+        logger.warning(
+            f"{manifest_path.stem}: {len(failed)} pages failed to parse, "
+            "will be retried on the next run"
+        )
+    manifest.record(
+        archive,
+        [item_id for item_id in target_list if item_id not in failed],
+        partition_key,
+    )
+    manifest.save()
+    return {name: store.concat_all() for name, store in stores.items()}
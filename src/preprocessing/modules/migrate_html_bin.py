@@ -0,0 +1,35 @@
+from src.config import *
+
+
+def migrate_html_bin(bin_dir: Path, pack_path: Path) -> int:
+    """
+    `[id].bin` 形式で保存された既存のHTMLファイル群をHTMLアーカイブへ移行する関数。
+
+    `bin_dir` 直下の `*.bin` に加え、以前の区切り文字 `"\\"` のバグによって
+    親ディレクトリに `race\\[id].bin` のような名前で作られてしまったファイルも対象とする。
+    取得時刻としてファイルの更新時刻を引き継ぐ。既にアーカイブに存在するIDはスキップするため、
+    途中で中断しても再実行できる。元のファイルは削除しない。
+
+    Args:
+        bin_dir (Path): `.bin` ファイルが保存されているディレクトリ。
+        pack_path (Path): 移行先のアーカイブ本体のパス。
+
+    Returns:
+        int: 新たにアーカイブへ追加した件数。
+    """
+    bin_dir = Path(bin_dir)
+    archive = HtmlArchive(pack_path)
+    bin_paths = list(bin_dir.glob("*.bin"))
+    bin_paths += list(bin_dir.parent.glob(bin_dir.name + "\\*.bin"))
+
+    migrated = 0
+    for bin_path in tqdm(bin_paths):
+        item_id = bin_path.stem.split("\\")[-1]
+        if item_id in archive:
+            continue
+        with open(bin_path, "rb") as rf:
+            html = rf.read()
+        archive.put(item_id, html, stored_at=bin_path.stat().st_mtime)
+        migrated += 1
+    logger.info(f"{bin_dir} -> {pack_path}: {migrated}/{len(bin_paths)} migrated")
+    return migrated
@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from src.config import *
+
+
+def _parse_chunk(parse_func, pack_path, chunk):
+    """
+    ワーカープロセスで実行される処理。チャンク内のHTMLを読み出して`parse_func`を適用する。
+
+    Args:
+        parse_func (callable): `(item_id, html)` を受け取り解析結果またはNoneを返す関数。
+        pack_path (Path): HTMLアーカイブ本体のパス。
+        chunk (list): `(item_id, offset, length)` のリスト。
+
+    Returns:
+        tuple: `(Noneを除いた解析結果のリスト, ページ毎の解析時間のリスト, 失敗したIDのリスト)`。
+            解析結果はチャンク内の順序を保つ。
+    """
+    result_list = []
+    latency_list = []
+    failed_ids = []
+    for item_id, offset, length in chunk:
+        html = HtmlArchive.read_at(pack_path, offset, length)
+        start = time.perf_counter()
+        result = parse_func(item_id, html)
+        latency_list.append(time.perf_counter() - start)
+        if result is not None:
+            result_list.append(result)
+        else:
+            failed_ids.append(item_id)
+    return result_list, latency_list, failed_ids
+
+
+def _record_chunk(parse_func, chunk, latency_list, failed):
+    """
+    チャンクの解析時間と件数を計測値に記録する（ワーカーの計測値は親プロセスでまとめる）。
+    """
+    histogram = f"{parse_func.__name__}_seconds"
+    for latency in latency_list:
+        metrics.observe(histogram, latency)
+    metrics.count("pages_parsed", len(chunk) - failed)
+    metrics.count("pages_failed", failed)
+    metrics.count("html_bytes_read", sum(length for _, _, length in chunk))
+
+
+def parse_html_archive(
+    parse_func,
+    archive: HtmlArchive,
+    id_list: list,
+    workers: int = PARSE_WORKERS,
+    chunk_size: int = PARSE_CHUNK_SIZE,
+    failed_ids: list = None,
+) -> list:
+    """
+    HTMLアーカイブ内の指定IDのページを解析し、解析結果のリストを返す関数。
+
+    `workers=1` の場合は現在のプロセスで順に解析する。`workers>1` の場合はIDを
+    `chunk_size` 件ずつのチャンクに分けてプロセスプールに割り振る。ワーカーには
+    アーカイブ内の位置だけを渡し、HTMLの読み出しもワーカー側で行う。
+    結果は入力の順序を保って返すため、どちらの場合も同じ出力となる。
+    ページ毎の解析時間・解析/失敗件数・読み出したバイト数は`metrics`に記録し、
+    進捗は`PROGRESS_INTERVAL_SECONDS`毎にログへ出力する。
+
+    Args:
+        parse_func (callable): `(item_id, html)` を受け取り解析結果（DataFrame等）またはNoneを返す関数。
+            プロセス間で受け渡すため、モジュールのトップレベルで定義された関数であること。
+            ページ毎のエラーは`parse_func`内でログに記録し、Noneを返すこと。
+        archive (HtmlArchive): 読み込み対象のHTMLアーカイブ。
+        id_list (list): 対象とするIDのリスト。
+        workers (int, optional): プロセス数。デフォルトは`PARSE_WORKERS`。
+        chunk_size (int, optional): 1回にワーカーへ渡す件数。デフォルトは`PARSE_CHUNK_SIZE`。
+        failed_ids (list, optional): 指定した場合、アーカイブに無いIDと解析に失敗した
+            （`parse_func`がNoneを返した）IDを追加する。
+
+    Returns:
+        list: Noneを除いた解析結果のリスト。
+    """
+    if failed_ids is None:
+        failed_ids = []
+    targets = []
+    for item_id in id_list:
+        if item_id not in archive:
+            logger.error(f"{item_id}:" + ERROR_NOT_IN_ARCHIVE)
+            failed_ids.append(item_id)
+            continue
+        targets.append((item_id, *archive.locate(item_id)))
+
+    chunks = [targets[i : i + chunk_size] for i in range(0, len(targets), chunk_size)]
+    result_list = []
+    with Progress(
+        parse_func.__name__, len(targets), PROGRESS_INTERVAL_SECONDS, logger
+    ) as progress:
+        if workers <= 1:
+            results = (
+                _parse_chunk(parse_func, archive.pack_path, chunk) for chunk in chunks
+            )
+            for chunk, (chunk_result_list, latency_list, chunk_failed_ids) in zip(
+                chunks, results
+            ):
+                result_list.extend(chunk_result_list)
+                failed_ids.extend(chunk_failed_ids)
+                _record_chunk(parse_func, chunk, latency_list, len(chunk_failed_ids))
+                progress.update(len(chunk))
+            return result_list
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _parse_chunk,
+                [parse_func] * len(chunks),
+                [archive.pack_path] * len(chunks),
+                chunks,
+            )
+            for chunk, (chunk_result_list, latency_list, chunk_failed_ids) in zip(
+                chunks, results
+            ):
+                result_list.extend(chunk_result_list)
+                failed_ids.extend(chunk_failed_ids)
+                _record_chunk(parse_func, chunk, latency_list, len(chunk_failed_ids))
+                progress.update(len(chunk))
+    return result_list
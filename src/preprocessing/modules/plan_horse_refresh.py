@@ -0,0 +1,216 @@
+import time
+
+import numpy as np
+
+from src.config import *
+
+# 再取得の優先度（小さいほど先に取得する）
+PRIORITY_UPCOMING = 0  # 出走予定の馬
+PRIORITY_MISSING = 1  # アーカイブに無い馬
+PRIORITY_STALE = 2  # 取得後に出走した馬
+PRIORITY_FAILED = 3  # 前回の取得に失敗した馬（出走予定の馬を除く）
+
+
+def last_race_dates() -> pd.Series:
+    """
+    レース結果から馬毎の最終出走日を求める。
+
+    Returns:
+        pandas.Series: 馬IDのコードをインデックス、最終出走日を値とするシリーズ。
+    """
+    race_results = table_store.read(
+        RACE_RESULTS_TABLE, columns=[COLUMN_RACE_ID, COLUMN_HORSE_ID]
+    )
+    race_info = table_store.read(RACE_INFO_TABLE, columns=[COLUMN_RACE_ID, "info2"])
+    date_parts = race_info["info2"].str[0].str.extract(DATE_PARTS_PATTERN)
+    race_dates = pd.Series(
+        pd.to_datetime(
+            {"year": date_parts[0], "month": date_parts[1], "day": date_parts[2]},
+            errors="coerce",
+        ).to_numpy(),
+        index=race_info[COLUMN_RACE_ID].to_numpy(),
+    )
+    race_dates = race_dates[~race_dates.index.duplicated(keep="last")]
+    dates = race_dates.reindex(race_results[COLUMN_RACE_ID].to_numpy()).to_numpy()
+    return (
+        pd.Series(dates, index=race_results[COLUMN_HORSE_ID].to_numpy())
+        .groupby(level=0)
+        .max()
+    )
+
+
+def fetched_dates(horse_id_list) -> pd.Series:
+    """
+    馬毎にページを最後に取得（または304で確認）した日付を求める。
+
+    アーカイブへの書き込み時刻と`HTML_HORSE_VALIDATORS`の確認時刻のうち新しい方を、
+    `RACE_TIMEZONE`の日付に変換して返す。アーカイブに無い馬はNaTとなる。
+
+    Args:
+        horse_id_list (list): 馬IDのリスト。
+
+    Returns:
+        pandas.Series: `horse_id_list`と同じ順序の日付。
+    """
+    archive = HtmlArchive(HTML_HORSE_PACK)
+    validators = PageValidators(HTML_HORSE_VALIDATORS)
+    timestamps = []
+    for horse_id in horse_id_list:
+        if horse_id not in archive:
+            timestamps.append(np.nan)
+            continue
+        checked_at = validators.checked_at(horse_id)
+        stored_at = archive.stored_at(horse_id)
+        timestamps.append(
+            stored_at if checked_at is None else max(stored_at, checked_at)
+        )
+    return (
+        pd.to_datetime(pd.Series(timestamps, dtype=float), unit="s", utc=True)
+        .dt.tz_convert(RACE_TIMEZONE)
+        .dt.tz_localize(None)
+        .dt.normalize()
+    )
+
+
+def retry_due(
+    horse_id_list,
+    now: float = None,
+    retry_seconds: float = HORSE_REFRESH_RETRY_SECONDS,
+    max_retry_seconds: float = HORSE_REFRESH_RETRY_MAX_SECONDS,
+) -> tuple:
+    """
+    馬毎に、連続した取得失敗の回数と、再び取得を試してよいかどうかを求める。
+
+    n回続けて失敗した馬は、最後の失敗から`retry_seconds * 2^(n-1)`
+    （`max_retry_seconds`まで）経つまで試さない。
+
+    Args:
+        horse_id_list (list): 馬IDのリスト。
+        now (float, optional): 現在時刻(UNIX時間)。省略時は現在時刻。
+
+    Returns:
+        tuple: `horse_id_list`と同じ順序の、失敗の回数と試してよいかどうかの配列。
+    """
+    now = time.time() if now is None else now
+    validators = PageValidators(HTML_HORSE_VALIDATORS)
+    failures = np.zeros(len(horse_id_list), dtype=np.int64)
+    due = np.ones(len(horse_id_list), dtype=bool)
+    for i, horse_id in enumerate(horse_id_list):
+        count, failed_at = validators.failures(horse_id)
+        if count:
+            failures[i] = count
+            wait = min(retry_seconds * 2 ** (count - 1), max_retry_seconds)
+            due[i] = failed_at + wait <= now
+    return failures, due
+
+
+def upcoming_horse_ids(path: Path = UPCOMING_ENTRIES_FILE) -> list:
+    """
+    出走予定の馬（予測サービスに予測を依頼された馬のうち、開催日が今日以降の馬）のIDを返す。
+    """
+    today = pd.Timestamp.now(tz=RACE_TIMEZONE).strftime("%Y-%m-%d")
+    return UpcomingEntries(path).horse_ids(since=today)
+
+
+def horse_refresh_candidates(upcoming_horse_ids=()) -> pd.DataFrame:
+    """
+    ページの再取得が必要な馬を、優先度の順に並べて返す。
+
+    最終出走日がページの取得日以降の馬（取得した時点のページにその結果が無い馬）と、
+    アーカイブに無い馬を対象とし、それ以外の馬は再取得しない。
+    優先度は出走予定の馬、アーカイブに無い馬、取得後に出走した馬、前回の取得に失敗した馬の順で、
+    同じ優先度では最終出走日が新しい馬を先にする。取得に失敗し続けている馬（削除されたページなど）が
+    他の馬の再取得を妨げないよう、失敗した馬は`retry_due`の間隔が経つまで対象から外す
+    （出走予定の馬も同じ間隔を空けるが、優先度は下げない）。
+
+    Args:
+        upcoming_horse_ids (list, optional): 出走予定の馬IDのリスト（`upcoming_horse_ids()`）。
+            対象となる場合は最優先で取得する。
+
+    Returns:
+        pandas.DataFrame: `horse_id`・`last_race_date`・`fetched_date`・`failures`・
+            `priority`列を持つ、優先度の順に並べたデータフレーム。
+    """
+    last_dates = last_race_dates()
+    horse_id_list = id_registry.decode(COLUMN_HORSE_ID, last_dates.index)
+    # レース結果に無い出走予定の馬（初出走など）も、ページが無ければ対象にする
+    known = set(horse_id_list)
+    new_ids = [
+        horse_id
+        for horse_id in dict.fromkeys(upcoming_horse_ids)
+        if horse_id not in known
+    ]
+    horse_id_list = np.concatenate([horse_id_list, np.array(new_ids, dtype=object)])
+    last_dates = pd.concat(
+        [last_dates, pd.Series(pd.NaT, index=range(len(new_ids)))], ignore_index=True
+    )
+    df = pd.DataFrame(
+        {
+            COLUMN_HORSE_ID: horse_id_list,
+            "last_race_date": last_dates.to_numpy(),
+            "fetched_date": fetched_dates(horse_id_list).to_numpy(),
+        }
+    )
+    df = df[df[COLUMN_HORSE_ID].notna()]
+    missing = df["fetched_date"].isna()
+    stale = df["last_race_date"] >= df["fetched_date"]
+    df = df[missing | stale]
+    failures, due = retry_due(df[COLUMN_HORSE_ID].tolist())
+    df = df[due].assign(failures=failures[due])
+    df["priority"] = np.where(
+        df["fetched_date"].isna(), PRIORITY_MISSING, PRIORITY_STALE
+    )
+    df.loc[df["failures"] > 0, "priority"] = PRIORITY_FAILED
+    df.loc[df[COLUMN_HORSE_ID].isin(list(upcoming_horse_ids)), "priority"] = (
+        PRIORITY_UPCOMING
+    )
+    return df.sort_values(
+        ["priority", "last_race_date"], ascending=[True, False], kind="stable"
+    ).reset_index(drop=True)
+
+
+def select_horse_refresh(
+    candidates: pd.DataFrame, max_requests: int = HORSE_REFRESH_MAX_REQUESTS
+) -> list:
+    """
+    `horse_refresh_candidates`の結果の先頭から最大`max_requests`件の馬IDを取り出す。
+
+    Args:
+        candidates (pandas.DataFrame): `horse_refresh_candidates`の結果。
+        max_requests (int, optional): 1回の実行で再取得する馬の上限。Noneの場合は上限なし。
+
+    Returns:
+        list: 優先度の順に並べた馬IDのリスト。
+    """
+    counts = candidates["priority"].value_counts()
+    plan = candidates[COLUMN_HORSE_ID].tolist()[:max_requests]
+    logger.info(
+        f"horse refresh: {len(plan)}/{len(candidates)} planned "
+        f"(upcoming {counts.get(PRIORITY_UPCOMING, 0)}, "
+        f"missing {counts.get(PRIORITY_MISSING, 0)}, "
+        f"stale {counts.get(PRIORITY_STALE, 0)}, "
+        f"failed {counts.get(PRIORITY_FAILED, 0)})"
+    )
+    metrics.count("horse_refresh_deferred", len(candidates) - len(plan))
+    return plan
+
+
+def plan_horse_refresh(
+    upcoming_horse_ids=(), max_requests: int = HORSE_REFRESH_MAX_REQUESTS
+) -> list:
+    """
+    今回の実行で再取得する馬IDのリストを返す。
+
+    `horse_refresh_candidates`の先頭から最大`max_requests`件を取り出す。
+    上限を超えた馬は次回以降の実行で（再取得が必要なままであれば）取得される。
+
+    Args:
+        upcoming_horse_ids (list, optional): 出走予定の馬IDのリスト。
+        max_requests (int, optional): 1回の実行で再取得する馬の上限。Noneの場合は上限なし。
+
+    Returns:
+        list: 優先度の順に並べた馬IDのリスト。
+    """
+    return select_horse_refresh(
+        horse_refresh_candidates(upcoming_horse_ids), max_requests
+    )
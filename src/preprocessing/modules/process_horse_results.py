@@ -1,34 +1,49 @@
 from src.config import *
 
+# 前処理で読み込む列
+HORSE_RESULTS_COLUMNS = [
+    COLUMN_HORSE_ID,
+    "日付",
+    "天気",
+    "レース名",
+    "頭数",
+    "着順",
+    "距離",
+    "馬場",
+    "着差",
+    "賞金",
+]
 
-def process_horse_results():
+
+def transform_horse_results(df):
     """
-    馬の結果データを処理し、必要なカラムを抽出して前処理を行う関数。
-    - 必要なカラムに変換を施し、不足しているデータは削除。
-    - 指定したカラム名に基づいてデータを再構成し、最終的にファイルに出力。
+    馬の結果データの前処理を行う関数。各行を独立に変換するため、チャンク毎に適用しても結果は変わらない。
+
+    Args:
+        df (pandas.DataFrame): `HORSE_RESULTS_COLUMNS`の列を持つ馬の結果データ。
 
     Returns:
-        None
+        pandas.DataFrame: 使用する列だけを持つ前処理済みのデータ。
     """
-    df = pd.read_csv(SAVE_DIR / RAWDF_HORSE_FILE_NAME_CSV, sep="\t")
+    df = df.copy()
     df[COLUMN_RANK] = pd.to_numeric(df["着順"], errors="coerce")
     df.dropna(subset=[COLUMN_RANK], inplace=True)
     df[COLUMN_DATE] = pd.to_datetime(df["日付"])
-    df[COLUMN_WEATHER] = df["天気"].map(mapping_loader.get_weather_mapping())
-    df[COLUMN_RACE_TYPE] = df["距離"].str[0].map(mapping_loader.get_race_type_mapping())
+    df[COLUMN_WEATHER] = mapping_loader.get_compiled("weather").map(df["天気"])
+    df[COLUMN_RACE_TYPE] = mapping_loader.get_compiled("race_type").map(
+        df["距離"].str[0]
+    )
     df[COLUMN_COURSE_LEN] = df["距離"].str.extract(r"(\d+)").astype(int)
-    df[COLUMN_GROUND_STATE] = df["馬場"].map(mapping_loader.get_ground_state_mapping())
+    df[COLUMN_GROUND_STATE] = mapping_loader.get_compiled("ground_state").map(
+        df["馬場"]
+    )
     df[COLUMN_RANK_DIFF] = df["着差"].map(lambda x: 0 if x < 0 else x)
     df[COLUMN_PRIZE] = df["賞金"].fillna(0)
-    regex_race_class = "|".join(mapping_loader.get_race_class_mapping().keys())
-    df[COLUMN_RACE_CLASS] = (
-        df["レース名"]
-        .str.extract(rf"({regex_race_class})")[0]
-        .map(mapping_loader.get_race_class_mapping())
-    )
+    # レース名に含まれるクラス名を探す（"G"と"G1"のように重なる場合は長い方を優先する）
+    df[COLUMN_RACE_CLASS] = mapping_loader.get_matcher("race_class").map(df["レース名"])
     df.rename(columns={"頭数": "n_horses"}, inplace=True)
 
-    df = df[
+    return df[
         # ここに使用する列名を列挙
         [
             COLUMN_HORSE_ID,
@@ -44,5 +59,46 @@ def process_horse_results():
             "n_horses",
         ]
     ]
-    SAVE_DIR.mkdir(parents=True, exist_ok=True)
-    df.to_csv(SAVE_DIR / RAWDF_PREPROCESSED_HORSE_FILE_NAME_CSV, sep="\t", index=False)
+
+
+def process_horse_results(memory_limit: int = PROCESS_MEMORY_LIMIT):
+    """
+    馬の結果データを処理し、必要なカラムを抽出して前処理を行う関数。
+    - 必要なカラムに変換を施し、不足しているデータは削除。
+    - 指定したカラム名に基づいてデータを再構成し、最終的にテーブルとして保存。
+    - 保存時に`TABLE_SCHEMAS`で宣言した型（int8/int16・float32・カテゴリ型）に縮小する。
+
+    `memory_limit`を指定すると、1チャンクの処理に使うメモリがその値以下となる行数ずつ
+    馬の結果データを読み込み、チャンク毎に前処理してスキーマの型に縮小してから結合する。
+    文字列の列を含む元データ全体をメモリに展開しないため、小さなマシンでも実行できる。
+    結果は一括で処理した場合と同じになる。
+
+    Args:
+        memory_limit (int, optional): 1チャンクの処理に使うメモリの上限（バイト）。
+            Noneの場合はテーブル全体を一括で読み込む。デフォルトは`PROCESS_MEMORY_LIMIT`。
+
+    Returns:
+        None
+    """
+    if memory_limit is None:
+        # 使用する列だけを読み込む
+        df = table_store.read(HORSE_RESULTS_TABLE, columns=HORSE_RESULTS_COLUMNS)
+        table_store.write(PREPROCESSED_HORSE_RESULTS_TABLE, transform_horse_results(df))
+        return
+
+    chunk_rows = table_store.batch_rows_for_memory(
+        HORSE_RESULTS_TABLE,
+        memory_limit,
+        PROCESS_MEMORY_FACTOR,
+        columns=HORSE_RESULTS_COLUMNS,
+    )
+    logger.info(f"process_horse_results: {chunk_rows} rows per chunk")
+    chunks = [
+        table_store.apply_schema(
+            PREPROCESSED_HORSE_RESULTS_TABLE, transform_horse_results(chunk)
+        )
+        for chunk in table_store.iter_batches(
+            HORSE_RESULTS_TABLE, HORSE_RESULTS_COLUMNS, chunk_rows
+        )
+    ]
+    table_store.write(PREPROCESSED_HORSE_RESULTS_TABLE, table_store.concat(chunks))
@@ -5,17 +5,34 @@ def process_race_results():
     """
     レース結果の生データを処理し、必要なカラムを抽出して前処理を行う関数。
     - 必要なカラムに変換を施し、不足しているデータは削除。
-    - 指定したカラム名に基づいてデータを再構成し、最終的にファイルに出力。
+    - 指定したカラム名に基づいてデータを再構成し、最終的にテーブルとして保存。
+    - 保存時に`TABLE_SCHEMAS`で宣言した型（int8/int16・float32・カテゴリ型）に縮小する。
 
     Returns:
         None
     """
-    df = pd.read_csv(SAVE_DIR / RAWDF_RACE_FILE_NAME_CSV, sep="\t")
+    # 使用する列だけを読み込む
+    df = table_store.read(
+        RACE_RESULTS_TABLE,
+        columns=[
+            COLUMN_RACE_ID,
+            COLUMN_HORSE_ID,
+            COLUMN_JOCKEY_ID,
+            COLUMN_TRAINER_ID,
+            COLUMN_OWNER_ID,
+            "着順",
+            "枠番",
+            "馬番",
+            "性齢",
+            "斤量",
+            "単勝",
+            "人気",
+            "馬体重",
+        ],
+    )
     df[COLUMN_RANK] = pd.to_numeric(df["着順"], errors="coerce")
     df.dropna(subset=[COLUMN_RANK], inplace=True)
-    df[COLUMN_SEX] = (
-        df["性齢"].str[0].map(mapping_loader.get_sex_mapping()).value_counts()
-    )
+    df[COLUMN_SEX] = mapping_loader.get_compiled("sex").map(df["性齢"].str[0])
     df[COLUMN_AGE] = df["性齢"].str[1:].astype(int)
     df[COLUMN_WEIGHT] = df["馬体重"].str.extract(r"(\d+)").astype(int)
     df[COLUMN_WEIGHT] = pd.to_numeric(df[COLUMN_WEIGHT], errors="coerce")
@@ -24,7 +41,7 @@ def process_race_results():
     df[COLUMN_TANSYO] = df["単勝"].astype(float)
     df[COLUMN_POPULARITY] = pd.to_numeric(df["人気"], errors="coerce")
     df.dropna(subset=[COLUMN_POPULARITY], inplace=True)
-    df[COLUMN_IMPOST] = df["斤量"].astype(int)
+    df[COLUMN_IMPOST] = df["斤量"].astype(float)
     df[COLUMN_WAKUBAN] = df["枠番"].astype(int)
     df[COLUMN_UMABAN] = df["馬番"].astype(int)
 
@@ -48,5 +65,4 @@ def process_race_results():
             COLUMN_IMPOST,
         ]
     ]
-    SAVE_DIR.mkdir(parents=True, exist_ok=True)
-    df.to_csv(SAVE_DIR / RAWDF_PREPROCESSED_RACE_FILE_NAME_CSV, sep="\t", index=False)
+    table_store.write(PREPROCESSED_RACE_RESULTS_TABLE, df)
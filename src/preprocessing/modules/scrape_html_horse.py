@@ -1,4 +1,5 @@
 from src.config import *
+from src.fetch_engine import FetchEngine
 
 
 def scrape_html_horse(horse_id_list, skip: bool = True):
@@ -6,34 +7,64 @@ def scrape_html_horse(horse_id_list, skip: bool = True):
     指定された馬IDリストを基にHTMLページをスクレイピングし、指定ディレクトリに保存する。
 
     この関数は、`horse_id_list` から各馬IDを取得し、それに対応するHTMLページを指定されたURLからスクレイピングしてダウンロードする。
-    ダウンロードしたHTMLファイルは、`../data/html/horse` ディレクトリに `horse_id.bin` という名前で保存される。
-    すでにファイルが存在する場合、その馬IDに対するダウンロードはスキップする（`skip=True` の場合）。
+    ダウンロードしたHTMLは、`HTML_HORSE_PACK` (`data/html/horse.pack`) に圧縮して追記される。
+    すでにアーカイブに存在する場合、その馬IDに対するダウンロードはスキップする（`skip=True` の場合）。
+    再取得したページは同じIDで追記され、以降は新しい方が読み出される。
+    取得に失敗した馬は`HTML_HORSE_VALIDATORS`に失敗として記録し、再取得の計画
+    （`horse_refresh_candidates`）で間隔を空けて後回しにする。
+    アーカイブに存在する馬を再取得する場合は、前回の`ETag`・`Last-Modified`
+    (`HTML_HORSE_VALIDATORS`)を付けて条件付きで取得し、変わっていないページ(304)は追記しない。
 
-    スクレイピング中には1秒間の待機を挟みながら行う。
+    スクレイピングは `FetchEngine` により並列に行われ、ホスト毎のレート制限
+    (`FETCH_RATE_PER_SECOND`) を超えない範囲で `FETCH_MAX_WORKERS` 件まで同時に通信する。
 
     Args:
         horse_id_list (list): スクレイピング対象となる馬IDのリスト。
-        skip (bool, optional): ファイルが既に存在する場合にスキップするかどうか。デフォルトはTrue。
-
-    Raises:
-        Exception: スクレイピングやファイル書き込み中にエラーが発生した場合。
+        skip (bool, optional): アーカイブに既に存在する場合にスキップするかどうか。デフォルトはTrue。
     """
-    path_list = []
-    HTML_HORSE_DIR.mkdir(parents=True, exist_ok=True)
-    for horse_id in tqdm(horse_id_list):
-        try:
-            html_file = str(HTML_HORSE_DIR) + "\\" + horse_id + ".bin"
-            # 既にファイルが存在し、スキップする設定の場合はスキップ
-            if Path(html_file).is_file() and skip:
-                logger.info("skip:" + horse_id)
-                continue
-            time.sleep(LOOP_WAIT_SECONDS)
-            url = HORSE_URL_TEMPLATE.format(horse_id=horse_id)
-            request = Request(url, headers=HEADERS)
-            path_list.append(html_file)
-            html = urlopen(request).read()  # スクレイピング
-            with open(html_file, "wb") as wf:
-                wf.write(html)
-        except HTTPError as e:
-            logger.error(f"{horse_id}:" + ERROR_INVALID_URL + "- {e}")
+    archive = HtmlArchive(HTML_HORSE_PACK)
+    validators = PageValidators(HTML_HORSE_VALIDATORS)
+    target_list = []
+    conditional = {}
+    skipped = 0
+    for horse_id in horse_id_list:
+        # 既にアーカイブに存在し、スキップする設定の場合はスキップ
+        if horse_id in archive and skip:
+            skipped += 1
             continue
+        url = HORSE_URL_TEMPLATE.format(horse_id=horse_id)
+        target_list.append((horse_id, url))
+        # アーカイブにあるページだけを条件付きで取得する
+        if horse_id in archive and horse_id in validators:
+            conditional[horse_id] = validators.get(horse_id)
+
+    # スキップしたIDは1件毎にログへ出さず、件数だけを記録する
+    metrics.count("horse_pages_skipped", skipped)
+    logger.info(f"horse pages: {len(target_list)} to fetch, {skipped} skipped")
+
+    with FetchEngine() as engine, Progress(
+        "scrape_html_horse", len(target_list), PROGRESS_INTERVAL_SECONDS, logger
+    ) as progress:
+        # スクレイピング
+        results = engine.fetch_many_responses(target_list, conditional)
+        for horse_id, response, error in results:
+            progress.update()
+            if isinstance(error, HTTPError):
+                metrics.count("horse_pages_failed")
+                validators.put_failure(horse_id)
+                logger.error(f"{horse_id}:" + ERROR_INVALID_URL + f"- {error}")
+                continue
+            if error is not None:
+                metrics.count("horse_pages_failed")
+                validators.put_failure(horse_id)
+                logger.error(f"{horse_id}:" + ERROR_UNEXPECTED + f"- {error}")
+                continue
+            if response.not_modified:
+                metrics.count("horse_pages_not_modified")
+                etag, last_modified = conditional[horse_id]
+                validators.put(horse_id, etag, last_modified)
+                continue
+            archive.put(horse_id, response.body)
+            validators.put(horse_id, response.etag, response.last_modified)
+            metrics.count("horse_pages_fetched")
+            metrics.count("html_bytes_written", len(response.body))
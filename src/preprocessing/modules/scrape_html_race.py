@@ -1,4 +1,5 @@
 from src.config import *
+from src.fetch_engine import FetchEngine
 
 
 def scrape_html_race(race_id_list):
@@ -6,29 +7,48 @@ def scrape_html_race(race_id_list):
     指定されたレースIDリストに基づき、HTMLページをスクレイピングして指定ディレクトリに保存する関数。
 
     この関数は、`race_id_list` から各レースIDを取得し、それに対応するHTMLページを指定されたURLからスクレイピングする。
-    ダウンロードしたHTMLは、`/data/html/race` ディレクトリに `[race_id].bin` という名前で保存される。
-    すでにファイルが存在する場合、そのレースIDに対するダウンロードはスキップされる。
+    ダウンロードしたHTMLは、`HTML_RACE_PACK` (`data/html/race.pack`) に圧縮して追記される。
+    すでにアーカイブに存在する場合、そのレースIDに対するダウンロードはスキップされる。
 
-    スクレイピングは、LOOP_WAIT_SECONDS秒間の待機を挟みながら行われる。
+    スクレイピングは `FetchEngine` により並列に行われ、ホスト毎のレート制限
+    (`FETCH_RATE_PER_SECOND`) を超えない範囲で `FETCH_MAX_WORKERS` 件まで同時に通信する。
+    取得に失敗したレースIDはログに記録し、残りの処理を続行する。
+    取得したページの`ETag`・`Last-Modified`は`HTML_RACE_VALIDATORS`に記録する。
 
     Args:
         race_id_list (list): スクレイピング対象となるレースIDのリスト。
-
-    Raises:
-        Exception: スクレイピングやファイル書き込み中にエラーが発生した場合。
     """
-    path_list = []
-    HTML_RACE_DIR.mkdir(parents=True, exist_ok=True)
-    for race_id in tqdm(race_id_list):
-        html_file = str(HTML_RACE_DIR) + "\\" + race_id + ".bin"
-        # binファイルが存在していればスキップ
-        if Path(html_file).is_file():
-            logger.info("skip:" + race_id)
+    archive = HtmlArchive(HTML_RACE_PACK)
+    validators = PageValidators(HTML_RACE_VALIDATORS)
+    target_list = []
+    skipped = 0
+    for race_id in race_id_list:
+        # アーカイブに存在していればスキップ
+        if race_id in archive:
+            skipped += 1
             continue
-        time.sleep(LOOP_WAIT_SECONDS)
         url = RACE_URL_TEMPLATE.format(race_id=race_id)
-        request = Request(url, headers=HEADERS)
-        path_list.append(html_file)
-        html = urlopen(request).read()  # スクレイピング
-        with open(html_file, "wb") as wf:
-            wf.write(html)
+        target_list.append((race_id, url))
+
+    # スキップしたIDは1件毎にログへ出さず、件数だけを記録する
+    metrics.count("race_pages_skipped", skipped)
+    logger.info(f"race pages: {len(target_list)} to fetch, {skipped} skipped")
+
+    with FetchEngine() as engine, Progress(
+        "scrape_html_race", len(target_list), PROGRESS_INTERVAL_SECONDS, logger
+    ) as progress:
+        results = engine.fetch_many_responses(target_list)  # スクレイピング
+        for race_id, response, error in results:
+            progress.update()
+            if isinstance(error, HTTPError):
+                metrics.count("race_pages_failed")
+                logger.error(f"{race_id}:" + ERROR_INVALID_URL + f"- {error}")
+                continue
+            if error is not None:
+                metrics.count("race_pages_failed")
+                logger.error(f"{race_id}:" + ERROR_UNEXPECTED + f"- {error}")
+                continue
+            archive.put(race_id, response.body)
+            validators.put(race_id, response.etag, response.last_modified)
+            metrics.count("race_pages_fetched")
+            metrics.count("html_bytes_written", len(response.body))
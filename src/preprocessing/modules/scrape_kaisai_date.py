@@ -1,4 +1,6 @@
 from src.config import *
+from src.config import BeautifulSoup
+from src.fetch_engine import FetchEngine
 
 
 def scrape_kaisai_date(from_: str, to_: str) -> list:
@@ -25,18 +27,20 @@ def scrape_kaisai_date(from_: str, to_: str) -> list:
     -----
     - `pd.date_range` を使って、指定された開始日から終了日までの月初日を範囲としてスクレイピングを行う。
     - 各月のURLは `https://race.netkeiba.com/top/calendar.html` から取得し、`Calendar_Table` クラスを持つHTML要素内のリンクを解析して、開催日を抽出する。
-    - `HEADERS` や `LOOP_WAIT_SECONDS` などの設定が前提となっており、これらは事前に定義されている必要がある。
-    - サーバーへの負荷を軽減するため、各リクエストの間に `time.sleep(LOOP_WAIT_SECONDS)` を使って待機時間を設けている。
+    - 各月のページは `FetchEngine` で並列に取得する。サーバーへの負荷はホスト毎のレート制限
+      (`FETCH_RATE_PER_SECOND`) で制御され、429/5xxの場合は指数バックオフでリトライする。
+    - 開催日は月の順序を保ったまま返される。
     """
 
+    url_list = [
+        RACE_DATE_URL_TEMPLATE.format(year=date.year, month=date.month)
+        for date in pd.date_range(from_, to_, freq="MS")
+    ]
+    with FetchEngine() as engine:
+        html_list = engine.fetch_all(url_list)  # スクレイピング
+
     kaisai_date_list = []
-    for date in tqdm(pd.date_range(from_, to_, freq="MS")):
-        year = date.year
-        month = date.month
-        url = RACE_DATE_URL_TEMPLATE.format(year=year, month=month)
-        time.sleep(LOOP_WAIT_SECONDS)
-        request = Request(url, headers=HEADERS)
-        html = urlopen(request).read()  # スクレイピング
+    for html in tqdm(html_list):
         soup = BeautifulSoup(html, features="lxml")
         a_tag_list = soup.find("table", class_="Calendar_Table").find_all("a")
         for a in a_tag_list:
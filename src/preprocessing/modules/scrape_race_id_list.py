@@ -1,34 +1,179 @@
+import lxml.html
+
 from src.config import *
+from src.fetch_engine import FetchEngine
 
 
-def scrape_race_id_list(kaisai_date_list: list[str]) -> list[str]:
+def parse_race_id_list(html) -> list[str]:
     """
-    開催日リストに基づいて、各開催日のレースIDを取得する関数。
+    レース一覧（`race_list_sub.html`）のHTMLからレースIDを抽出する関数。
 
-    指定された開催日リストに従い、`netkeiba`のレースページから各レースのIDをスクレイピングする。
-    引数に開催日リストを渡さない場合、デフォルトで2024年1月から2024年10月までの開催日を使用する。
+    `RaceList_DataItem`クラスを持つ`li`タグ内の最初のリンクから、`race_id=`に続く12桁を取り出す。
 
-    Parameters:
-    kaisai_date_list (list of str): レースの開催日を表す文字列のリスト。
-                                    例: ["2024-01-01", "2024-01-02"]
+    Args:
+        html (bytes): レース一覧のHTML。
 
     Returns:
-    list of str: 取得したレースIDのリスト（12桁の文字列）。
-                 例: ["123456789012", "123456789013"]
+        list[str]: ページ内の順序を保ったレースIDのリスト。
     """
+    doc = lxml.html.fromstring(html)
     race_id_list = []
+    for li in doc.xpath(
+        '//li[contains(concat(" ", normalize-space(@class), " "), " RaceList_DataItem ")]'
+    ):
+        href_list = li.xpath(".//a/@href")
+        if not href_list:
+            continue
+        match = re.search(RACE_ID_PATTERN, href_list[0])
+        if match:
+            race_id_list.append(match.group(1))
+    return race_id_list
+
+
+def _scrape_race_id_list_http(
+    kaisai_date_list: list[str],
+    url_template: str,
+    max_retries: int,
+    engine: FetchEngine = None,
+) -> tuple[dict, list]:
+    """
+    レース一覧の断片HTMLをHTTPで取得してレースIDを抽出する。
+
+    取得エラーやレースIDが1件も無いページは、その開催日だけを最大`max_retries`回まで取得し直す。
+
+    Returns:
+        tuple: `(開催日をキー、レースIDのリストを値とする辞書, 取得できなかった開催日のリスト)`。
+    """
+    if engine is None:
+        engine = FetchEngine()
+    race_id_dict = {}
+    pending = list(kaisai_date_list)
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            logger.warning(f"retry {attempt}/{max_retries}: {len(pending)} dates")
+        targets = [
+            (kaisai_date, url_template.format(kaisai_date=kaisai_date))
+            for kaisai_date in pending
+        ]
+        failed = []
+        for kaisai_date, html, error in tqdm(
+            engine.fetch_many(targets), total=len(targets)
+        ):
+            if error is not None:
+                logger.warning(f"{kaisai_date}: {error}")
+                failed.append(kaisai_date)
+                continue
+            try:
+                race_id_list = parse_race_id_list(html)
+            except Exception:
+                logger.warning(f"{kaisai_date}:" + ERROR_UNEXPECTED)
+                race_id_list = []
+            if not race_id_list:
+                logger.warning(f"{kaisai_date}:" + ERROR_NO_RACE_ID)
+                failed.append(kaisai_date)
+                continue
+            race_id_dict[kaisai_date] = race_id_list
+        pending = failed
+    return race_id_dict, pending
+
+
+def _scrape_race_id_list_selenium(
+    kaisai_date_list: list[str], max_retries: int
+) -> tuple[dict, list]:
+    """
+    ヘッドレスChromeでレース一覧ページを開き、レースIDを抽出する。
+
+    開催日毎に最大`max_retries`回まで取得し直し、それでも失敗した開催日は飛ばして次へ進む。
+
+    Returns:
+        tuple: `(開催日をキー、レースIDのリストを値とする辞書, 取得できなかった開催日のリスト)`。
+    """
+    # Seleniumはこのモードを使うときだけ読み込む
+    from src.config import By, get_chrome_driver
+
+    race_id_dict = {}
+    failed = []
     with get_chrome_driver(headless=True) as driver:
         for kaisai_date in tqdm(kaisai_date_list):
-            time.sleep(LOOP_WAIT_SECONDS)
             url = RACE_ID_LIST_URL_TEMPLATE.format(kaisai_date=kaisai_date)
-            try:
-                driver.get(url)
-                li_list = driver.find_elements(By.CLASS_NAME, "RaceList_DataItem")
-                for li in li_list:
-                    href = li.find_element(By.TAG_NAME, "a").get_attribute("href")
-                    race_id = re.findall(r"race_id=(\d{12})", href)[0]
-                    race_id_list.append(race_id)
-            except:
-                logger.error("stopped at {URL}")
-                break
-    return race_id_list
+            for attempt in range(max_retries + 1):
+                time.sleep(LOOP_WAIT_SECONDS)
+                try:
+                    driver.get(url)
+                    race_id_list = []
+                    li_list = driver.find_elements(By.CLASS_NAME, "RaceList_DataItem")
+                    for li in li_list:
+                        href = li.find_element(By.TAG_NAME, "a").get_attribute("href")
+                        race_id_list.append(re.search(RACE_ID_PATTERN, href).group(1))
+                    if not race_id_list:
+                        raise ValueError(ERROR_NO_RACE_ID)
+                    race_id_dict[kaisai_date] = race_id_list
+                    break
+                except Exception as e:
+                    if attempt < max_retries:
+                        logger.warning(
+                            f"retry {attempt + 1}/{max_retries}: {kaisai_date} - {e}"
+                        )
+                    else:
+                        logger.warning(
+                            f"failed after {max_retries} retries: {kaisai_date} - {e}"
+                        )
+            else:
+                failed.append(kaisai_date)
+    return race_id_dict, failed
+
+
+def scrape_race_id_list(
+    kaisai_date_list: list[str],
+    mode: str = RACE_ID_LIST_MODE,
+    url_template: str = RACE_ID_LIST_SUB_URL_TEMPLATE,
+    max_retries: int = RACE_ID_LIST_MAX_RETRIES,
+    selenium_fallback: bool = RACE_ID_LIST_SELENIUM_FALLBACK,
+    engine: FetchEngine = None,
+) -> list[str]:
+    """
+    開催日リストに基づいて、各開催日のレースIDを取得する関数。
+
+    `mode="http"`（デフォルト）では、ブラウザを起動せずにレース一覧の断片HTML
+    (`race_list_sub.html`)を`FetchEngine`で取得し、lxmlで解析する。取得・解析に失敗した
+    開催日はその開催日だけを取得し直し、それでも失敗した開催日は`selenium_fallback`が
+    有効な場合にSeleniumで取得する。`mode="selenium"`では最初からSeleniumを使う。
+    取得できなかった開催日はログに記録し、残りの開催日の処理は続行する。
+
+    Parameters:
+    kaisai_date_list (list of str): レースの開催日を表す文字列のリスト。
+                                    例: ["20240106", "20240107"]
+    mode (str): 取得方法。"http" または "selenium"。デフォルトは`RACE_ID_LIST_MODE`。
+    url_template (str): HTTPモードで取得するURLのテンプレート。`{kaisai_date}`を含む。
+    max_retries (int): 開催日毎の最大リトライ回数。
+    selenium_fallback (bool): HTTPモードで取得できなかった開催日をSeleniumで取得するかどうか。
+    engine (FetchEngine): HTTPモードで使う取得エンジン。省略時は設定値で作成する。
+
+    Returns:
+    list of str: 取得したレースIDのリスト（12桁の文字列）。開催日の順序を保つ。
+                 例: ["123456789012", "123456789013"]
+    """
+    if mode == "http":
+        race_id_dict, failed = _scrape_race_id_list_http(
+            kaisai_date_list, url_template, max_retries, engine
+        )
+        if failed and selenium_fallback:
+            logger.info(f"selenium fallback: {len(failed)} dates")
+            fallback_dict, failed = _scrape_race_id_list_selenium(failed, max_retries)
+            race_id_dict.update(fallback_dict)
+    elif mode == "selenium":
+        race_id_dict, failed = _scrape_race_id_list_selenium(
+            kaisai_date_list, max_retries
+        )
+    else:
+        raise ValueError(f"unknown mode: {mode}")
+
+    for kaisai_date in failed:
+        logger.error(f"{kaisai_date}:" + ERROR_NO_RACE_ID)
+    return [
+        race_id
+        for kaisai_date in kaisai_date_list
+        for race_id in race_id_dict.get(kaisai_date, [])
+    ]
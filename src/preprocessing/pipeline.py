@@ -0,0 +1,180 @@
+import argparse
+
+from src.config import *
+from src.pipeline import Pipeline, Stage
+from src.preprocessing.modules.create_horse_result import create_horse_result
+from src.preprocessing.modules.create_race_info import (
+    create_race_info_preprocessing,
+    create_race_info_transformed,
+)
+from src.preprocessing.modules.create_race_result import create_race_result
+from src.preprocessing.modules.feature_setting import FeatureCreator
+from src.preprocessing.modules.process_horse_results import process_horse_results
+from src.preprocessing.modules.plan_horse_refresh import (
+    horse_refresh_candidates,
+    select_horse_refresh,
+    upcoming_horse_ids,
+)
+from src.preprocessing.modules.process_race_results import process_race_results
+from src.preprocessing.modules.scrape_html_horse import scrape_html_horse
+from src.preprocessing.modules.scrape_html_race import scrape_html_race
+from src.preprocessing.modules.scrape_kaisai_date import scrape_kaisai_date
+from src.preprocessing.modules.scrape_race_id_list import scrape_race_id_list
+
+
+def scrape_race():
+    """
+    開催日一覧からレースID一覧を取得し、レースのHTMLをアーカイブに保存する。
+    """
+    kaisai_date_list = scrape_kaisai_date(FLOM_DATE, TO_DATE)
+    race_id_list = scrape_race_id_list(kaisai_date_list)
+    scrape_html_race(race_id_list)
+
+
+def scrape_horse() -> int:
+    """
+    レース結果に出走した馬のうち、未取得の馬とページの取得後に出走した馬のHTMLを取得し、
+    アーカイブに保存する（1回の実行で`HORSE_REFRESH_MAX_REQUESTS`件まで）。
+    予測サービスに予測を依頼された出走予定の馬（`UPCOMING_ENTRIES_FILE`）を最優先で取得する。
+
+    Returns:
+        int: 上限を超えて次回に回した馬の数。0より大きい間は、入力が変わらなくても
+            次回の実行でこの段階を実行する。
+    """
+    # 台帳が無い間は入力が欠けているとみなされ毎回実行されるため、空の台帳を作っておく
+    UpcomingEntries(UPCOMING_ENTRIES_FILE).create()
+    candidates = horse_refresh_candidates(upcoming_horse_ids())
+    plan = select_horse_refresh(candidates)
+    scrape_html_horse(plan, False)
+    return len(candidates) - len(plan)
+
+
+def create_features():
+    """
+    特徴量を作成し、`FEATURES_TABLE`として保存する。
+    """
+    FeatureCreator().create_features()
+
+
+def build_pipeline(max_workers: int = PIPELINE_MAX_WORKERS) -> Pipeline:
+    """
+    生データ取得から特徴量作成までの段階と、その入出力を宣言したパイプラインを返す。
+
+    レースのスクレイピングは入力ファイルで表せないWebサイトの状態に依存するため、
+    毎回実行する（`volatile`）。取得済みのページは取得し直さないため、新しいレースが無ければ
+    アーカイブは更新されず、下流の段階は省略される。
+    """
+    # アーカイブは本体と索引を同時に更新するため、本体の更新時刻で判定する
+    race_pack = [HTML_RACE_PACK]
+    horse_pack = [HTML_HORSE_PACK]
+    stages = [
+        Stage("scrape_race", scrape_race, [], race_pack, volatile=True),
+        Stage(
+            "create_race_result",
+            create_race_result,
+            race_pack,
+            [table_store.path(RACE_RESULTS_TABLE), table_store.path(RACE_INFO_TABLE)],
+        ),
+        Stage(
+            "scrape_horse",
+            scrape_horse,
+            [
+                table_store.path(RACE_RESULTS_TABLE),
+                table_store.path(RACE_INFO_TABLE),
+                UPCOMING_ENTRIES_FILE,
+            ],
+            horse_pack,
+        ),
+        Stage(
+            "create_horse_result",
+            create_horse_result,
+            horse_pack,
+            [table_store.path(HORSE_RESULTS_TABLE)],
+        ),
+        Stage(
+            "process_race_results",
+            process_race_results,
+            [table_store.path(RACE_RESULTS_TABLE)],
+            [table_store.path(PREPROCESSED_RACE_RESULTS_TABLE)],
+        ),
+        Stage(
+            "process_horse_results",
+            process_horse_results,
+            [table_store.path(HORSE_RESULTS_TABLE)],
+            [table_store.path(PREPROCESSED_HORSE_RESULTS_TABLE)],
+        ),
+        Stage(
+            "create_race_info_transformed",
+            create_race_info_transformed,
+            [table_store.path(RACE_INFO_TABLE)],
+            [table_store.path(RACE_INFO_TRANSFORMED_TABLE)],
+        ),
+        Stage(
+            "create_race_info_preprocessing",
+            create_race_info_preprocessing,
+            [table_store.path(RACE_INFO_TRANSFORMED_TABLE)],
+            [table_store.path(RACE_INFO_PREPROCESSING_TABLE)],
+        ),
+        Stage(
+            "create_features",
+            create_features,
+            [
+                table_store.path(RACE_RESULTS_TABLE),
+                table_store.path(RACE_INFO_PREPROCESSING_TABLE),
+                table_store.path(PREPROCESSED_HORSE_RESULTS_TABLE),
+                table_store.path(PREPROCESSED_RACE_RESULTS_TABLE),
+            ],
+            [table_store.path(FEATURES_TABLE)],
+        ),
+    ]
+    return Pipeline(stages, PIPELINE_STATE_FILE, max_workers, metrics)
+
+
+if __name__ == "__main__":
+    """
+    パイプラインを実行する。
+
+    例:
+        python -m src.preprocessing.pipeline                      # 最新でない段階だけを実行
+        python -m src.preprocessing.pipeline --from scrape_race   # 再スクレイピングから実行
+        python -m src.preprocessing.pipeline --only create_features
+        python -m src.preprocessing.pipeline --list
+    """
+    parser = argparse.ArgumentParser(description="前処理パイプライン")
+    parser.add_argument(
+        "--from",
+        dest="from_",
+        nargs="+",
+        help="指定した段階とその下流を強制的に実行する",
+    )
+    parser.add_argument("--only", nargs="+", help="指定した段階だけを実行する")
+    parser.add_argument(
+        "--force", action="store_true", help="すべての段階を強制的に実行する"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PIPELINE_MAX_WORKERS,
+        help="同時に実行する段階の数",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="段階と依存関係、最新かどうかを表示する"
+    )
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args.workers)
+    if args.list:
+        for name, dependencies in pipeline.dependencies.items():
+            if pipeline.stages[name].volatile:
+                state = "always"
+            else:
+                state = "up to date" if pipeline.is_up_to_date(name) else "stale"
+            print(f"{name:<32} {state:<11} <- {', '.join(dependencies) or '-'}")
+    else:
+        try:
+            print(pipeline.run(only=args.only, from_=args.from_, force=args.force))
+            print(table_store.memory_report())
+        finally:
+            # 失敗した場合も、それまでの計測値を保存する
+            logger.info(f"metrics: {metrics.write(METRICS_DIR)}")
+            print(metrics.summary())
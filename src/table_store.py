@@ -0,0 +1,376 @@
+import ast
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class TableStore:
+    EXTENSIONS = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv"}
+    DATETIME_DTYPE = "datetime64[ns]"
+    LIST_DTYPE = "list"
+    CATEGORY_DTYPE = "category"
+
+    def __init__(
+        self,
+        base_dir: Path,
+        schemas: dict,
+        storage_format: str = "parquet",
+        export_csv: bool = False,
+        row_group_size: int = 100_000,
+        metrics=None,
+    ):
+        """
+        データフレームをテーブル名単位で保存・読み込みするストア。
+
+        テーブル毎に列の型（スキーマ）を宣言し、保存時に型を揃えてから書き出す。
+        Parquet形式では列の射影(`columns`)と行グループ単位の条件絞り込み(`filters`)を
+        読み込み時に適用できるため、必要な列・期間だけを読み込める。
+        CSVは他のツールとの受け渡し用の書き出し形式として残している。
+
+        Args:
+            base_dir (Path): テーブルを保存するディレクトリ。
+            schemas (dict): テーブル名をキーとし、`dtypes`（列名と型の辞書。`list`は文字列のリスト列、
+                `category`はマッピング済みの値のカテゴリ型）、
+                `sort_by`（保存時に並べ替える列のリスト）、`csv`（書き出すCSVのファイル名）を持つ辞書。
+            storage_format (str, optional): 保存形式。`parquet`、`feather`、`csv`のいずれか。
+            export_csv (bool, optional): 保存時にタブ区切りのCSVも書き出すかどうか。
+            row_group_size (int, optional): Parquetの1行グループあたりの行数。
+            metrics (Metrics, optional): 読み書きしたファイルのバイト数を記録する計測値。
+        """
+        if storage_format not in self.EXTENSIONS:
+            raise ValueError(f"unknown storage format: {storage_format}")
+        self.base_dir = Path(base_dir)
+        self.schemas = schemas
+        self.storage_format = storage_format
+        self.export_csv = export_csv
+        self.row_group_size = row_group_size
+        self.memory_stats = {}
+        self.metrics = metrics
+
+    def path(self, name: str) -> Path:
+        """
+        テーブルの保存先パスを返す。CSV形式の場合はスキーマに宣言されたCSVファイル名を使う。
+        """
+        if self.storage_format == "csv":
+            return self.csv_path(name)
+        return self.base_dir / f"{name}{self.EXTENSIONS[self.storage_format]}"
+
+    def csv_path(self, name: str) -> Path:
+        return self.base_dir / self.schemas.get(name, {}).get("csv", f"{name}.csv")
+
+    def exists(self, name: str) -> bool:
+        return self.path(name).is_file()
+
+    def dtypes(self, name: str) -> dict:
+        return self.schemas.get(name, {}).get("dtypes", {})
+
+    def apply_schema(self, name: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        スキーマで宣言された型に列を変換する。
+
+        宣言の無いobject型の列は文字列型に揃える（ページ毎に推論された型が混在した列を
+        そのまま保存できないため）。宣言された列がデータフレームに無い場合は無視する。
+        """
+        dtypes = self.dtypes(name)
+        df = df.copy()
+        for column in df.columns:
+            dtype = dtypes.get(column)
+            if dtype is None:
+                if df[column].dtype == object:
+                    df[column] = df[column].astype("string")
+            elif dtype == self.DATETIME_DTYPE:
+                df[column] = pd.to_datetime(df[column])
+            elif dtype == self.LIST_DTYPE:
+                df[column] = df[column].map(self._to_list)
+            elif dtype == "string":
+                df[column] = df[column].astype("string")
+            elif dtype == self.CATEGORY_DTYPE:
+                df[column] = self._to_category(df[column])
+            elif str(df[column].dtype) != dtype:
+                if not pd.api.types.is_numeric_dtype(df[column]):
+                    df[column] = pd.to_numeric(df[column])
+                self._check_range(name, column, df[column], dtype)
+                df[column] = df[column].astype(dtype)
+        return df
+
+    def _restore_categories(self, name: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        カテゴリ型を宣言した列を読み込み後にカテゴリ型へ戻す
+        （整数のカテゴリはParquetでは値の列として保存されるため）。
+        """
+        for column, dtype in self.dtypes(name).items():
+            if dtype == self.CATEGORY_DTYPE and column in df.columns:
+                df[column] = self._to_category(df[column])
+        return df
+
+    @staticmethod
+    def _to_category(series: pd.Series) -> pd.Series:
+        """
+        マッピング済みの列をカテゴリ型に変換する。整数値の浮動小数点数（欠損値を含む）は
+        整数のカテゴリにする。
+        """
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series
+        if pd.api.types.is_float_dtype(series):
+            values = series.dropna()
+            if (values == values.round()).all():
+                series = series.astype("Int64")
+        return series.astype("category")
+
+    @staticmethod
+    def _check_range(name: str, column: str, series: pd.Series, dtype: str):
+        """
+        整数型に縮小するときに、値が型の範囲に収まることを確認する（範囲外の値は桁あふれするため）。
+        """
+        if not pd.api.types.is_integer_dtype(pd.api.types.pandas_dtype(dtype)):
+            return
+        info = np.iinfo(dtype.lower())
+        values = series.dropna()
+        if len(values) and (values.min() < info.min or values.max() > info.max):
+            raise ValueError(
+                f"{name}.{column}: values out of range for {dtype} "
+                f"({values.min()}..{values.max()})"
+            )
+
+    def write(self, name: str, df: pd.DataFrame):
+        """
+        テーブルを保存する。名前付きのインデックスは列に戻してから保存する。
+
+        `sort_by`が宣言されたテーブルは保存前に安定ソートし、Parquetの行グループ毎の
+        最小・最大値で読み込み時の絞り込みが効くようにする。
+        `export_csv`が有効な場合は、タブ区切りのCSVも書き出す。
+        スキーマ適用前後のメモリ使用量を`memory_report`用に記録する。
+
+        Returns:
+            pandas.DataFrame: スキーマの型に揃えて保存したデータフレーム。
+        """
+        if df.index.name is not None:
+            df = df.reset_index()
+        before = df.memory_usage(deep=True).sum()
+        df = self.apply_schema(name, df)
+        self.memory_stats[name] = (before, df.memory_usage(deep=True).sum())
+        sort_by = self.schemas.get(name, {}).get("sort_by")
+        if sort_by:
+            df = df.sort_values(sort_by, kind="stable")
+        df = df.reset_index(drop=True)
+
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(name)
+        tmp_path = path.with_name(path.name + ".tmp")
+        if self.storage_format == "parquet":
+            df.to_parquet(tmp_path, index=False, row_group_size=self.row_group_size)
+        elif self.storage_format == "feather":
+            df.to_feather(tmp_path)
+        else:
+            df.to_csv(tmp_path, sep="\t", index=False)
+        os.replace(tmp_path, path)
+        if self.metrics is not None:
+            self.metrics.count("table_bytes_written", path.stat().st_size)
+        if self.export_csv and self.storage_format != "csv":
+            self.to_csv(name, df)
+        return df
+
+    def memory_report(self) -> pd.DataFrame:
+        """
+        このプロセスで保存したテーブル毎に、スキーマ適用前後のメモリ使用量（バイト）を返す。
+        """
+        df = pd.DataFrame.from_dict(
+            self.memory_stats, orient="index", columns=["before_bytes", "after_bytes"]
+        )
+        df.index.name = "table"
+        df["ratio"] = df["after_bytes"] / df["before_bytes"]
+        return df
+
+    def to_csv(self, name: str, df: pd.DataFrame = None, path: Path = None) -> Path:
+        """
+        テーブルをタブ区切りのCSVとして書き出す。`df`を省略した場合は保存済みのテーブルを読み込む。
+        """
+        if df is None:
+            df = self.read(name)
+        path = self.csv_path(name) if path is None else Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(path, sep="\t", index=False)
+        return path
+
+    def read(
+        self, name: str, columns: list = None, filters: list = None
+    ) -> pd.DataFrame:
+        """
+        テーブルを読み込む。
+
+        Args:
+            name (str): テーブル名。
+            columns (list, optional): 読み込む列。省略時はすべての列。
+            filters (list, optional): `(列名, 演算子, 値)`のリスト（すべてを満たす行を返す）。
+                演算子は`==`、`!=`、`<`、`<=`、`>`、`>=`、`in`、`not in`。
+                Parquet形式では行グループ単位で読み飛ばしたうえで行を絞り込む。
+
+        Returns:
+            pandas.DataFrame: スキーマの型に揃えたデータフレーム。
+        """
+        path = self.path(name)
+        if self.metrics is not None:
+            self.metrics.count("table_bytes_read", path.stat().st_size)
+        if self.storage_format == "parquet":
+            df = pd.read_parquet(path, columns=columns, filters=filters or None)
+            return self._restore_categories(name, df)
+
+        read_columns = columns
+        if columns is not None and filters:
+            read_columns = list(
+                dict.fromkeys(list(columns) + [column for column, _, _ in filters])
+            )
+        if self.storage_format == "feather":
+            df = self._restore_categories(
+                name, pd.read_feather(path, columns=read_columns)
+            )
+        else:
+            dtypes = self.dtypes(name)
+            if read_columns is not None:
+                dtypes = {c: d for c, d in dtypes.items() if c in read_columns}
+            df = pd.read_csv(
+                path,
+                sep="\t",
+                usecols=read_columns,
+                dtype={c: d for c, d in dtypes.items() if d == "string"},
+            )
+            df = self.apply_schema(name, df)
+        if filters:
+            df = df[self._filter_mask(df, filters)].reset_index(drop=True)
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+
+    def iter_batches(self, name: str, columns: list = None, batch_rows: int = 100_000):
+        """
+        テーブルを最大`batch_rows`行ずつのデータフレームとして順に返す。
+
+        Parquet形式では行グループを順に読み込み、Feather形式ではファイルをメモリマップして切り出し、
+        CSV形式では`chunksize`で読み込むため、テーブル全体を一度にメモリへ展開しない。
+
+        Args:
+            name (str): テーブル名。
+            columns (list, optional): 読み込む列。省略時はすべての列。
+            batch_rows (int, optional): 1回に返す最大行数。
+
+        Yields:
+            pandas.DataFrame: スキーマの型に揃えたデータフレーム。
+        """
+        path = self.path(name)
+        if self.storage_format == "parquet":
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(path)
+            for batch in parquet_file.iter_batches(
+                batch_size=batch_rows, columns=columns
+            ):
+                yield self._restore_categories(name, batch.to_pandas())
+        elif self.storage_format == "feather":
+            import pyarrow as pa
+
+            with pa.memory_map(str(path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+                if columns is not None:
+                    table = table.select(list(columns))
+                for start in range(0, table.num_rows, batch_rows):
+                    df = table.slice(start, batch_rows).to_pandas()
+                    yield self._restore_categories(name, df)
+        else:
+            dtypes = self.dtypes(name)
+            with pd.read_csv(
+                path,
+                sep="\t",
+                usecols=columns,
+                dtype={c: d for c, d in dtypes.items() if d == "string"},
+                chunksize=batch_rows,
+            ) as reader:
+                for df in reader:
+                    df = self.apply_schema(name, df)
+                    yield df if columns is None else df[list(columns)]
+
+    def batch_rows_for_memory(
+        self,
+        name: str,
+        memory_limit: int,
+        factor: float = 1.0,
+        columns: list = None,
+        sample_rows: int = 10_000,
+    ) -> int:
+        """
+        先頭の`sample_rows`行から1行あたりのメモリ使用量を見積もり、
+        1バッチの処理に使うメモリが`memory_limit`以下となる行数を返す。
+
+        Args:
+            name (str): テーブル名。
+            memory_limit (int): 1バッチの処理に使うメモリの上限（バイト）。
+            factor (float, optional): 処理中のメモリ使用量が、読み込んだバッチの何倍になるかの見積もり。
+            columns (list, optional): 読み込む列。
+            sample_rows (int, optional): 見積もりに使う行数。
+
+        Returns:
+            int: 1バッチの行数（最低1行）。
+        """
+        sample = next(self.iter_batches(name, columns, sample_rows), None)
+        if sample is None or len(sample) == 0:
+            return sample_rows
+        row_bytes = sample.memory_usage(deep=True).sum() / len(sample)
+        return max(1, int(memory_limit / (row_bytes * factor)))
+
+    @staticmethod
+    def concat(frames: list) -> pd.DataFrame:
+        """
+        バッチ毎に処理したデータフレームを結合する。
+
+        カテゴリ型の列はバッチ毎にカテゴリが異なると結合後にobject型になるため、
+        すべてのバッチのカテゴリの和集合に揃えてから結合する。
+        """
+        frames = list(frames)
+        if not frames:
+            return pd.DataFrame()
+        for column in frames[0].columns:
+            if not isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+                continue
+            categories = pd.Index(
+                sorted(set().union(*(df[column].cat.categories for df in frames)))
+            )
+            for df in frames:
+                df[column] = df[column].cat.set_categories(categories)
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _to_list(value):
+        """
+        リスト列の値をPythonのリストに揃える。CSVから読み込んだ文字列表現も復元する。
+        """
+        if isinstance(value, str):
+            return ast.literal_eval(value)
+        if value is None or (not hasattr(value, "__len__") and pd.isna(value)):
+            return None
+        return list(value)
+
+    @staticmethod
+    def _filter_mask(df: pd.DataFrame, filters: list) -> pd.Series:
+        mask = pd.Series(True, index=df.index)
+        for column, op, value in filters:
+            series = df[column]
+            if op == "==":
+                mask &= series == value
+            elif op == "!=":
+                mask &= series != value
+            elif op == "<":
+                mask &= series < value
+            elif op == "<=":
+                mask &= series <= value
+            elif op == ">":
+                mask &= series > value
+            elif op == ">=":
+                mask &= series >= value
+            elif op == "in":
+                mask &= series.isin(value)
+            elif op == "not in":
+                mask &= ~series.isin(value)
+            else:
+                raise ValueError(f"unknown filter operator: {op}")
+        return mask.fillna(False).astype(bool)
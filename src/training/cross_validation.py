@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.config import *
+from src.metrics import peak_rss_bytes
+from src.training.dataset import TrainingDataset
+from src.training.train import binned_dataset, train_ranker
+
+
+def walk_forward_folds(
+    dataset: TrainingDataset,
+    date_from: str = FLOM_DATE,
+    date_to: str = TO_DATE,
+    min_train_races: int = CV_MIN_TRAIN_RACES,
+) -> list:
+    """
+    `date_from`から`date_to`までの各月を検証に使うfoldを作る。
+
+    各foldは、検証する月の前日までのすべてのレースで学習し、その月のレースで検証する。
+    データセットの行は開催日順に並んでいるため、学習・検証の範囲はレースの連続した範囲
+    （`slice`）として表し、特徴量を作り直したりコピーしたりはしない。
+    学習のレースが`min_train_races`に満たない月と、レースの無い月は除く。
+
+    Args:
+        dataset (TrainingDataset): 作成済みのデータセット。
+        date_from (str, optional): 最初に検証する年月（例: "2024-01"）。
+        date_to (str, optional): 最後に検証する年月。
+        min_train_races (int, optional): 検証に必要な学習のレース数。
+
+    Returns:
+        list: `fold`・`month`・`train`・`test`（レースの範囲）を持つ辞書のリスト。
+    """
+    folds = []
+    for month in pd.period_range(date_from, date_to, freq="M"):
+        test = dataset.groups_between(
+            date_from=month.start_time, date_to=(month + 1).start_time
+        )
+        if test.stop <= test.start or test.start < min_train_races:
+            continue
+        folds.append(
+            {
+                "fold": len(folds),
+                "month": str(month),
+                "train": slice(0, test.start),
+                "test": test,
+            }
+        )
+    return folds
+
+
+def ranking_metrics(
+    score: np.ndarray,
+    label: np.ndarray,
+    rank: np.ndarray,
+    group_sizes: np.ndarray,
+    eval_at: list = (1, 3),
+) -> dict:
+    """
+    レース毎に並んだ予測スコアから、検証の指標をレースの平均として求める。
+
+    - `ndcg@k`: LightGBMと同じ定義（利得`2^関連度-1`、関連度の無いレースは1）のNDCG。
+    - `top1_win_rate`: スコアが最も高い馬が1着だったレースの割合。
+    - `top1_top3_rate`: スコアが最も高い馬が3着以内だったレースの割合。
+
+    Args:
+        score (numpy.ndarray): 行毎の予測スコア。
+        label (numpy.ndarray): 行毎の関連度。
+        rank (numpy.ndarray): 行毎の着順。
+        group_sizes (numpy.ndarray): レース毎の行数。
+        eval_at (list, optional): NDCGを求める順位。
+
+    Returns:
+        dict: 指標名と値の辞書。
+    """
+    n_groups = len(group_sizes)
+    group = np.repeat(np.arange(n_groups), group_sizes)
+    starts = np.r_[0, np.cumsum(group_sizes)[:-1]]
+    position = np.arange(len(score)) - starts[group]
+    gain = np.exp2(label.astype(np.float64)) - 1
+    discount = 1 / np.log2(position + 2)
+    # レース内でスコアの降順・関連度の降順に並べた行
+    by_score = np.lexsort((-score, group))
+    by_label = np.lexsort((-label, group))
+    result = {}
+    for k in eval_at:
+        top = position < k
+        dcg = np.bincount(
+            group[top], weights=gain[by_score][top] * discount[top], minlength=n_groups
+        )
+        ideal = np.bincount(
+            group[top], weights=gain[by_label][top] * discount[top], minlength=n_groups
+        )
+        ndcg = np.where(ideal > 0, dcg / np.where(ideal > 0, ideal, 1), 1.0)
+        result[f"ndcg@{k}"] = float(ndcg.mean()) if n_groups else np.nan
+    first = by_score[starts] if n_groups else np.zeros(0, dtype=np.int64)
+    result["top1_win_rate"] = float((rank[first] == 1).mean()) if n_groups else np.nan
+    result["top1_top3_rate"] = float((rank[first] <= 3).mean()) if n_groups else np.nan
+    return result
+
+
+# ワーカープロセスで使うデータセット（初期化時に1度だけ読み込む）
+_worker_state = None
+
+
+def _init_worker(dataset_dir: Path, num_threads: int, bin_rows: slice):
+    global _worker_state
+    dataset = TrainingDataset(dataset_dir)
+    # メタ情報（ビン分割の結果のキー）とレース毎の先頭行を読み込む
+    dataset.load("group_offsets")
+    _worker_state = {
+        "dataset": dataset,
+        "binned": binned_dataset(dataset, bin_rows=bin_rows),
+        "params": {**TRAINING_PARAMS, "num_threads": num_threads},
+    }
+
+
+def _run_fold(fold: dict) -> dict:
+    """
+    1つのfoldを学習・検証する。学習の範囲の末尾を早期終了の判定に使い、検証の月は使わない。
+    """
+    start = time.perf_counter()
+    dataset = _worker_state["dataset"]
+    train = fold["train"]
+    split = train.start + int(
+        (train.stop - train.start) * (1 - TRAINING_VALID_FRACTION)
+    )
+    booster = train_ranker(
+        dataset,
+        slice(train.start, split),
+        slice(split, train.stop),
+        params=_worker_state["params"],
+        binned=_worker_state["binned"],
+    )
+    rows = dataset.rows(fold["test"])
+    # メモリマップから検証の月の行だけを読み込む
+    score = booster.predict(dataset.X[rows], num_iteration=booster.best_iteration)
+    sizes = dataset.group_sizes(fold["test"])
+    result = {
+        "fold": fold["fold"],
+        "month": fold["month"],
+        "train_races": train.stop - train.start,
+        "test_races": fold["test"].stop - fold["test"].start,
+        "best_iteration": booster.best_iteration,
+        **ranking_metrics(
+            score,
+            dataset.label[rows],
+            dataset.rank[rows],
+            sizes,
+            TRAINING_PARAMS.get("eval_at", (1, 3)),
+        ),
+        "seconds": time.perf_counter() - start,
+    }
+    return {"result": result, "score": score.astype(np.float32)}
+
+
+def run_walk_forward(
+    date_from: str = FLOM_DATE,
+    date_to: str = TO_DATE,
+    workers: int = CV_WORKERS,
+    rebuild: bool = False,
+) -> tuple:
+    """
+    月毎のwalk-forwardの時系列交差検証を行う。
+
+    特徴量は`FEATURES_TABLE`として期間全体について1度だけ作られたものを使い、
+    データセットとビン分割の結果（`TrainingDataset`・`binned_dataset`）も1度だけ作る。
+    ビンの境界は最初の検証月より前の行だけから決め、検証する期間の特徴量の分布は使わない。
+    各foldはその範囲を切り出して学習し、`workers`個のプロセスで並列に実行する。
+    各プロセスはデータセットをメモリマップで、ビン分割の結果をファイルから読み込むため、
+    特徴量行列をプロセス毎に複製することはない。
+
+    Args:
+        date_from (str, optional): 最初に検証する年月。
+        date_to (str, optional): 最後に検証する年月。
+        workers (int, optional): プロセス数。Noneの場合はCPU数とfold数の小さい方、
+            1の場合は並列にしない。
+        rebuild (bool, optional): Trueの場合はデータセットを作り直す。
+
+    Returns:
+        tuple: fold毎の指標と全体（検証レース数での加重平均）の行を持つデータフレームと、
+            検証した行の`race_id`・`horse_id`・`score`のデータフレーム。
+    """
+    with metrics.stage("training_dataset"):
+        dataset = TrainingDataset().build(force=rebuild)
+    folds = walk_forward_folds(dataset, date_from, date_to)
+    if not folds:
+        raise ValueError(f"no folds between {date_from} and {date_to}")
+    bin_rows = dataset.rows(slice(0, folds[0]["test"].start))
+    with metrics.stage("binned_dataset"):
+        # 各プロセスが読み込むビン分割の結果を先に保存しておく
+        binned_dataset(dataset, bin_rows=bin_rows)
+    workers = min(workers or os.cpu_count(), len(folds))
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    logger.info(
+        f"walk-forward: {len(folds)} folds ({folds[0]['month']} - "
+        f"{folds[-1]['month']}), {workers} workers x {num_threads} threads"
+    )
+    with metrics.stage("cross_validation"):
+        if workers <= 1:
+            _init_worker(dataset.dataset_dir, num_threads, bin_rows)
+            outputs = [_run_fold(fold) for fold in folds]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(dataset.dataset_dir, num_threads, bin_rows),
+            ) as executor:
+                outputs = list(executor.map(_run_fold, folds))
+
+    report = pd.DataFrame([output["result"] for output in outputs])
+    for seconds in report["seconds"]:
+        metrics.observe("cv_fold_seconds", seconds)
+    metric_columns = [
+        column
+        for column in report.columns
+        if column.startswith("ndcg@") or column.startswith("top1_")
+    ]
+    total = {
+        "fold": None,
+        "month": "all",
+        "train_races": None,
+        "test_races": report["test_races"].sum(),
+        "best_iteration": report["best_iteration"].mean(),
+        **{
+            column: np.average(report[column], weights=report["test_races"])
+            for column in metric_columns
+        },
+        "seconds": report["seconds"].sum(),
+    }
+    report = pd.concat([report, pd.DataFrame([total])], ignore_index=True)
+
+    scores = pd.DataFrame(
+        {
+            COLUMN_RACE_ID: np.concatenate(
+                [dataset.race_ids(fold["test"]) for fold in folds]
+            ),
+            COLUMN_HORSE_ID: np.concatenate(
+                [dataset.horse_id[dataset.rows(fold["test"])] for fold in folds]
+            ),
+            "score": np.concatenate([output["score"] for output in outputs]),
+        }
+    )
+    return report, scores
+
+
+if __name__ == "__main__":
+    """
+    月毎のwalk-forwardの時系列交差検証を行い、fold毎の指標を`CV_REPORT_FILE`に、
+    検証した月の予測スコアを`CV_SCORES_FILE`に保存する。
+    予測スコアは`src.evaluation.backtest --scores`にそのまま渡せる。
+
+    例:
+        python -m src.training.cross_validation
+        python -m src.training.cross_validation --date-from 2024-04 --date-to 2024-12 --workers 4
+    """
+    parser = argparse.ArgumentParser(description="walk-forwardの時系列交差検証")
+    parser.add_argument("--date-from", default=FLOM_DATE, help="最初に検証する年月")
+    parser.add_argument("--date-to", default=TO_DATE, help="最後に検証する年月")
+    parser.add_argument("--workers", type=int, default=CV_WORKERS)
+    parser.add_argument("--rebuild", action="store_true", help="データセットを作り直す")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report, scores = run_walk_forward(
+        args.date_from, args.date_to, args.workers, args.rebuild
+    )
+    CV_REPORT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    report.to_csv(CV_REPORT_FILE, index=False)
+    scores.to_parquet(CV_SCORES_FILE, index=False)
+    print(report.to_string(index=False))
+    print(
+        json.dumps(
+            {
+                "seconds": time.perf_counter() - start,
+                "peak_rss_bytes": peak_rss_bytes(),
+            }
+        )
+    )
+    print(metrics.summary())
+    metrics.write(METRICS_DIR, "cv-" + time.strftime("%Y%m%d-%H%M%S"))
@@ -0,0 +1,251 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from src.config import *
+
+# 特徴量に使わない列（IDと、着順から分かる列）
+EXCLUDED_COLUMNS = [
+    COLUMN_RACE_ID,
+    COLUMN_DATE,
+    *ENTITY_ID_COLUMNS,
+    "着順",
+    "タイム",
+    "着差",
+]
+
+
+def relevance(rank: np.ndarray) -> np.ndarray:
+    """
+    着順をランキング学習の関連度に変換する（1着から順に`RANK_RELEVANCE`の値、それ以外は0）。
+    """
+    result = np.zeros(len(rank), dtype=np.float32)
+    for position, value in RANK_RELEVANCE.items():
+        result[rank == position] = value
+    return result
+
+
+class TrainingDataset:
+    FILES = {
+        "X": "X.npy",
+        "label": "label.npy",
+        "rank": "rank.npy",
+        "horse_id": "horse_id.npy",
+        "group_offsets": "group_offsets.npy",
+        "group_race_ids": "group_race_ids.npy",
+        "group_days": "group_days.npy",
+    }
+    META_FILE = "meta.json"
+
+    def __init__(self, dataset_dir: Path = TRAINING_DATASET_DIR):
+        """
+        `FEATURES_TABLE`から作る、学習用のバイナリのデータセット。
+
+        行は開催日・レースIDの順に並べ、同じレースの行が連続するようにする。
+        - `X.npy`: float32の特徴量行列（行×特徴量）。読み込み時はメモリマップで開く。
+        - `label.npy` / `rank.npy`: 関連度と着順。
+        - `horse_id.npy`: 馬IDのコード（予測したスコアをレース結果と結合するために使う）。
+        - `group_offsets.npy`: レース毎の先頭行（末尾に行数を加えた長さ`レース数+1`の配列）。
+        - `group_race_ids.npy` / `group_days.npy`: レース毎のレースIDと開催日（UNIX日数）。
+
+        `meta.json`には特徴量の列名と、作成元のテーブルの内容のハッシュ・コードのバージョンを
+        キーとして記録し、キーが変わらない限り`build`は作り直さずに既存のファイルを使う。
+
+        Args:
+            dataset_dir (Path, optional): データセットを保存するディレクトリ。
+        """
+        self.dataset_dir = Path(dataset_dir)
+        self.meta = None
+        self._arrays = {}
+
+    def path(self, name: str) -> Path:
+        return self.dataset_dir / self.FILES.get(name, name)
+
+    def _key(self, store: TableStore) -> str:
+        return feature_cache.key(
+            "training_dataset",
+            {FEATURES_TABLE: feature_cache.input_hash(store.path(FEATURES_TABLE))},
+            {"excluded": EXCLUDED_COLUMNS, "relevance": RANK_RELEVANCE},
+            code_version(TrainingDataset._write, relevance),
+        )
+
+    def _load_meta(self) -> dict:
+        meta_path = self.dataset_dir / self.META_FILE
+        if not meta_path.is_file():
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def build(self, store: TableStore = table_store, force: bool = False):
+        """
+        データセットが作成元のテーブルより古ければ作り直し、最新であれば何もしない。
+
+        Returns:
+            TrainingDataset: 自身。
+        """
+        key = self._key(store)
+        meta = self._load_meta()
+        if not force and meta is not None and meta["key"] == key:
+            logger.info(f"training dataset: reuse {self.dataset_dir}")
+            self.meta = meta
+            return self
+        start = time.perf_counter()
+        features = store.read(FEATURES_TABLE)
+        self._write(features, key)
+        logger.info(
+            f"training dataset: {self.meta['n_rows']} rows x "
+            f"{len(self.meta['features'])} features, {self.meta['n_groups']} races "
+            f"({time.perf_counter() - start:.1f}s)"
+        )
+        return self
+
+    def _write(self, features: pd.DataFrame, key: str):
+        """
+        特徴量のデータフレームをデータセットのファイルに書き出す。
+
+        特徴量行列はメモリマップで作成して列毎に書き込むため、float32に変換した
+        行列全体をメモリに持つことはない。書き込みは一時ディレクトリで行い、完了後に置き換える。
+        """
+        rank = pd.to_numeric(features["着順"], errors="coerce")
+        # 着順の無い行（取消・除外など）は学習に使わない
+        features = features[rank.notna()]
+        features = features.sort_values(
+            [COLUMN_DATE, COLUMN_RACE_ID], kind="stable"
+        ).reset_index(drop=True)
+        rank = pd.to_numeric(features["着順"]).to_numpy(dtype=np.float32)
+        columns = [
+            column
+            for column in features.columns
+            if column not in EXCLUDED_COLUMNS
+            and pd.api.types.is_numeric_dtype(features[column])
+            and not pd.api.types.is_bool_dtype(features[column])
+        ]
+
+        tmp_dir = self.dataset_dir.with_name(self.dataset_dir.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        X = np.lib.format.open_memmap(
+            tmp_dir / self.FILES["X"],
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(features), len(columns)),
+        )
+        for i, column in enumerate(columns):
+            X[:, i] = features[column].to_numpy(dtype=np.float32, na_value=np.nan)
+        X.flush()
+        del X
+
+        race_ids = features[COLUMN_RACE_ID].to_numpy(dtype=str)
+        starts = np.flatnonzero(np.r_[True, race_ids[1:] != race_ids[:-1]])
+        days = features[COLUMN_DATE].to_numpy("datetime64[D]").astype(np.int64)
+        np.save(tmp_dir / self.FILES["label"], relevance(rank))
+        np.save(tmp_dir / self.FILES["rank"], rank)
+        np.save(
+            tmp_dir / self.FILES["horse_id"],
+            features[COLUMN_HORSE_ID].to_numpy(dtype=np.int32),
+        )
+        np.save(
+            tmp_dir / self.FILES["group_offsets"],
+            np.r_[starts, len(features)].astype(np.int64),
+        )
+        np.save(tmp_dir / self.FILES["group_race_ids"], race_ids[starts])
+        np.save(tmp_dir / self.FILES["group_days"], days[starts])
+        meta = {
+            "key": key,
+            "features": columns,
+            "n_rows": len(features),
+            "n_groups": len(starts),
+            "created_at": time.time(),
+        }
+        with open(tmp_dir / self.META_FILE, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        shutil.rmtree(self.dataset_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.dataset_dir)
+        self.meta = meta
+        self._arrays = {}
+
+    def load(self, name: str) -> np.ndarray:
+        """
+        配列を読み込む。特徴量行列はメモリマップで開き、必要な部分だけが読み込まれる。
+        """
+        if self.meta is None:
+            self.meta = self._load_meta()
+            if self.meta is None:
+                raise FileNotFoundError(f"{self.dataset_dir}: dataset not built")
+        if name not in self._arrays:
+            mmap_mode = "r" if name == "X" else None
+            self._arrays[name] = np.load(self.path(name), mmap_mode=mmap_mode)
+        return self._arrays[name]
+
+    @property
+    def X(self) -> np.ndarray:
+        return self.load("X")
+
+    @property
+    def label(self) -> np.ndarray:
+        return self.load("label")
+
+    @property
+    def rank(self) -> np.ndarray:
+        return self.load("rank")
+
+    @property
+    def horse_id(self) -> np.ndarray:
+        return self.load("horse_id")
+
+    @property
+    def group_offsets(self) -> np.ndarray:
+        return self.load("group_offsets")
+
+    @property
+    def features(self) -> list:
+        self.load("group_offsets")
+        return self.meta["features"]
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.group_offsets) - 1
+
+    def group_sizes(self, groups: slice = None) -> np.ndarray:
+        """
+        レースの範囲（省略時はすべて）の、レース毎の行数を返す。
+        """
+        if groups is None:
+            groups = slice(0, self.n_groups)
+        return np.diff(self.group_offsets[groups.start : groups.stop + 1])
+
+    def groups_between(self, date_from=None, date_to=None) -> slice:
+        """
+        開催日が`date_from`以上`date_to`未満のレースの範囲を返す（行は日付順のため連続する）。
+        """
+        days = self.load("group_days")
+        start = 0
+        stop = len(days)
+        if date_from is not None:
+            start = np.searchsorted(days, _to_day(date_from), side="left")
+        if date_to is not None:
+            stop = np.searchsorted(days, _to_day(date_to), side="left")
+        return slice(int(start), int(stop))
+
+    def race_ids(self, groups: slice = None) -> np.ndarray:
+        """
+        レースの範囲（省略時はすべて）の、行毎のレースIDを返す。
+        """
+        if groups is None:
+            groups = slice(0, self.n_groups)
+        return np.repeat(self.load("group_race_ids")[groups], self.group_sizes(groups))
+
+    def rows(self, groups: slice) -> slice:
+        """
+        レースの範囲に対応する行の範囲を返す。
+        """
+        offsets = self.group_offsets
+        return slice(int(offsets[groups.start]), int(offsets[groups.stop]))
+
+
+def _to_day(date) -> int:
+    return int(np.datetime64(pd.Timestamp(date).date(), "D").astype(np.int64))
@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import pickle
+import time
+
+import numpy as np
+
+from src.config import *
+from src.metrics import peak_rss_bytes
+from src.training.dataset import TrainingDataset
+
+
+def binned_dataset(
+    dataset: TrainingDataset,
+    params: dict = TRAINING_DATASET_PARAMS,
+    bin_rows: slice = None,
+):
+    """
+    データセット全体をLightGBMのビン分割済みのデータセットとして返す。
+
+    ビン分割の結果は`lgb_[キー].bin`として保存し、データセット・ビン分割のパラメータ・
+    `bin_rows`が変わらない限り、次回からは特徴量行列を読み直さずにこのファイルを読み込む。
+    学習・検証に使う範囲は`subset`で切り出す（ビンの境界は全体で共通となる）。
+
+    Args:
+        dataset (TrainingDataset): 作成済みのデータセット。
+        params (dict, optional): ビン分割のパラメータ（`max_bin`など）。
+        bin_rows (slice, optional): ビンの境界を決めるのに使う行の範囲。省略時はすべての行。
+            時系列の検証では、検証する期間の分布が境界に入らないよう、最初の検証期間より前の
+            行を指定する（それ以降の行は、その境界でビン分割する）。
+
+    Returns:
+        lightgbm.Dataset: 構築済みのデータセット。
+    """
+    import lightgbm as lgb
+
+    digest = hashlib.sha256(
+        json.dumps(
+            {
+                "dataset": dataset.meta["key"],
+                "params": params,
+                "bin_rows": (
+                    None if bin_rows is None else [bin_rows.start, bin_rows.stop]
+                ),
+            },
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()[:12]
+    bin_path = dataset.dataset_dir / f"lgb_{digest}.bin"
+    params = {"verbose": -1, **params}
+    if bin_path.is_file():
+        logger.info(f"binned dataset: reuse {bin_path}")
+        return lgb.Dataset(str(bin_path), params=params).construct()
+    start = time.perf_counter()
+    reference = None
+    if bin_rows is not None:
+        # 指定した行だけでビンの境界を決め、全体のビン分割の基準とする
+        reference = lgb.Dataset(
+            dataset.X[bin_rows],
+            label=dataset.label[bin_rows],
+            feature_name=dataset.features,
+            params=params,
+            free_raw_data=True,
+        ).construct()
+    binned = lgb.Dataset(
+        dataset.X,
+        label=dataset.label,
+        group=dataset.group_sizes(),
+        feature_name=dataset.features,
+        params=params,
+        reference=reference,
+        free_raw_data=True,
+    ).construct()
+    binned.save_binary(str(bin_path))
+    logger.info(f"binned dataset: {bin_path} ({time.perf_counter() - start:.1f}s)")
+    return binned
+
+
+def subset(binned, dataset: TrainingDataset, groups: slice):
+    """
+    レースの範囲に対応する行を切り出し、レース毎の行数を設定したデータセットを返す。
+    """
+    rows = dataset.rows(groups)
+    part = binned.subset(np.arange(rows.start, rows.stop, dtype=np.int32))
+    part.set_group(dataset.group_sizes(groups))
+    return part
+
+
+def train_ranker(
+    dataset: TrainingDataset,
+    train_groups: slice,
+    valid_groups: slice = None,
+    params: dict = TRAINING_PARAMS,
+    num_boost_round: int = TRAINING_NUM_BOOST_ROUND,
+    early_stopping_rounds: int = TRAINING_EARLY_STOPPING_ROUNDS,
+    binned=None,
+):
+    """
+    指定したレースの範囲で、勾配ブースティングのランキングモデルを学習する。
+
+    Args:
+        dataset (TrainingDataset): 作成済みのデータセット。
+        train_groups (slice): 学習に使うレースの範囲。
+        valid_groups (slice, optional): 検証に使うレースの範囲。指定した場合は早期終了する。
+        params (dict, optional): LightGBMのパラメータ。
+        num_boost_round (int, optional): ブースティングの最大回数。
+        early_stopping_rounds (int, optional): 検証スコアが改善しなくなってから止めるまでの回数。
+        binned (lightgbm.Dataset, optional): `binned_dataset`の結果。省略時は読み込む。
+
+    Returns:
+        lightgbm.Booster: 学習済みのモデル。
+    """
+    import lightgbm as lgb
+
+    if binned is None:
+        binned = binned_dataset(dataset)
+    train_set = subset(binned, dataset, train_groups)
+    valid_sets = []
+    callbacks = [lgb.log_evaluation(period=0)]
+    if valid_groups is not None and valid_groups.stop > valid_groups.start:
+        valid_sets.append(subset(binned, dataset, valid_groups))
+        callbacks.append(lgb.early_stopping(early_stopping_rounds, verbose=False))
+    return lgb.train(
+        {"verbose": -1, **params},
+        train_set,
+        num_boost_round=num_boost_round,
+        valid_sets=valid_sets,
+        callbacks=callbacks,
+    )
+
+
+def save_model(booster, features: list, model_path: Path = MODEL_FILE):
+    """
+    予測サービスが読み込む形式（`{"model", "features"}`のpickle）でモデルを保存する。
+    """
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(model_path, "wb") as f:
+        pickle.dump({"model": booster, "features": list(features)}, f)
+
+
+def run(valid_from: str = None, rebuild: bool = False) -> dict:
+    """
+    データセットを用意してモデルを学習し、`MODEL_FILE`に保存する。
+
+    段階毎（データセット・ビン分割・学習）の経過時間と最大常駐メモリを`metrics`に記録する。
+
+    Args:
+        valid_from (str, optional): この日以降のレースを検証に使う。省略時は最後の
+            `TRAINING_VALID_FRACTION`の割合のレースを検証に使う。
+        rebuild (bool, optional): Trueの場合はデータセットを作り直す。
+
+    Returns:
+        dict: 学習の結果（レース数・反復回数・検証スコア・経過時間・最大常駐メモリ）。
+    """
+    start = time.perf_counter()
+    with metrics.stage("training_dataset"):
+        dataset = TrainingDataset().build(force=rebuild)
+    with metrics.stage("binned_dataset"):
+        binned = binned_dataset(dataset)
+    if valid_from is None:
+        split = int(dataset.n_groups * (1 - TRAINING_VALID_FRACTION))
+    else:
+        split = dataset.groups_between(date_from=valid_from).start
+    train_groups = slice(0, split)
+    valid_groups = slice(split, dataset.n_groups)
+    with metrics.stage("train"):
+        booster = train_ranker(dataset, train_groups, valid_groups, binned=binned)
+    save_model(booster, dataset.features)
+    best_score = {name: dict(scores) for name, scores in booster.best_score.items()}
+    return {
+        "train_races": train_groups.stop - train_groups.start,
+        "valid_races": valid_groups.stop - valid_groups.start,
+        "best_iteration": booster.best_iteration,
+        "best_score": best_score,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+if __name__ == "__main__":
+    """
+    ランキングモデルを学習する。
+
+    例:
+        python -m src.training.train
+        python -m src.training.train --valid-from 2024-10-01
+        python -m src.training.train --rebuild   # データセットを作り直す
+    """
+    parser = argparse.ArgumentParser(description="ランキングモデルの学習")
+    parser.add_argument("--valid-from", help="この日以降のレースを検証に使う")
+    parser.add_argument("--rebuild", action="store_true", help="データセットを作り直す")
+    args = parser.parse_args()
+
+    result = run(args.valid_from, args.rebuild)
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=float))
+    print(metrics.summary())
+    metrics.write(METRICS_DIR, "train-" + time.strftime("%Y%m%d-%H%M%S"))
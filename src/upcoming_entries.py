@@ -0,0 +1,70 @@
+import threading
+import time
+from pathlib import Path
+
+
+class UpcomingEntries:
+    def __init__(self, path: Path):
+        """
+        出走予定の馬の台帳。
+
+        予測サービスに予測を依頼された出走馬を`horse_id, race_date, added_at`のタブ区切りで
+        1行ずつ追記する。馬のページの再取得（`plan_horse_refresh`）は、開催日が過ぎていない
+        馬を出走予定の馬として最優先で取得する。
+
+        Args:
+            path (Path): 台帳ファイルのパス。
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def add(self, horse_id_list: list, race_date: str):
+        """
+        出走予定の馬を追記する。
+
+        Args:
+            horse_id_list (list): 馬IDのリスト。
+            race_date (str): 開催日（`YYYY-MM-DD`）。
+        """
+        added_at = time.time()
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(
+                    f"{horse_id}\t{race_date}\t{added_at}\n"
+                    for horse_id in horse_id_list
+                )
+
+    def create(self):
+        """
+        台帳が無ければ空のファイルを作る（既存の台帳の内容と更新時刻は変えない）。
+        """
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.touch()
+
+    def horse_ids(self, since: str) -> list:
+        """
+        開催日が`since`以降の馬IDを、追記した順に重複を除いて返す。
+
+        台帳は別のプロセス（予測サービス）が追記するため、呼び出す度に読み込む。
+        書き込み途中で中断された末尾の行は無視する。
+
+        Args:
+            since (str): この日（`YYYY-MM-DD`）以降に出走する馬を返す。
+
+        Returns:
+            list: 馬IDのリスト。
+        """
+        result = {}
+        if not self.path.is_file():
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                horse_id, race_date, _ = line.rstrip("\n").split("\t")
+                # 日付は`YYYY-MM-DD`のため、文字列の比較で前後を判定できる
+                if race_date >= since:
+                    result[horse_id] = None
+        return list(result)
@@ -0,0 +1,112 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from src.fetch_engine import FetchEngine
+from src.preprocessing.modules.scrape_race_id_list import (
+    parse_race_id_list,
+    scrape_race_id_list,
+)
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures" / "race_list_sub"
+
+
+class RaceListHandler(BaseHTTPRequestHandler):
+    """
+    保存したレース一覧の断片HTML（`fixtures/race_list_sub/[開催日].html`）を返す代替サーバー。
+
+    `fail_once`に含まれる開催日は、最初の1回だけ500を返す。
+    """
+
+    fail_once = set()
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        kaisai_date = parse_qs(urlparse(self.path).query)["kaisai_date"][0]
+        self.requests.append(kaisai_date)
+        path = FIXTURE_DIR / f"{kaisai_date}.html"
+        if kaisai_date in self.fail_once:
+            self.fail_once.discard(kaisai_date)
+            status, body = 500, b""
+        elif path.is_file():
+            status, body = 200, path.read_bytes()
+        else:
+            status, body = 404, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ScrapeRaceIdListHttpTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RaceListHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url_template = (
+            f"http://127.0.0.1:{cls.server.server_port}"
+            "/top/race_list_sub.html?kaisai_date={kaisai_date}"
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        RaceListHandler.fail_once = set()
+        RaceListHandler.requests = []
+        # エンジン内のリトライは行わず、開催日毎のリトライだけを確認する
+        self.engine = FetchEngine(
+            max_workers=2, rate_per_second=1000, burst=10, max_retries=0
+        )
+
+    def tearDown(self):
+        self.engine.close()
+
+    def scrape(self, kaisai_date_list, max_retries=1):
+        return scrape_race_id_list(
+            kaisai_date_list,
+            mode="http",
+            url_template=self.url_template,
+            max_retries=max_retries,
+            selenium_fallback=False,
+            engine=self.engine,
+        )
+
+    def test_parse_fixture(self):
+        html = (FIXTURE_DIR / "20240106.html").read_bytes()
+        self.assertEqual(
+            parse_race_id_list(html),
+            ["202406010101", "202406010102", "202408010101"],
+        )
+
+    def test_scrape_keeps_date_order(self):
+        race_id_list = self.scrape(["20240106"])
+        self.assertEqual(race_id_list, ["202406010101", "202406010102", "202408010101"])
+
+    def test_failed_dates_do_not_abort_run(self):
+        # 20240107はレースIDが無く、20240108は404となるが、20240106の結果は返す
+        race_id_list = self.scrape(["20240107", "20240106", "20240108"])
+        self.assertEqual(race_id_list, ["202406010101", "202406010102", "202408010101"])
+        # 失敗した開催日だけを取得し直す
+        self.assertEqual(
+            sorted(RaceListHandler.requests),
+            ["20240106", "20240107", "20240107", "20240108", "20240108"],
+        )
+
+    def test_retry_recovers_failed_date(self):
+        RaceListHandler.fail_once = {"20240106"}
+        race_id_list = self.scrape(["20240106"], max_retries=1)
+        self.assertEqual(len(race_id_list), 3)
+        self.assertEqual(RaceListHandler.requests, ["20240106", "20240106"])
+
+
+if __name__ == "__main__":
+    unittest.main()